@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Benchmark of the startup of the 'Sensor' script: time to the first response.
+# Version 2
+#
+"""
+    Time to first response.
+
+    The Sensor script is started (main(), like after a reset) while a 'Main'
+    device sends a 'date_time' request every poll seconds, each with a
+    timeout of timeout seconds, until one gets a reply. For each case it reports:
+
+        first_ack_s     from the start of the Sensor script until it sent the first ACK
+        first_reply_s   from the start of the Sensor script until the Main had the first reply
+        pending_s       from the start of the Sensor script until the first PEND frame, when the
+                        Sensor deferred the reply (see use_deferred of the Sensor script)
+        requests        requests the Main sent until then
+
+    Cases: use_fast_start off and on, with the built-in RTC of the Sensor at its
+    power-up time, or still running (a reset that is not a power cycle).
+    WiFi connects take --wifi-delay seconds, a scan of the access points
+    --scan-delay seconds (see sim_board).
+
+    Usage (from the folder Examples/Version_02/Host):
+
+        python3 bench_boot.py
+        python3 bench_boot.py --wifi-delay 8 --json boot.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from sim_uart import SimClock, make_pair
+from sim_board import Device
+from bench_link import transact
+
+CASES = (
+    ('slow', False, False),
+    ('slow', False, True),
+    ('fast', True, False),
+    ('fast', True, True),
+)
+
+def bench_boot(fast, rtc_running, wifi_delay, scan_delay, speed, poll, timeout, max_wait):
+    clock = SimClock(speed)
+    u_main, u_sensor = make_pair(clock)
+    sensor = Device('Sensor', 'unexpectedmaker_pros3', u_sensor, clock, echo=False)
+    sensor.wifi_delay = wifi_delay
+    sensor.scan_delay = scan_delay
+    main_dev = Device('Main', 'pyportal_titano', u_main, clock, echo=False)
+    g = main_dev.load()
+    g['use_nvm'] = False
+    g['setup']()
+
+    def entry(sg):
+        sg['use_fast_start'] = fast
+        sg['use_time_bcast'] = False
+        if rtc_running:
+            sensor.rtc.datetime = time.gmtime(clock.utc())
+        sg['main']()
+
+    node = {'ads': 0x25, 'req': 100, 'timeout': timeout, 'fails': 0, 'pend_end': 0.0}
+    n_req = 0
+    t_reply = None
+    t_pend = None
+    try:
+        t0 = clock.monotonic()
+        sensor.start(entry)
+        while clock.monotonic() - t0 < max_wait:
+            res, _ = transact(g, node, clock)
+            n_req += 1
+            if res == 1 and g['pend']:
+                t_pend = clock.monotonic() - t0
+                while g['pend'] and clock.monotonic() - t0 < max_wait:
+                    clock.sleep(0.01)
+                    g['listen']()  # the deferred reply
+                if node['fails']:
+                    continue  # it did not arrive in time
+            if res == 1:
+                t_reply = clock.monotonic() - t0
+                break
+            if res == -1:
+                break
+            clock.sleep(poll)
+    finally:
+        sensor.stop()
+        main_dev.stop()
+    sg = sensor.globals or {}
+    return {
+        'mode': 'fast' if fast else 'slow',
+        'rtc': 'running' if rtc_running else 'power-up',
+        'wifi_delay_s': wifi_delay,
+        'scan_delay_s': scan_delay,
+        'first_ack_s': sg.get('t_first', None),
+        'first_reply_s': t_reply,
+        'pending_s': t_pend,
+        'requests': n_req,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Time from the start of the Sensor script to its first response")
+    ap.add_argument('--wifi-delay', type=float, default=3.0, help="seconds a WiFi connect takes")
+    ap.add_argument('--scan-delay', type=float, default=2.5, help="seconds a scan of the access points takes")
+    ap.add_argument('--poll', type=float, default=0.2, help="seconds between two requests of the Main")
+    ap.add_argument('--timeout', type=float, default=2.0, help="timeout of the Main per request (s)")
+    ap.add_argument('--max-wait', type=float, default=60.0, help="give up after this many seconds")
+    ap.add_argument('--speed', type=float, default=2.0, help="simulated seconds per real second")
+    ap.add_argument('--json', default=None, help="write the results as JSON to this file ('-': stdout)")
+    args = ap.parse_args()
+
+    results = []
+    for _, fast, rtc_running in CASES:
+        results.append(bench_boot(fast, rtc_running, args.wifi_delay, args.scan_delay, args.speed, args.poll,
+                                  args.timeout, args.max_wait))
+    report = {
+        'suite': 'sercom_boot',
+        'python': platform.python_version(),
+        'speed': args.speed,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return 0
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    print("{:5s} {:9s} {:>10s} {:>10s} {:>11s} {:>9s}".format('mode', 'rtc', 'first ACK', 'pending', 'first reply', 'requests'))
+    for r in results:
+        print("{:5s} {:9s} {:>10s} {:>10s} {:>11s} {:9d}".format(
+            r['mode'], r['rtc'],
+            '-' if r['first_ack_s'] is None else "{:.2f} s".format(r['first_ack_s']),
+            '-' if r['pending_s'] is None else "{:.2f} s".format(r['pending_s']),
+            '-' if r['first_reply_s'] is None else "{:.2f} s".format(r['first_reply_s']),
+            r['requests']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
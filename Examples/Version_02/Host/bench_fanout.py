@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Benchmark of the 'Sensor' script with several displays asking the same data.
+# Version 2
+#
+"""
+    Fan-out.
+
+    n displays (addresses 0x30, 0x31, ...) share the line to the Sensor. Each round
+    they all send the same request (--req) at the same moment, then wait for the
+    replies. For each number of displays, with the coalescing of the Sensor on
+    (req_coalesce) and off, it reports:
+
+        replies     replies received / requests sent
+        handler     runs of the request handlers of the Sensor (its loop_nr)
+        coalesced   requests answered with the reply to an identical request (n_coalesced)
+        ntp         NTP syncs of the Sensor (upstream load)
+        p50/p99     from the request until its reply (simulated ms)
+
+    The Sensor starts with its built-in RTC at its power-up time, so the first
+    'date_time' requests need the network (see use_deferred of the Sensor script).
+
+    Usage (from the folder Examples/Version_02/Host):
+
+        python3 bench_fanout.py
+        python3 bench_fanout.py --displays 1 4 8 --rounds 20 --req 101
+"""
+import argparse
+import sys
+
+from sim_uart import SimClock, make_pair
+from sim_board import Device
+from bench_link import percentile
+from replay_trace import frames
+
+STX = 0x02
+ADS_SENSOR = 0x25
+ADS_FIRST = 0x30
+
+def frame(dst, src, code, seq):
+    buf = bytearray((dst, src, 0, STX, code, seq))
+    buf.append(sum(buf) & 0xFF)
+    return bytes(buf)
+
+def bench_fanout(n_disp, coalesce, req, rounds, interval, timeout, wifi_delay, speed):
+    clock = SimClock(speed)
+    u_disp, u_sensor = make_pair(clock)
+    sensor = Device('Sensor', 'unexpectedmaker_pros3', u_sensor, clock, echo=False)
+    sensor.wifi_delay = wifi_delay
+
+    def entry(sg):
+        sg['use_time_bcast'] = False
+        sg['net_delay'] = 0.0
+        if not coalesce:
+            sg['req_coalesce'] = ()
+        sg['setup']()
+        sg['loop']()
+
+    lat = []
+    n_sent = 0
+    n_rcvd = 0
+    try:
+        sensor.start(entry)
+        clock.sleep(1.0)
+        for r in range(rounds):
+            seq = r & 0xFF
+            t0 = clock.monotonic()
+            u_disp.write(b''.join(frame(ADS_SENSOR, ADS_FIRST + k, req, seq) for k in range(n_disp)))
+            n_sent += n_disp
+            waiting = set(range(n_disp))
+            rx = bytearray()
+            while waiting and clock.monotonic() - t0 < timeout:
+                clock.sleep(0.005)
+                if not u_disp.in_waiting:
+                    continue
+                rx += u_disp.read()
+                for dst, src, code, s in frames(rx):  # all the frames of this round so far
+                    k = dst - ADS_FIRST
+                    if code == req and s == seq and k in waiting:
+                        waiting.discard(k)
+                        lat.append(clock.monotonic() - t0)
+                        n_rcvd += 1
+            clock.sleep(interval)
+    finally:
+        sensor.stop()
+    sg = sensor.globals or {}
+    return {
+        'displays': n_disp,
+        'coalesce': coalesce,
+        'sent': n_sent,
+        'replies': n_rcvd,
+        'handler': sg.get('loop_nr', 0),
+        'coalesced': sg.get('n_coalesced', 0),
+        'ntp': sg.get('ntp_stats', {}).get('syncs', 0),
+        'p50_ms': (percentile(lat, 50) or 0.0) * 1000,
+        'p99_ms': (percentile(lat, 99) or 0.0) * 1000,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Several displays asking the Sensor the same data")
+    ap.add_argument('--displays', type=int, nargs='+', default=[1, 2, 4, 6], help="numbers of displays")
+    ap.add_argument('--req', type=int, default=100, help="request code (100: date_time, 101: unix_time)")
+    ap.add_argument('--rounds', type=int, default=10, help="requests per display")
+    ap.add_argument('--interval', type=float, default=1.0, help="seconds between two rounds")
+    ap.add_argument('--timeout', type=float, default=12.0, help="seconds a display waits for its reply")
+    ap.add_argument('--wifi-delay', type=float, default=2.0, help="seconds a WiFi connect takes")
+    ap.add_argument('--speed', type=float, default=4.0, help="simulated seconds per real second")
+    args = ap.parse_args()
+
+    print("{:>8s} {:>8s} {:>9s} {:>8s} {:>10s} {:>4s} {:>9s} {:>9s}".format(
+        'displays', 'coalesce', 'replies', 'handler', 'coalesced', 'ntp', 'p50', 'p99'))
+    for n in args.displays:
+        for coalesce in (False, True):
+            r = bench_fanout(n, coalesce, args.req, args.rounds, args.interval, args.timeout,
+                             args.wifi_delay, args.speed)
+            print("{:8d} {:>8s} {:>9s} {:8d} {:10d} {:4d} {:6.0f} ms {:6.0f} ms".format(
+                r['displays'], 'on' if coalesce else 'off', "{}/{}".format(r['replies'], r['sent']),
+                r['handler'], r['coalesced'], r['ntp'], r['p50_ms'], r['p99_ms']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Benchmark of the built-in RTC of the 'Sensor' script while NTP does not answer.
+# Version 2
+#
+"""
+    RTC holdover.
+
+    The built-in RTC of the Sensor runs --ppm fast (see sim_board, rtc_ppm).
+    NTP answers during --learn hours, then stops answering for --hold hours.
+    With --wifi-drop the WiFi drops too, and does not connect again.
+    The Sensor broadcasts the datetime every minute, with the error bound of
+    its RTC (see dt_payload() of the Sensor script). With the drift correction
+    of the Sensor (use_drift) on and off, it reports:
+
+        syncs       NTP syncs while NTP answered
+        drift       drift of the RTC estimated by the Sensor (ppm)
+        err         error of the RTC at the end (ms), and the largest during the holdover
+        bound       error bound in the last broadcast (ms)
+        over        broadcasts of which the error bound was less than the error of the RTC
+        resets      resets of the Sensor (a reset loses the drift learned)
+
+    The simulation runs at a fixed SPEED (simulated seconds per real second). At a
+    higher speed the sleeps of the simulated Sensor overshoot by many ms, which
+    spoils the offsets measured on the second boundaries of its RTC, so the drift
+    estimate and the error bound are no longer valid.
+
+    Usage (from the folder Examples/Version_02/Host):
+
+        python3 bench_holdover.py
+        python3 bench_holdover.py --ppm -30 --learn 6 --hold 12 --wifi-drop
+"""
+import argparse
+import sys
+
+from sim_uart import SimClock, make_pair
+from sim_board import Device
+
+STX = 0x02
+BCAST = 0xFF
+ERR_UNKNOWN = 0xFFFF
+SPEED = 400.0  # simulated seconds per real second. See above
+
+def bcasts(data):
+    """The error bounds (ms) in the datetime broadcasts (code 110) in data, and the bytes not parsed."""
+    res = []
+    i = 0
+    while i + 7 <= len(data):
+        n = data[i + 2]
+        if data[i + 3] != STX:
+            i += 1
+            continue
+        end = i + n + 7
+        if end > len(data):
+            break
+        if sum(data[i:end - 1]) & 0xFF != data[end - 1]:
+            i += 1
+            continue
+        if data[i] == BCAST and data[i + 4] == 110 and n == 21:
+            res.append((data[i + 25] << 8) | data[i + 26])
+        i = end
+    return res, data[i:]
+
+def bench_holdover(drift, ppm, learn, hold, wifi_drop, speed=SPEED):
+    clock = SimClock(speed)
+    u_disp, u_sensor = make_pair(clock)
+    sensor = Device('Sensor', 'unexpectedmaker_pros3', u_sensor, clock, echo=False)
+    sensor.rtc_ppm = ppm
+
+    def entry(sg):
+        sg['use_drift'] = drift
+        sg['net_delay'] = 0.0
+        sg['setup']()
+        sg['loop']()
+
+    tz = [0]  # tz_offset of the Sensor, kept over a reset of the Sensor (its globals are new)
+
+    def rtc_err():
+        tz[0] = sensor.globals.get('tz_offset', tz[0])
+        return (sensor.rtc.exact() - clock.utc() - tz[0] * 3600) * 1000
+
+    rx = b''
+    syncs = 0
+    err_max = 0.0
+    bound = None
+    n_over = 0
+    try:
+        sensor.start(entry)
+        t0 = clock.monotonic()
+        while True:
+            clock.sleep(10)
+            now = clock.monotonic() - t0
+            if sensor.ntp_ok and now > learn * 3600:
+                sensor.ntp_ok = False
+                if wifi_drop:
+                    sensor.wifi_ok = False
+                    sensor.radio.ipv4_address = None
+                syncs = sensor.globals['ntp_stats']['syncs']
+            if now > (learn + hold) * 3600:
+                break
+            if u_disp.in_waiting:
+                res, rx = bcasts(rx + u_disp.read())
+                err = abs(rtc_err())
+                for b in res:
+                    bound = None if b == ERR_UNKNOWN else b
+                    if bound is not None and err > bound:
+                        n_over += 1
+                if not sensor.ntp_ok and err > err_max:
+                    err_max = err
+        err = rtc_err()
+        sg = sensor.globals
+    finally:
+        sensor.stop()
+    return {
+        'drift': drift,
+        'syncs': syncs,
+        'drift_ppm': sg.get('drift_ppm', 0.0),
+        'drift_dev': sg.get('drift_dev', 0.0),
+        'err_ms': err,
+        'err_max_ms': err_max,
+        'bound_ms': bound,
+        'over': n_over,
+        'resets': sensor.resets,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Error of the RTC of the Sensor while NTP does not answer")
+    ap.add_argument('--ppm', type=float, default=40.0, help="frequency error of the RTC of the Sensor (ppm)")
+    ap.add_argument('--learn', type=float, default=4.0, help="hours NTP answers")
+    ap.add_argument('--hold', type=float, default=8.0, help="hours NTP does not answer, after that")
+    ap.add_argument('--wifi-drop', action='store_true', help="the WiFi drops too when NTP stops answering")
+    args = ap.parse_args()
+
+    print("RTC {:+.1f} ppm, NTP {:.1f} h, then no {} {:.1f} h".format(
+        args.ppm, args.learn, 'WiFi' if args.wifi_drop else 'NTP', args.hold))
+    print("{:>5s} {:>6s} {:>17s} {:>9s} {:>9s} {:>9s} {:>5s} {:>6s}".format(
+        'drift', 'syncs', 'drift est.', 'err', 'err max', 'bound', 'over', 'resets'))
+    for drift in (False, True):
+        r = bench_holdover(drift, args.ppm, args.learn, args.hold, args.wifi_drop)
+        print("{:>5s} {:6d} {:+7.2f} +- {:5.2f} {:6.0f} ms {:6.0f} ms {:>9s} {:5d} {:6d}".format(
+            'on' if drift else 'off', r['syncs'], r['drift_ppm'], r['drift_dev'], r['err_ms'],
+            r['err_max_ms'], '-' if r['bound_ms'] is None else "{} ms".format(r['bound_ms']), r['over'],
+            r['resets']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Benchmark of the request/response path over the simulated UART line.
+# Version 2
+#
+"""
+    Link benchmark.
+
+    For each baudrate a 'Main' and a 'Sensor' device are connected by a
+    simulated line (see sim_uart). The Sensor runs its loop() (ck_uart() ->
+    send_dt()); the benchmark calls send_req() and ck_uart() of the Main,
+    like poll_nodes() does, and measures per request:
+
+        latency     from send_req() until ck_uart() handled the reply (simulated ms)
+        goodput     payload bytes of the replies per second
+        wire        bytes on the line (both directions) per request
+        allocations CPython proxy of the heap use per request of both scripts:
+                    the peak of memory allocated (tracemalloc, bytes) and the
+                    net nr of memory blocks still allocated after the request.
+                    Measured in a separate pass, as tracing slows down the scripts.
+
+    The NTP sync and the datetime broadcasts of the Sensor are switched off,
+    so only the link is measured. With --log-level warning the scripts do not
+    format their INFO lines, which is most of what they allocate per request. Run with speed 1 (the default): the time
+    the scripts spend executing is part of the latency.
+
+    Usage (from the folder Examples/Version_02/Host):
+
+        python3 bench_link.py
+        python3 bench_link.py --n 200 --baud 9600 --json bench.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from sim_uart import SimClock, make_pair
+from sim_board import Device
+
+BAUDRATES = (4800, 9600, 115200)
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers, p in 0..100."""
+    if not values:
+        return None
+    v = sorted(values)
+    k = max(0, min(len(v) - 1, int(round(p / 100.0 * len(v) + 0.5)) - 1))
+    return v[k]
+
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}  # see lib/sercom_log.py
+
+def _sensor_entry(g, log_level=None):
+    g['use_ntp'] = False
+    g['use_time_bcast'] = False
+    if log_level is not None:
+        g['log'].set_level(log_level)
+    g['setup']()
+    g['loop']()
+
+"""
+    Function start_link()
+
+    :param  SimClock clock, int baudrate, float loss, float corrupt, int seed, int log_level of both scripts,
+            noise (see sim_uart.Line)
+    :return tuple (Device main, dict globals of the Main script, Device sensor)
+"""
+def start_link(clock, baudrate, loss=0.0, corrupt=0.0, seed=None, log_level=None, **noise):
+    u_main, u_sensor = make_pair(clock, loss, corrupt, seed, baudrate, **noise)
+    sensor = Device('Sensor', 'unexpectedmaker_pros3', u_sensor, clock, echo=False)
+    main_dev = Device('Main', 'pyportal_titano', u_main, clock, echo=False)
+    g = main_dev.load()
+    if log_level is not None:
+        g['log'].set_level(log_level)
+    g['setup']()
+    sensor.start(lambda sg: _sensor_entry(sg, log_level))
+    return main_dev, g, sensor
+
+"""
+    Function transact()
+
+    :param  dict g, globals of the Main script; dict node
+    :return tuple (int result of ck_uart(), float latency in simulated seconds)
+"""
+def transact(g, node, clock):
+    t0 = clock.monotonic()
+    g['send_req'](node['ads'], node['req'], node.get('payload', None))
+    res = g['ck_uart'](node, g['seq_nr'])
+    return res, clock.monotonic() - t0
+
+def bench_baudrate(baudrate, n, n_alloc, req, timeout, speed, loss=0.0, corrupt=0.0, seed=None, warmup=2, log_level=None):
+    clock = SimClock(speed)
+    main_dev, g, sensor = start_link(clock, baudrate, loss, corrupt, seed, log_level)
+    node = {'ads': 0x25, 'req': req, 'timeout': timeout}
+    try:
+        for _ in range(warmup):
+            transact(g, node, clock)
+        line_a, line_b = main_dev.uart.tx_line, sensor.uart.tx_line
+        wire0 = line_a.n_sent + line_b.n_sent
+        lat = []
+        n_ok = 0
+        n_payload = 0
+        t_start = clock.monotonic()
+        for _ in range(n):
+            res, dt = transact(g, node, clock)
+            if res == 1:
+                n_ok += 1
+                n_payload += g['parser'].payload_len
+                lat.append(dt)
+            elif res == -1:
+                break
+        t_total = clock.monotonic() - t_start
+        wire = line_a.n_sent + line_b.n_sent - wire0
+
+        peaks = []
+        blocks = []
+        if n_alloc:
+            tracemalloc.start()
+            for _ in range(n_alloc):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                b0 = sys.getallocatedblocks()
+                transact(g, node, clock)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+                blocks.append(sys.getallocatedblocks() - b0)
+            tracemalloc.stop()
+    finally:
+        sensor.stop()
+        main_dev.stop()
+    ms = [x * 1000 for x in lat]
+    return {
+        'baudrate': baudrate,
+        'n': n,
+        'ok': n_ok,
+        'timeouts': n - n_ok,
+        'p50_ms': percentile(ms, 50),
+        'p99_ms': percentile(ms, 99),
+        'mean_ms': sum(ms) / len(ms) if ms else None,
+        'max_ms': max(ms) if ms else None,
+        'goodput_Bps': n_payload / t_total if t_total > 0 else 0.0,
+        'wire_bytes_per_req': wire / n if n else 0,
+        'wire_time_ms_per_req': (wire / n) * 10 * 1000 / baudrate if n else 0,
+        'alloc_peak_bytes_p50': percentile(peaks, 50),
+        'alloc_peak_bytes_max': max(peaks) if peaks else None,
+        'alloc_net_blocks_p50': percentile(blocks, 50),
+        'overruns': main_dev.uart.overruns + sensor.uart.overruns,
+        'pool_low': min(g['frame_pool'].low, sensor.globals['frame_pool'].low) if sensor.globals else None,
+        'pool_exhausted': g['frame_pool'].n_exhausted + (sensor.globals['frame_pool'].n_exhausted if sensor.globals else 0),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Round-trip latency, goodput and allocations of the sercom link")
+    ap.add_argument('--n', type=int, default=50, help="requests per baudrate")
+    ap.add_argument('--n-alloc', type=int, default=10, help="requests per baudrate of the allocation pass (0: skip)")
+    ap.add_argument('--baud', type=int, action='append', help="baudrate (repeat for several). Default: 4800, 9600, 115200")
+    ap.add_argument('--req', type=int, default=100, help="request code (default 100: date_time)")
+    ap.add_argument('--timeout', type=float, default=2.0, help="timeout of the Main per request (s)")
+    ap.add_argument('--speed', type=float, default=1.0, help="simulated seconds per real second")
+    ap.add_argument('--log-level', choices=sorted(LOG_LEVELS), default=None, help="log level of both scripts (default: theirs)")
+    ap.add_argument('--json', default=None, help="write the results as JSON to this file ('-': stdout)")
+    args = ap.parse_args()
+
+    results = []
+    for baud in args.baud or BAUDRATES:
+        results.append(bench_baudrate(baud, args.n, args.n_alloc, args.req, args.timeout, args.speed,
+                                      log_level=LOG_LEVELS.get(args.log_level, None)))
+    report = {
+        'suite': 'sercom_link',
+        'python': platform.python_version(),
+        'request': args.req,
+        'log_level': args.log_level,
+        'speed': args.speed,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return 0
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    print("{:>7s} {:>5s} {:>9s} {:>9s} {:>10s} {:>9s} {:>11s} {:>7s}".format(
+        'baud', 'ok', 'p50 ms', 'p99 ms', 'goodput', 'wire B', 'alloc peak', 'blocks'))
+    for r in results:
+        print("{:7d} {:5d} {:9.1f} {:9.1f} {:8.1f}/s {:9.1f} {:11} {:7}".format(
+            r['baudrate'], r['ok'], r['p50_ms'] or 0, r['p99_ms'] or 0, r['goodput_Bps'],
+            r['wire_bytes_per_req'], '-' if r['alloc_peak_bytes_p50'] is None else r['alloc_peak_bytes_p50'],
+            '-' if r['alloc_net_blocks_p50'] is None else r['alloc_net_blocks_p50']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Benchmark of the request/response path over a noisy simulated UART line.
+# Version 2
+#
+"""
+    Goodput under noise.
+
+    For each noise profile (see PROFILES and sim_uart.Line) and each protocol
+    variant (see VARIANTS) the Main sends requests back-to-back during
+    duration simulated seconds, like bench_link does. It reports:
+
+        tx_per_min      successful transactions per minute
+        success         successful transactions / transactions
+        bad_accepted    replies that passed the checksum but differ from what the Sensor sent
+        lat_p50, lat_p99  duration of the successful transactions, retransmissions included
+        recovery_s      time from the start of the first failed transaction of a run
+                        of failures until the end of the next successful one (mean, max)
+        bad_frames      frames dropped by the parsers of both devices (bad STX, length, checksum)
+        served          requests the Sensor handled (did the work for)
+        cache_hits      retransmitted requests the Sensor answered from its reply cache (see replies)
+
+    Usage (from the folder Examples/Version_02/Host):
+
+        python3 bench_noise.py
+        python3 bench_noise.py --profile ber_1e-3 --profile burst --duration 120 --json noise.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from sim_uart import SimClock
+from bench_link import percentile, start_link, transact
+
+PROFILES = {
+    'clean': {},
+    'ber_1e-4': {'ber': 1e-4},
+    'ber_1e-3': {'ber': 1e-3},
+    'drop_1%': {'loss': 0.01},
+    'dup_1%': {'dup': 0.01},
+    'burst': {'burst': 0.002, 'burst_len': 8},
+}
+
+# Protocol variants: the node polled by the Main (see poll_nodes() of the Main script)
+VARIANTS = {
+    'date_time_t2.0': {'ads': 0x25, 'req': 100, 'timeout': 2.0, 'retries': 0},
+    'date_time_t0.5': {'ads': 0x25, 'req': 100, 'timeout': 0.5, 'retries': 0},
+    'date_time_retry': {'ads': 0x25, 'req': 100, 'timeout': 2.0, 'retries': 3},
+}
+
+def bench_case(profile, node, baudrate, duration, speed, seed):
+    clock = SimClock(speed)
+    main_dev, g, sensor = start_link(clock, baudrate, seed=seed, **PROFILES[profile])
+    node = dict(node)
+    n_tx = 0
+    n_ok = 0
+    n_bad_acc = 0
+    recovery = []
+    lat = []
+    t_fail = None  # start of the first failed transaction of the current run of failures
+    try:
+        t_start = clock.monotonic()
+        while clock.monotonic() - t_start < duration:
+            t0 = clock.monotonic()
+            res, dt = transact(g, node, clock)
+            if res == -1:
+                break
+            n_tx += 1
+            ok = res == 1
+            if ok and node['req'] == 100 and sensor.globals is not None:
+                # the datetime string, without the error bound behind it
+                if bytes(g['parser'].payload()[:19]) != sensor.globals['default_s_dt'].encode():
+                    n_bad_acc += 1
+                    ok = False
+            if ok:
+                n_ok += 1
+                lat.append(dt)
+                if t_fail is not None:
+                    recovery.append(t0 + dt - t_fail)
+                    t_fail = None
+            elif t_fail is None:
+                t_fail = t0
+        t_total = clock.monotonic() - t_start
+    finally:
+        sensor.stop()
+        main_dev.stop()
+    sg = sensor.globals or {}
+    bad_frames = g['parser'].n_bad + (sg['parser'].n_bad if sg else 0)
+    return {
+        'profile': profile,
+        'noise': PROFILES[profile],
+        'baudrate': baudrate,
+        'duration_s': t_total,
+        'transactions': n_tx,
+        'tx_per_min': n_ok * 60.0 / t_total if t_total > 0 else 0.0,
+        'success': n_ok / n_tx if n_tx else 0.0,
+        'bad_accepted': n_bad_acc,
+        'lat_s_p50': percentile(lat, 50),
+        'lat_s_p99': percentile(lat, 99),
+        'recoveries': len(recovery),
+        'recovery_s_mean': sum(recovery) / len(recovery) if recovery else None,
+        'recovery_s_max': max(recovery) if recovery else None,
+        'bad_frames': bad_frames,
+        'served': sg.get('loop_nr', None),
+        'cache_hits': sg['replies'].n_hits if 'replies' in sg else None,
+        'overruns': main_dev.uart.overruns + sensor.uart.overruns,
+        'line_to_sensor': main_dev.uart.tx_line.stats(),
+        'line_to_main': sensor.uart.tx_line.stats(),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Goodput and recovery of the sercom link under noise")
+    ap.add_argument('--profile', action='append', choices=sorted(PROFILES), help="noise profile (repeat for several). Default: all")
+    ap.add_argument('--variant', action='append', choices=sorted(VARIANTS), help="protocol variant (repeat for several). Default: all")
+    ap.add_argument('--baud', type=int, default=4800)
+    ap.add_argument('--duration', type=float, default=60.0, help="simulated seconds per case")
+    ap.add_argument('--speed', type=float, default=4.0, help="simulated seconds per real second")
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--json', default=None, help="write the results as JSON to this file ('-': stdout)")
+    args = ap.parse_args()
+
+    results = []
+    for variant in args.variant or sorted(VARIANTS):
+        for profile in args.profile or list(PROFILES):
+            r = bench_case(profile, VARIANTS[variant], args.baud, args.duration, args.speed, args.seed)
+            r['variant'] = variant
+            results.append(r)
+    report = {
+        'suite': 'sercom_noise',
+        'python': platform.python_version(),
+        'speed': args.speed,
+        'seed': args.seed,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return 0
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    print("{:16s} {:10s} {:>7s} {:>8s} {:>8s} {:>8s} {:>7s} {:>7s} {:>9s} {:>9s} {:>6s} {:>6s} {:>6s}".format(
+        'variant', 'profile', 'tx/min', 'success', 'bad acc', 'bad frm', 'p50 s', 'p99 s', 'recov s', 'recov max',
+        'tx', 'served', 'hits'))
+    for r in results:
+        print("{:16s} {:10s} {:7.1f} {:8.3f} {:8d} {:8d} {:7.2f} {:7.2f} {:9.2f} {:9.2f} {:6d} {:>6s} {:>6s}".format(
+            r['variant'], r['profile'], r['tx_per_min'], r['success'], r['bad_accepted'], r['bad_frames'],
+            r['lat_s_p50'] or 0.0, r['lat_s_p99'] or 0.0, r['recovery_s_mean'] or 0.0, r['recovery_s_max'] or 0.0,
+            r['transactions'], '-' if r['served'] is None else str(r['served']),
+            '-' if r['cache_hits'] is None else str(r['cache_hits'])))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Replay of a link trace (see lib/sercom_trace.py) into the script of the role that recorded it.
+# Version 2
+#
+"""
+    Trace replay.
+
+    A trace recorded by one device (a trace file, or the REPL output with the
+    'TRC:' lines) is replayed into the code.py of the same role, running on a
+    simulated device (see sim_board): the bytes that device received are fed
+    to its UART at the recorded times, scaled by --speed (2: twice as fast).
+    The recorded time 0 is the first use of the UART by the script.
+    The broadcasts and pushes follow the built-in RTC: the true time of the replay
+    (SimClock.utc(), that its NTP server stand-in answers) is set from the last
+    datetime broadcast or push in the trace, so they are sent when they were recorded.
+
+    Afterwards the frames the script sent are compared with the recorded ones
+    (destination, source, code and sequence number; broadcast and pushed frames
+    depend on the timers of the script and are not compared) and the response times
+    of the recording and of the replay are printed. A response time runs from the
+    end of a frame received until the end of the first frame sent back to its source
+    with its sequence number (ACK, NAK, PEND or the reply).
+    With --max-p99-ms and --strict the exit code is 1 if the replay is slower, or
+    sends other frames, another number of bytes or another number of responses,
+    so a field trace can be used as a regression test.
+    The Main starts its sequence numbers at random (seq_nr): the replay starts them
+    where the recording did, from the first request in the trace.
+
+    Usage (from the folder Examples/Version_02/Host):
+
+        python3 replay_trace.py trace_sensor.bin --dump
+        python3 replay_trace.py repl_log.txt --speed 4 --max-p99-ms 300
+"""
+import argparse
+import calendar
+import os
+import struct
+import sys
+import threading
+
+from sim_uart import SimClock
+from sim_board import Device
+from bench_link import percentile
+
+MAGIC = b'SCT1'
+RX = 0
+TX = 1
+STX = 0x02
+HDR_LEN = 6
+OVERHEAD = 7
+BCAST = 0xFF
+PUSH_CODES = (110, 111)  # frames sent on a timer, not in response to the bytes received
+REQ_MIN = 100  # codes below are control frames (ACK, NAK, CREDIT, PEND): they carry the sequence number of another frame
+
+"""
+    Function load_trace()
+
+    :param  str path, trace file or text file with 'TRC:' lines
+    :return tuple (int address of the device, list of records (t in seconds, dir, bytes))
+"""
+def load_trace(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if not raw.startswith(MAGIC):
+        hexs = []
+        for line in raw.decode('utf-8', 'replace').splitlines():
+            i = line.find('TRC:')
+            if i >= 0:
+                hexs.append(line[i + 4:].strip())
+        raw = bytes.fromhex(''.join(hexs))
+    if not raw.startswith(MAGIC):
+        raise ValueError("{}: not a sercom trace".format(path))
+    ads = raw[len(MAGIC)]
+    i = len(MAGIC) + 1
+    recs = []
+    wrap = 0
+    t_prev = 0
+    while i + 6 <= len(raw):
+        t, d, n = struct.unpack_from("<IBB", raw, i)
+        if t < t_prev:
+            wrap += 1 << 32  # the microsecond counter wrapped
+        t_prev = t
+        recs.append(((t + wrap) / 1_000_000, d, raw[i + 6:i + 6 + n]))
+        i += 6 + n
+    return ads, recs
+
+def _scan(data):
+    """The valid frames in data as tuples (index of the frame, index after it, dst, src, code, seq)."""
+    i = 0
+    while i + OVERHEAD <= len(data):
+        n = data[i + 2]
+        if data[i + 3] == STX and i + n + OVERHEAD <= len(data):
+            end = i + n + OVERHEAD
+            if sum(data[i:end - 1]) & 0xFF == data[end - 1]:
+                yield i, end, data[i], data[i + 1], data[i + 4], data[i + 5]
+                i = end
+                continue
+        i += 1
+
+def _compared(dst, code):
+    # broadcast and pushed frames are sent on the timers of the script
+    return dst != BCAST and code not in PUSH_CODES
+
+def frames(data):
+    """
+        The frames in data as tuples (dst, src, code, seq). Bytes that are not a frame,
+        broadcast frames and pushed frames are skipped.
+    """
+    return [(dst, src, code, seq) for _, _, dst, src, code, seq in _scan(data) if _compared(dst, code)]
+
+def timed_frames(recs, d):
+    """The frames of direction d in recs as tuples (t, dst, src, code, seq), t: time of their last byte."""
+    chunks = [r for r in recs if r[1] == d]
+    res = []
+    k = 0
+    n = len(chunks[0][2]) if chunks else 0  # bytes up to the end of chunk k
+    for _, end, dst, src, code, seq in _scan(b''.join(r[2] for r in chunks)):
+        while n < end:
+            k += 1
+            n += len(chunks[k][2])
+        res.append((chunks[k][0], dst, src, code, seq))
+    return res
+
+"""
+    Function trace_utc()
+
+    :param  list of records, int tz_offset (hours) of the Sensor
+    :return float, UTC at the recorded time 0, from the last datetime broadcast (code 110)
+            or push (code 111) in the records, or None if there is none
+"""
+def trace_utc(recs, tz_offset):
+    res = None
+    for d in (RX, TX):
+        data = b''.join(r[2] for r in recs if r[1] == d)
+        for (t, dst, src, code, seq), (i, end, _, _, _, _) in zip(timed_frames(recs, d), _scan(data)):
+            pl = data[i + HDR_LEN:end - 1]
+            if code == 111 and len(pl) >= 7:
+                tm = ((pl[0] << 8) | pl[1], pl[2], pl[3], pl[4], pl[5], pl[6])
+            elif code == 110 and len(pl) >= 19:
+                s = pl[:19].decode('ascii', 'replace')
+                try:
+                    tm = (int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]))
+                except ValueError:
+                    continue
+            else:
+                continue
+            if tm[0] < 2022:
+                continue  # the power-up time of the RTC of the Sensor
+            if res is None or t > res[0]:
+                res = (t, calendar.timegm(tm + (0, 0, 0)) - tz_offset * 3600)
+    return None if res is None else res[1] - res[0]
+
+def response_times(recs):
+    """
+        Seconds from each frame received until the first frame sent back to its
+        source with its sequence number. Frames that got no answer are not counted.
+    """
+    res = []
+    waiting = {}  # (src, seq): time received
+    rx = timed_frames(recs, RX)
+    j = 0
+    for t, dst, src, code, seq in timed_frames(recs, TX):
+        while j < len(rx) and rx[j][0] <= t:
+            r = rx[j]
+            if r[1] != BCAST:
+                waiting[(r[2], r[4])] = r[0]
+            j += 1
+        t_rx = waiting.pop((dst, seq), None)
+        if t_rx is not None:
+            res.append(t - t_rx)
+    return res
+
+class ReplayUART:
+    """
+        busio.UART stand-in that receives the recorded RX bytes at their recorded
+        time and records what the script sends, in the same format.
+    """
+    def __init__(self, clock, recs):
+        self.clock = clock
+        self._rx = [(t, data) for t, d, data in recs if d == RX]
+        self._i = 0
+        self._pending = bytearray()
+        self.t_base = None
+        self.stop = None
+        self.baudrate = 9600
+        self.timeout = 0
+        self.receiver_buffer_size = 64
+        self.out = []  # (t, TX, bytes) and (t, RX, bytes) as the script read them
+        self.done = threading.Event()
+
+    def configure(self, baudrate=9600, timeout=1, receiver_buffer_size=64, **kwargs):
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.receiver_buffer_size = receiver_buffer_size
+        return self
+
+    def _now(self):
+        if self.t_base is None:
+            self.t_base = self.clock.monotonic()
+        return self.clock.monotonic() - self.t_base
+
+    def _fill(self):
+        now = self._now()
+        while self._i < len(self._rx) and self._rx[self._i][0] <= now:
+            self._pending += self._rx[self._i][1]
+            self._i += 1
+        if self._i >= len(self._rx) and not self._pending:
+            self.done.set()
+
+    def _check_stop(self):
+        if self.stop is not None and self.stop.is_set():
+            raise KeyboardInterrupt
+
+    @property
+    def in_waiting(self):
+        self._fill()
+        return len(self._pending)
+
+    def readinto(self, buf):
+        self._check_stop()
+        t_end = self._now() + self.timeout
+        while True:
+            self._fill()
+            if self._pending or self._now() >= t_end:
+                break
+            self.clock.sleep(0.001, self.stop)
+        n = min(len(buf), len(self._pending))
+        if not n:
+            return None
+        buf[:n] = self._pending[:n]
+        del self._pending[:n]
+        self.out.append((self._now(), RX, bytes(buf[:n])))
+        return n
+
+    def write(self, buf):
+        self._check_stop()
+        data = bytes(buf)
+        self.clock.sleep(len(data) * 10 / self.baudrate, self.stop)
+        self.out.append((self._now(), TX, data))  # like sercom_trace: after the write
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._fill()
+        self._pending = bytearray()
+
+    def deinit(self):
+        pass
+
+def first_seq(f_rec):
+    """The seq_nr of the Main before the first request in the frames f_rec, or None."""
+    for dst, src, code, seq in f_rec:
+        if code >= REQ_MIN:
+            return (seq - 1) & 0xFF
+    return None
+
+def _entry(g, seq_nr=None):
+    # main() of both roles, like the device: the Sensor brings up the network from there
+    g['use_trace'] = False
+    if seq_nr is not None:
+        g['seq_nr'] = seq_nr  # instead of the random start of the recording device
+    g['main']()
+
+"""
+    Function pr_stats()
+
+    :param  str name, list of records
+    :return tuple (float p99 response time in ms or None, int nr of responses, int bytes sent)
+"""
+def pr_stats(name, recs):
+    rt = [x * 1000 for x in response_times(recs)]
+    n_rx = sum(len(r[2]) for r in recs if r[1] == RX)
+    n_tx = sum(len(r[2]) for r in recs if r[1] == TX)
+    p50 = percentile(rt, 50)
+    p99 = percentile(rt, 99)
+    print("{:9s} rx {:6d} B, tx {:6d} B, responses {:4d}, p50 {:8.1f} ms, p99 {:8.1f} ms".format(
+        name, n_rx, n_tx, len(rt), p50 or 0.0, p99 or 0.0))
+    return p99, len(rt), n_tx
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay a sercom link trace into the script of its role")
+    ap.add_argument('trace', help="trace file, or REPL output with 'TRC:' lines")
+    ap.add_argument('--role', choices=('Main', 'Sensor'), default=None, help="default: from the address in the trace")
+    ap.add_argument('--speed', type=float, default=1.0, help="replay speed (simulated seconds per real second)")
+    ap.add_argument('--tail', type=float, default=2.0, help="seconds to run after the last recorded byte")
+    ap.add_argument('--dump', action='store_true', help="print the records and exit")
+    ap.add_argument('--max-p99-ms', type=float, default=None, help="fail if the p99 response time of the replay is higher")
+    ap.add_argument('--strict', action='store_true', help="fail if the frames sent differ from the recording")
+    ap.add_argument('--quiet', action='store_true', help="do not print the output of the script")
+    args = ap.parse_args()
+
+    ads, recs = load_trace(args.trace)
+    if args.dump:
+        print("address 0x{:02x}, {} records".format(ads, len(recs)))
+        for t, d, data in recs:
+            print("{:12.6f} {} {}".format(t, 'RX' if d == RX else 'TX', data.hex(' ')))
+        return 0
+    role = args.role or ('Main' if ads == 0x20 else 'Sensor')
+    board_id = 'pyportal_titano' if role == 'Main' else 'unexpectedmaker_pros3'
+    f_rec = frames(b''.join(r[2] for r in recs if r[1] == TX))
+    seq_nr = first_seq(f_rec) if role == 'Main' else None
+    clock = SimClock(args.speed)
+    uart = ReplayUART(clock, recs)
+    dev = Device(role, board_id, uart, clock, secrets={'sercom_ads': '0x{:02x}'.format(ads)}, echo=not args.quiet)
+    sec = dev.secrets
+    local = sec.get('LOCAL_TIME_FLAG', '0') == '1' and sec.get('timezone', None) is not None
+    utc = trace_utc(recs, int(sec.get('tz_offset', 0)) if local else 0)
+    if utc is not None:
+        clock.set_utc(utc)
+    dev.start(lambda g: _entry(g, seq_nr))
+    t_last = recs[-1][0] if recs else 0.0
+    while dev.thread.is_alive():
+        if uart.t_base is not None and uart._now() > t_last + args.tail and uart.done.is_set():
+            break
+        dev.thread.join(0.1)
+    dev.stop()
+
+    print()
+    print("trace {}: role {}, address 0x{:02x}, {:.1f} s".format(os.path.basename(args.trace), role, ads, t_last))
+    _, n_resp, n_tx = pr_stats('recorded', recs)
+    p99, n_resp_rep, n_tx_rep = pr_stats('replayed', uart.out)
+    f_rep = frames(b''.join(r[2] for r in uart.out if r[1] == TX))
+    n_same = 0
+    for a, b in zip(f_rec, f_rep):
+        if a != b:
+            break
+        n_same += 1
+    print("frames sent: recorded {}, replayed {}, identical prefix {}".format(len(f_rec), len(f_rep), n_same))
+    res = 0
+    if args.strict and (n_same != len(f_rec) or len(f_rep) != len(f_rec)):
+        print("FAIL: the frames sent differ from the recording")
+        res = 1
+    if args.strict and n_tx_rep != n_tx:
+        print("FAIL: {} bytes sent, {} recorded".format(n_tx_rep, n_tx))
+        res = 1
+    if args.strict and n_resp_rep != n_resp:
+        print("FAIL: {} responses, {} recorded".format(n_resp_rep, n_resp))
+        res = 1
+    if args.max_p99_ms is not None and (p99 or 0.0) > args.max_p99_ms:
+        print("FAIL: p99 response time {:.1f} ms > {:.1f} ms".format(p99, args.max_p99_ms))
+        res = 1
+    if dev.error is not None:
+        res = 1
+    return res
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Runs the scripts of the 'Main' and the 'Sensor' role on a host computer (CPython),
+# connected by a simulated UART line. See sim_uart and sim_board.
+# Version 2
+#
+"""
+    Usage (from the folder Examples/Version_02/Host):
+
+        python3 run_sim.py --duration 180 --speed 10
+        python3 run_sim.py --baud 9600 --loss 0.01 --corrupt 0.01 --seed 1
+    python3 run_sim.py --trace  # record trace_main.bin and trace_sensor.bin. See replay_trace
+    python3 run_sim.py --stats 30  # the Main asks the link counters of the Sensor every 30 s
+    python3 run_sim.py --power-cycle-main 90  # the Main restarts from the time it kept in NVM
+
+    Both scripts print to stdout, each line prefixed with the name of the device.
+    At the end the counters of the line, the link counters of both devices
+    (see lib/sercom_frame.py, Stats) and the time shown by the flipclock
+    of the Main device are printed.
+"""
+import argparse
+import sys
+import time
+
+from sim_uart import SimClock, make_pair
+from sim_board import Device
+
+def _make_entry(trace, stats_period):
+    def entry(g):
+        g['use_trace'] = trace
+        if stats_period and 'nodes' in g:  # Main
+            g['nodes'].append({'ads': 0x25, 'req': 104, 'period': stats_period, 'timeout': 2.0,
+                               'prio': 2, 'due': 0.0, 'fails': 0, 'pend_end': 0.0})
+        g['main']()
+    return entry
+
+def link_stats(dev):
+    """The link counters of a device, or None. See lib/sercom_frame.py, Stats."""
+    g = dev.globals
+    if not g or 'stats' not in g:
+        return None
+    return g['fr'].unpack_stats(g['stats'].pack(g['parser']))
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the Main and the Sensor script over a simulated UART line")
+    ap.add_argument('--duration', type=float, default=120.0, help="simulated seconds to run")
+    ap.add_argument('--speed', type=float, default=1.0, help="simulated seconds per real second")
+    ap.add_argument('--baud', type=int, default=None, help="override the baudrate set by the scripts")
+    ap.add_argument('--loss', type=float, default=0.0, help="probability that a byte is lost")
+    ap.add_argument('--corrupt', type=float, default=0.0, help="probability that a bit of a byte is flipped")
+    ap.add_argument('--seed', type=int, default=None)
+    ap.add_argument('--no-wifi', action='store_true', help="the Sensor cannot connect to WiFi")
+    ap.add_argument('--no-ntp', action='store_true', help="the NTP server does not reply")
+    ap.add_argument('--trace', action='store_true', help="both scripts record a trace (see lib/sercom_trace.py)")
+    ap.add_argument('--stats', type=float, default=0, metavar='SECS', help="the Main asks the link counters of the Sensor every SECS seconds")
+    ap.add_argument('--power-cycle-main', type=float, default=None, metavar='SECS', help="power cycle the Main after SECS seconds")
+    ap.add_argument('--quiet', action='store_true', help="do not print the output of the scripts")
+    args = ap.parse_args()
+
+    clock = SimClock(args.speed)
+    u_main, u_sensor = make_pair(clock, args.loss, args.corrupt, args.seed, args.baud)
+    sensor = Device('Sensor', 'unexpectedmaker_pros3', u_sensor, clock, echo=not args.quiet)
+    sensor.wifi_ok = not args.no_wifi
+    sensor.ntp_ok = not args.no_ntp
+    main_dev = Device('Main', 'pyportal_titano', u_main, clock, echo=not args.quiet)
+    devs = (sensor, main_dev)
+    entry = _make_entry(args.trace, args.stats) if args.trace or args.stats else None
+    for d in devs:
+        d.start(entry)
+    t_cycle = args.power_cycle_main
+    try:
+        while clock.monotonic() < args.duration and any(d.thread.is_alive() for d in devs):
+            if t_cycle is not None and clock.monotonic() >= t_cycle:
+                t_cycle = None
+                main_dev.power_cycle(entry)
+                clock.sleep(0.5)
+                print("{:8s}| power cycled. Flipclock after boot= {}".format('run_sim', main_dev.display()))
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    for d in devs:
+        d.stop()
+
+    print()
+    print("simulated time= {:.1f} s, speed= {}, baudrate= {}".format(clock.monotonic(), args.speed, u_main.baudrate))
+    print("Main -> Sensor: {}, Sensor UART: {}".format(u_main.tx_line.stats(), u_sensor.stats()))
+    print("Sensor -> Main: {}, Main UART: {}".format(u_sensor.tx_line.stats(), u_main.stats()))
+    for d in devs:
+        st = link_stats(d)
+        if st is not None:
+            print("{} link stats: {}".format(d.name, st))
+    if main_dev.globals and main_dev.globals.get('node_stats'):
+        print("Sensor link stats received by the Main: {}".format(main_dev.globals['node_stats']))
+    rtc = sensor.rtc.datetime if sensor.rtc else None
+    if rtc is not None:
+        print("Sensor RTC= {:02d}:{:02d}:{:02d}, Main flipclock= {}".format(rtc[3], rtc[4], rtc[5], main_dev.display()))
+    for d in devs:
+        if d.resets:
+            print("{}: reset {} time(s)".format(d.name, d.resets))
+        if d.error is not None:
+            print("{}: stopped by {}: {}".format(d.name, type(d.error).__name__, d.error))
+    return 1 if any(d.error is not None for d in devs) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,471 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Stand-ins for the CircuitPython modules used by the scripts of both roles,
+# to run them on a host computer (CPython).
+# Version 2
+#
+"""
+    Simulated devices.
+
+    A Device runs the code.py of one role in a thread. Its imports of
+    board, busio, rtc, time, gc, wifi, socketpool, micropython, digitalio,
+    microcontroller, pros3, displayio, adafruit_imageload and
+    adafruit_displayio_flipclock get stand-ins of that device only.
+    secrets, sercom_log and sercom_frame are loaded from the folder of the role
+    and from lib for each device, so both devices have their own globals.
+    Other imports (struct, array, sys, ...) are the CPython modules.
+
+    The stand-ins:
+        time            time.monotonic() is the simulated time (see sim_uart.SimClock).
+                        time.time() and time.localtime() read the built-in RTC.
+        rtc             RTC().datetime sets and reads the built-in RTC.
+                        At power-up it reads 2000-01-01 00:00:00. It runs rtc_ppm fast.
+        wifi            connect() takes wifi_delay seconds and succeeds unless wifi_ok is False.
+                        A scan of the access points takes scan_delay seconds.
+        socketpool      UDP sockets to port 123 are answered by an SNTP server stand-in
+                        that uses SimClock.utc(), after ntp_delay seconds.
+                        If ntp_ok is False there is no reply.
+        microcontroller reset() restarts code.py.
+        displayio, adafruit_imageload, FlipClock: no display. The digits
+                        shown by the flipclock are kept (see Device.display()).
+"""
+import builtins
+import calendar
+import errno
+import ipaddress
+import os
+import struct
+import sys
+import threading
+import time as _time
+import types
+from collections import deque
+
+_NTP_TO_UNIX_EPOCH = 2208988800
+_RTC_POWER_UP = calendar.timegm((2000, 1, 1, 0, 0, 0, 5, 1, -1))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)  # Examples/Version_02
+
+class _Reset(BaseException):
+    """Raised by microcontroller.reset(). Device.run() restarts code.py."""
+
+class Network:
+    def __init__(self, ssid, bssid, rssi, channel):
+        self.ssid = ssid
+        self.bssid = bssid
+        self.rssi = rssi
+        self.channel = channel
+
+class _Radio:
+    def __init__(self, dev):
+        self._dev = dev
+        self.enabled = True
+        self.hostname = dev.name
+        self.ipv4_address = None
+        self.ap_info = None
+        self._nets = [
+            Network(dev.secrets.get('ssid', ''), b'\x02\x00\x00\x00\x00\x01', -48, 6),
+            Network(dev.secrets.get('ssid', ''), b'\x02\x00\x00\x00\x00\x02', -71, 11),
+            Network('neighbour', b'\x02\x00\x00\x00\x00\x03', -80, 1),
+        ]
+
+    def start_scanning_networks(self, **kwargs):
+        self._dev.clock.sleep(self._dev.scan_delay, self._dev.stop_evt)
+        return iter(self._nets)
+
+    def stop_scanning_networks(self):
+        pass
+
+    def connect(self, ssid, password=None, channel=0, bssid=None, **kwargs):
+        self._dev.clock.sleep(self._dev.wifi_delay, self._dev.stop_evt)
+        if not self._dev.wifi_ok:
+            raise ConnectionError("No network with that ssid")
+        for net in self._nets:
+            if net.ssid == ssid and (bssid is None or bytes(bssid) == net.bssid):
+                self.ap_info = net
+                self.ipv4_address = ipaddress.ip_address('192.168.1.%d' % (100 + self._dev.index))
+                return
+        raise ConnectionError("No network with that ssid")
+
+    def ping(self, ip, timeout=0.5):
+        return 0.012 if self.ipv4_address is not None else None
+
+class _UDPSocket:
+    def __init__(self, dev):
+        self._dev = dev
+        self._timeout = None
+        self._reply = None  # (time of arrival, bytes)
+
+    def settimeout(self, t):
+        self._timeout = t
+
+    def sendto(self, buf, addr):
+        dev = self._dev
+        if not dev.ntp_ok or addr[1] != 123 or len(buf) < 48:
+            return len(buf)
+        clk = dev.clock
+        t = clk.utc() + dev.ntp_delay / 2
+        ts = int(t) + _NTP_TO_UNIX_EPOCH
+        frac = int((t % 1) * (1 << 32))
+        rep = bytearray(48)
+        rep[0] = 0x24  # LI: 0, version: 4, mode: 4 (server)
+        rep[1] = 1     # stratum
+        rep[24:32] = buf[40:48]  # originate timestamp = transmit timestamp of the request
+        struct.pack_into("!II", rep, 32, ts, frac)  # receive timestamp
+        struct.pack_into("!II", rep, 40, ts, frac)  # transmit timestamp
+        self._reply = (clk.monotonic() + dev.ntp_delay, bytes(rep))
+        return len(buf)
+
+    def recv_into(self, buf, nbytes=0):
+        clk = self._dev.clock
+        t_end = clk.monotonic() + (self._timeout if self._timeout is not None else 60)
+        if self._reply is None or self._reply[0] > t_end:
+            clk.sleep(max(0.0, t_end - clk.monotonic()), self._dev.stop_evt)
+            raise OSError(errno.ETIMEDOUT, "timed out")
+        clk.sleep(max(0.0, self._reply[0] - clk.monotonic()), self._dev.stop_evt)
+        data = self._reply[1]
+        self._reply = None
+        n = min(len(buf), len(data))
+        buf[:n] = data[:n]
+        return n
+
+    def close(self):
+        pass
+
+class _SocketPool:
+    AF_INET = 2
+    SOCK_STREAM = 1
+    SOCK_DGRAM = 2
+
+    def __init__(self, dev, radio):
+        self._dev = dev
+
+    def getaddrinfo(self, host, port, *args):
+        if self._dev.radio.ipv4_address is None:
+            raise OSError(errno.EHOSTUNREACH, "no network")
+        try:
+            addr = str(ipaddress.ip_address(host))
+        except ValueError:
+            addr = '10.0.0.%d' % (sum(host.encode()) % 250 + 1)
+        return [(self.AF_INET, self.SOCK_DGRAM, 0, '', (addr, port))]
+
+    def socket(self, family=AF_INET, type=SOCK_STREAM, proto=0):
+        return _UDPSocket(self._dev)
+
+class _RTC:
+    def __init__(self, dev):
+        self._dev = dev
+        self._ofs = _RTC_POWER_UP - self._count()
+        self.calibration = 0
+
+    def _count(self):
+        # the crystal of the RTC runs rtc_ppm fast (or slow) compared to SimClock
+        return self._dev.clock.monotonic() * (1 + self._dev.rtc_ppm / 1_000_000)
+
+    def exact(self):
+        """The time of the RTC, with the part of the second (sim only)."""
+        return self._count() + self._ofs
+
+    def time(self):
+        return int(self._count() + self._ofs)
+
+    @property
+    def datetime(self):
+        return _time.gmtime(self.time())
+
+    @datetime.setter
+    def datetime(self, dt):
+        # The RTC counts whole seconds from the moment it is set
+        self._ofs = calendar.timegm(tuple(dt)[:6] + (0, 0, 0)) - self._count()
+
+class _Bitmap:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+class _Palette:
+    def make_transparent(self, idx):
+        pass
+
+class _FlipDigit:
+    def __init__(self):
+        self.value = 0
+
+class _FlipClock(list):
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.digit_0 = _FlipDigit()
+        self.digit_1 = _FlipDigit()
+        self.digit_2 = _FlipDigit()
+        self.digit_3 = _FlipDigit()
+
+class _Group(list):
+    scale = 1
+    x = 0
+    y = 0
+
+class _Display:
+    def __init__(self):
+        self.root_group = None
+
+    def show(self, group):
+        self.root_group = group
+
+    def refresh(self, **kwargs):
+        return True
+
+class _DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = False
+        self.direction = None
+
+class Device:
+    """
+        One simulated device (board_id 'pyportal_titano' or 'unexpectedmaker_pros3')
+        running the code.py in the folder role_dir (e.g. 'Main', 'Sensor').
+        secrets: entries replacing those of the secrets.py of the role.
+    """
+    _count = 0
+
+    def __init__(self, role_dir, board_id, uart, clock, secrets=None, name=None, echo=True):
+        Device._count += 1
+        self.index = Device._count
+        self.role_dir = os.path.join(ROOT, role_dir)
+        self.board_id = board_id
+        self.uart = uart
+        self.clock = clock
+        self.name = name or role_dir
+        self.echo = echo
+        self.out = deque((), 1000)  # the last lines printed by the script
+        self.wifi_ok = True
+        self.wifi_delay = 0.0  # seconds a WiFi connect takes
+        self.scan_delay = 0.0  # seconds a scan of the access points takes
+        self.ntp_ok = True
+        self.ntp_delay = 0.02  # round-trip delay of the NTP server stand-in
+        self.rtc_ppm = 0.0     # frequency error of the built-in RTC (ppm, +: fast). Set it before start()
+        self.resets = 0
+        self.error = None      # exception that ended the script
+        self.stop_evt = threading.Event()
+        self.thread = None
+        uart.stop = self.stop_evt
+        self.secrets = self._load_secrets(secrets)
+        self.radio = _Radio(self)
+        self.rtc = None
+        self.nvm = bytearray(b'\xff' * 8192)  # microcontroller.nvm: kept over resets and power cycles
+        self.clock_face = None
+        self._print_lock = threading.Lock()
+        self.modules = {}
+        self.globals = None    # globals of the running code.py
+
+    def _load_secrets(self, extra):
+        g = {}
+        path = os.path.join(self.role_dir, 'secrets.py')
+        if os.path.exists(path):
+            with open(path) as f:
+                exec(compile(f.read(), path, 'exec'), g)
+        s = dict(g.get('secrets', {}))
+        s.setdefault('ssid', 'sim_ssid')
+        if extra:
+            s.update(extra)
+        return s
+
+    def _print(self, *args, sep=' ', end='\n', **kwargs):
+        s = sep.join(str(a) for a in args)
+        self.out.append(s)
+        if self.echo:
+            with self._print_lock:
+                sys.stdout.write("{:8s}| {}{}".format(self.name, s, end))
+
+    def _mod(self, name, **attrs):
+        m = types.ModuleType(name)
+        m.__dict__.update(attrs)
+        return m
+
+    def _make_modules(self):
+        dev = self
+        clk = self.clock
+        self.rtc = _RTC(self)
+
+        def monotonic():
+            return clk.monotonic()
+
+        def monotonic_ns():
+            return int(clk.monotonic() * 1_000_000_000)
+
+        def sleep(secs):
+            clk.sleep(secs, dev.stop_evt)
+
+        def time_():
+            return dev.rtc.time()
+
+        def localtime(secs=None):
+            return _time.gmtime(dev.rtc.time() if secs is None else secs)
+
+        def mktime(t):
+            return calendar.timegm(tuple(t))
+
+        def uart(tx=None, rx=None, **kwargs):
+            return dev.uart.configure(**kwargs)
+
+        def reset():
+            raise _Reset()
+
+        flipclock = self._mod('adafruit_displayio_flipclock.flip_clock', FlipClock=self._flipclock)
+        mods = {
+            'time': self._mod('time', struct_time=_time.struct_time, monotonic=monotonic,
+                              monotonic_ns=monotonic_ns, sleep=sleep, time=time_,
+                              localtime=localtime, mktime=mktime),
+            'board': self._mod('board', board_id=self.board_id, SDA='SDA', SCL='SCL',
+                               TX='TX', RX='RX', LED='LED', DISPLAY=_Display()),
+            'busio': self._mod('busio', UART=uart),
+            'rtc': self._mod('rtc', RTC=lambda: dev.rtc),
+            'gc': self._mod('gc', collect=lambda: None, mem_free=lambda: 100000,
+                            mem_alloc=lambda: 0),
+            'micropython': self._mod('micropython', const=lambda x: x),
+            'wifi': self._mod('wifi', radio=self.radio, Network=Network,
+                              AuthMode=types.SimpleNamespace(OPEN=0, WPA2=3)),
+            'socketpool': self._mod('socketpool', SocketPool=lambda radio: _SocketPool(dev, radio)),
+            'digitalio': self._mod('digitalio', DigitalInOut=_DigitalInOut),
+            'microcontroller': self._mod('microcontroller', reset=reset, nvm=self.nvm),
+            'pros3': self._mod('pros3'),
+            'displayio': self._mod('displayio', Group=_Group),
+            'adafruit_imageload': self._mod('adafruit_imageload', load=self._imageload),
+            'adafruit_displayio_flipclock': self._mod('adafruit_displayio_flipclock', flip_clock=flipclock),
+            'adafruit_displayio_flipclock.flip_clock': flipclock,
+            'secrets': self._mod('secrets', secrets=self.secrets),
+        }
+        return mods
+
+    def _flipclock(self, *args, **kwargs):
+        self.clock_face = _FlipClock(*args, **kwargs)
+        return self.clock_face
+
+    def _imageload(self, path, **kwargs):
+        # Only the size of the bitmap is used. It is read from the header of the BMP file
+        w = h = 0
+        try:
+            with open(os.path.join(self.role_dir, path), 'rb') as f:
+                hdr = f.read(26)
+            w, h = struct.unpack_from("<ii", hdr, 18)
+        except (OSError, struct.error):
+            pass
+        return _Bitmap(w, abs(h)), _Palette()
+
+    def _load_source(self, name):
+        for d in (self.role_dir, os.path.join(ROOT, 'lib')):
+            path = os.path.join(d, name + '.py')
+            if os.path.exists(path):
+                m = types.ModuleType(name)
+                m.__file__ = path
+                m.__builtins__ = self._builtins
+                self.modules[name] = m
+                with open(path) as f:
+                    exec(compile(f.read(), path, 'exec'), m.__dict__)
+                return m
+        return None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        m = self.modules.get(name)
+        if m is None and level == 0 and '.' not in name and name not in sys.builtin_module_names:
+            m = self._load_source(name)
+        if m is None:
+            return builtins.__import__(name, globals, locals, fromlist, level)
+        if '.' in name and not fromlist:
+            return self.modules[name.split('.')[0]]
+        return m
+
+    """
+        Function display()
+
+        :param  None
+        :return str, the time shown by the flipclock ('hh:mm'), or None
+    """
+    def display(self):
+        c = self.clock_face
+        if c is None:
+            return None
+        return "{}{}:{}{}".format(c.digit_0.value, c.digit_1.value, c.digit_2.value, c.digit_3.value)
+
+    def _new_globals(self, name):
+        self._builtins = dict(builtins.__dict__)
+        self._builtins['__import__'] = self._import
+        self._builtins['print'] = self._print
+        self.modules = self._make_modules()
+        self.globals = {'__name__': name, '__file__': self._path, '__builtins__': self._builtins}
+        return self.globals
+
+    def _compile(self):
+        self._path = os.path.join(self.role_dir, 'code.py')
+        with open(self._path) as f:
+            return compile(f.read(), self._path, 'exec')
+
+    """
+        Function load()
+
+        :param  None
+        :return dict, the globals of code.py
+
+        Executes code.py as a module (not as '__main__'), so main() is not called.
+        Its functions can then be called directly, e.g. by a benchmark.
+    """
+    def load(self):
+        exec(self._compile(), self._new_globals('code'))
+        return self.globals
+
+    """
+        Function run()
+
+        :param  entry, None or a function called with the globals of code.py
+        :return None
+
+        Runs code.py as '__main__' until it exits. After microcontroller.reset()
+        it runs again with fresh globals, like the device would.
+        If entry is given, code.py is loaded as a module and entry(globals) is called instead.
+    """
+    def run(self, entry=None):
+        code = self._compile()
+        while not self.stop_evt.is_set():
+            g = self._new_globals('__main__' if entry is None else 'code')
+            try:
+                exec(code, g)
+                if entry is not None:
+                    entry(g)
+                break
+            except _Reset:
+                self.resets += 1
+            except (SystemExit, KeyboardInterrupt):
+                break
+            except Exception as e:
+                self.error = e
+                self._print("{}: {}".format(type(e).__name__, e))
+                break
+
+    def start(self, entry=None):
+        self.thread = threading.Thread(target=self.run, args=(entry,), name=self.name, daemon=True)
+        self.thread.start()
+        return self.thread
+    def stop(self, timeout=5.0):
+        self.stop_evt.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    """
+        Function power_cycle()
+
+        :param  entry, see run()
+        :return threading.Thread
+
+        Stops the script and starts it again like after a power cycle:
+        the RTC starts at its power-up time again, the NVM keeps its contents.
+    """
+    def power_cycle(self, entry=None):
+        self.stop()
+        self.stop_evt.clear()
+        self.clock_face = None
+        self.uart.reset_input_buffer()
+        return self.start(entry)
@@ -0,0 +1,262 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Simulated UART line, to run the scripts of both roles on a host computer (CPython).
+# Version 2
+#
+"""
+    Simulated busio.UART pair.
+
+    Two UART objects are connected by two Lines, one per direction, like the
+    crossed SDA/SCL wires between the 'Main' and the 'Sensor' device.
+    A Line models:
+        - the baudrate: a byte (8N1: 10 bits) arrives 10 / baudrate seconds
+          after the previous one. write() returns when the last byte is sent;
+        - loss: each byte is dropped with probability loss;
+        - corruption: in each byte one bit is flipped with probability corrupt;
+        - bit errors: each bit is flipped with probability ber;
+        - duplication: each byte is received twice with probability dup;
+        - burst noise: with probability burst a byte starts a burst of
+          burst_len bytes replaced by random bytes.
+    The receiving UART keeps at most receiver_buffer_size bytes, like the
+    ring buffer of busio.UART. Bytes arriving when it is full are dropped
+    and counted in overruns.
+
+    All times are simulated seconds of a SimClock. With speed > 1 the
+    simulation runs faster than real time. Note that the time the scripts
+    spend executing is scaled too: measure latencies with speed 1.
+
+    Usage:
+        clock = SimClock()
+        u_main, u_sensor = make_pair(clock, loss=0.001, seed=1)
+"""
+import random
+import threading
+import time
+from collections import deque
+
+BITS_PER_BYTE = 10  # start bit, 8 data bits, stop bit
+
+class SimClock:
+    """
+        Simulated time, shared by all devices and lines of a simulation.
+        monotonic() starts at 0. utc() is the 'true' UTC time, used by the
+        NTP server stand-in (see sim_board).
+    """
+    def __init__(self, speed=1.0, utc0=None):
+        self.speed = speed
+        self._t0 = time.perf_counter()
+        self._utc0 = time.time() if utc0 is None else utc0
+
+    def monotonic(self):
+        return (time.perf_counter() - self._t0) * self.speed
+
+    def utc(self):
+        return self._utc0 + self.monotonic()
+
+    def set_utc(self, utc):
+        """Set utc() to utc now."""
+        self._utc0 = utc - self.monotonic()
+
+    def sleep(self, secs, stop=None):
+        """Sleep secs simulated seconds. Raises KeyboardInterrupt if stop (a threading.Event) is set."""
+        t_end = self.monotonic() + secs
+        while True:
+            if stop is not None and stop.is_set():
+                raise KeyboardInterrupt
+            dt = t_end - self.monotonic()
+            if dt <= 0:
+                return
+            if dt / self.speed < 0.0002:
+                continue  # time.sleep() would overshoot a short sleep by many simulated ms at a high speed
+            time.sleep(min(dt / self.speed, 0.05))
+
+class Line:
+    """
+        One direction of the serial connection.
+        The bytes in transit are kept with their time of arrival.
+    """
+    def __init__(self, clock, loss=0.0, corrupt=0.0, seed=None, ber=0.0, dup=0.0, burst=0.0, burst_len=8):
+        self.clock = clock
+        self.loss = loss
+        self.corrupt = corrupt
+        self.ber = ber
+        self.dup = dup
+        self.burst = burst
+        self.burst_len = burst_len
+        self._burst_left = 0
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._q = deque()     # (time of arrival, byte)
+        self._free_at = 0.0   # time at which the transmitter is idle
+        self.n_sent = 0
+        self.n_lost = 0
+        self.n_corrupted = 0
+        self.n_bit_errors = 0
+        self.n_dup = 0
+        self.n_burst = 0  # bytes replaced by burst noise
+
+    """
+        Function send()
+
+        :param  bytes data, float baudrate of the transmitter
+        :return float, the time at which the last byte is sent
+    """
+    def send(self, data, baudrate):
+        byte_time = BITS_PER_BYTE / baudrate
+        rnd = self._rnd
+        with self._lock:
+            t = max(self.clock.monotonic(), self._free_at)
+            for b in data:
+                t += byte_time
+                self.n_sent += 1
+                if self.burst and not self._burst_left and rnd.random() < self.burst:
+                    self._burst_left = self.burst_len
+                if self._burst_left:
+                    self._burst_left -= 1
+                    self.n_burst += 1
+                    b = rnd.randrange(256)
+                if self.loss and rnd.random() < self.loss:
+                    self.n_lost += 1
+                    continue
+                if self.corrupt and rnd.random() < self.corrupt:
+                    b ^= 1 << rnd.randrange(8)
+                    self.n_corrupted += 1
+                if self.ber:
+                    for i in range(8):
+                        if rnd.random() < self.ber:
+                            b ^= 1 << i
+                            self.n_bit_errors += 1
+                self._q.append((t, b))
+                if self.dup and rnd.random() < self.dup:
+                    self.n_dup += 1
+                    t += byte_time
+                    self._q.append((t, b))
+            self._free_at = t
+        return t
+
+    """
+        Function take()
+
+        :param  float now
+        :return list, the bytes arrived at time now
+    """
+    def take(self, now):
+        res = []
+        with self._lock:
+            q = self._q
+            while q and q[0][0] <= now:
+                res.append(q.popleft()[1])
+        return res
+
+    def stats(self):
+        return {'sent': self.n_sent, 'lost': self.n_lost, 'corrupted': self.n_corrupted,
+                'bit_errors': self.n_bit_errors, 'dup': self.n_dup, 'burst': self.n_burst}
+
+class UART:
+    """
+        Stand-in for busio.UART. It is created by make_pair(); the call
+        busio.UART(tx, rx, baudrate=.., timeout=.., receiver_buffer_size=..)
+        of a script configures it (see sim_board).
+        If baudrate is given here, it overrides the baudrate set by the script.
+    """
+    def __init__(self, clock, tx_line, rx_line, baudrate=None, name=''):
+        self.clock = clock
+        self.tx_line = tx_line
+        self.rx_line = rx_line
+        self.name = name
+        self.baud_override = baudrate
+        self.baudrate = baudrate or 9600
+        self.timeout = 1.0
+        self.receiver_buffer_size = 64
+        self.stop = None  # threading.Event of the device. See sim_board.Device
+        self._rx = deque()
+        self.overruns = 0   # bytes dropped because the receive buffer was full
+        self.n_rcvd = 0     # bytes read by the script
+
+    def configure(self, baudrate=9600, timeout=1, receiver_buffer_size=64, **kwargs):
+        if not self.baud_override:
+            self.baudrate = baudrate
+        self.timeout = timeout
+        self.receiver_buffer_size = receiver_buffer_size
+        return self
+
+    def _fill(self):
+        rx = self._rx
+        for b in self.rx_line.take(self.clock.monotonic()):
+            if len(rx) < self.receiver_buffer_size:
+                rx.append(b)
+            else:
+                self.overruns += 1
+
+    def _check_stop(self):
+        if self.stop is not None and self.stop.is_set():
+            raise KeyboardInterrupt
+
+    @property
+    def in_waiting(self):
+        self._fill()
+        return len(self._rx)
+
+    """
+        Function readinto()
+
+        :param  buf
+        :return int, nr of bytes read, or None if no bytes were read
+
+        Like busio.UART: it waits until buf is full or timeout seconds passed.
+    """
+    def readinto(self, buf):
+        self._check_stop()
+        n_max = len(buf)
+        n = 0
+        t_end = self.clock.monotonic() + self.timeout
+        rx = self._rx
+        while True:
+            self._fill()
+            while rx and n < n_max:
+                buf[n] = rx.popleft()
+                n += 1
+            if n >= n_max or self.clock.monotonic() >= t_end:
+                break
+            self.clock.sleep(BITS_PER_BYTE / self.baudrate, self.stop)
+        self.n_rcvd += n
+        return n if n else None
+
+    def read(self, nbytes=None):
+        buf = bytearray(nbytes if nbytes else max(self.in_waiting, 1))
+        n = self.readinto(buf)
+        return bytes(buf[:n]) if n else None
+
+    def write(self, buf):
+        self._check_stop()
+        data = bytes(buf)
+        t_end = self.tx_line.send(data, self.baudrate)
+        self.clock.sleep(t_end - self.clock.monotonic(), self.stop)
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._fill()
+        self._rx.clear()
+
+    def deinit(self):
+        pass
+
+    def stats(self):
+        return {'rcvd': self.n_rcvd, 'overruns': self.overruns}
+
+"""
+    Function make_pair()
+
+    :param  SimClock clock, float loss, float corrupt, int seed, int baudrate,
+            noise: ber, dup, burst, burst_len (see Line)
+    :return tuple (UART, UART), the UARTs of the 'Main' and the 'Sensor' device
+"""
+def make_pair(clock, loss=0.0, corrupt=0.0, seed=None, baudrate=None, **noise):
+    rnd = random.Random(seed)
+    to_sensor = Line(clock, loss, corrupt, rnd.randrange(1 << 30), **noise)
+    to_main = Line(clock, loss, corrupt, rnd.randrange(1 << 30), **noise)
+    return (UART(clock, to_sensor, to_main, baudrate, 'Main'),
+            UART(clock, to_main, to_sensor, baudrate, 'Sensor'))
@@ -15,22 +15,33 @@ import os
 #import dotenv
 import sys
 import board
+import microcontroller
 from rtc import RTC
 from busio import UART
-from micropython import const
 from displayio import Group
 import adafruit_imageload
 from adafruit_displayio_flipclock.flip_clock import FlipClock
+import sercom_log as log
+import sercom_frame as fr
+import sercom_trace as trc
+import sercom_nvm as nvs
 
-sercom_I2C_version = 2.0
+sercom_I2C_version = 2.1
 
-my_debug = False
+try:
+    from secrets import secrets
+except ImportError:
+    secrets = {}  # setup() reports it
+
+my_debug = False  # Set to True for log level DEBUG. See sercom_log
+# Apply the datetime broadcasts of a Sensor. None: only if no node subscribes to the pushes. See hdl_push()
+use_time_bcast = None
 use_flipclock = True
+use_trace = False  # Record the bytes on the UART. See sercom_trace
+use_flow = True  # Credit-based flow control. See sercom_frame.Flow
+use_nvm = True  # Keep the last known time in microcontroller.nvm and show it at boot. See warm_start()
 use_dynamic_fading = True
 
-_STX = const(0x02)  # Start-of-text ASCII code
-_ACK = const(0x06)  # Acknowledge ASCII code
-
 roles_dict = {
     0: 'Main',
     1: 'Sensor'
@@ -39,24 +50,54 @@ roles_dict = {
 req_dict = {
    100: 'date_time',  # 100 dec = 64 hex
    101: 'unix_time',
-   102: 'weather'
+   102: 'weather',
+   103: 'subscribe',  # payload: request code to push, cadence in seconds (2 bytes). Cadence 0: each minute
+   104: 'stats'       # reply: the link counters of the Sensor. See sercom_frame.Stats
+   }
+
+# Codes of frames a Sensor sends without being asked
+push_dict = {
+   110: 'time_bcast',  # datetime broadcast to all devices
+   111: 'time_push',   # compact datetime pushed to a subscriber
    }
 
 req_rev_dict = {
    'date_time': 100,  # 100 dec = 64 hex
    'unix_time': 101,
-   'weather': 102
+   'weather': 102,
+   'subscribe': 103,
+   'stats': 104
     }
 
 max_bytes = 2**5
-rx_buffer_len = max_bytes
-rx_buffer = bytearray(rx_buffer_len * b'\x00')
-rx_buffer_s = ''
+max_payload = max_bytes  # max length of the payload of a frame. See sercom_frame
+# Size of the receive buffer of the UART. It can be set in secrets.py, e.g.: 'sercom_rxbuf' : '256'
+# Keep it larger than two frames (2 x 39 bytes): an ACK and a reply can arrive back-to-back.
+rx_buffer_len = int(secrets.get("sercom_rxbuf", "128"))
+rx_buffer = bytearray(rx_buffer_len)
+rx_i = 0  # index of the first byte in rx_buffer not parsed yet. See ck_uart()
+rx_n = 0  # nr of bytes in rx_buffer
+t_rx = 0.0  # time.monotonic() of the last bytes received
+frame_gap = 0.1  # seconds without bytes after which a part of a frame is dropped. See next_frame()
+# The frames to send are built in the blocks of a pool, allocated once. See send_req()
+pool_blocks = 2
+frame_pool = fr.Pool(pool_blocks, max_payload + fr.OVERHEAD)
 id = board.board_id
 
 my_ads = 0x20
 master_ads = 0x20
-target_ads = 0x25
+parser = fr.Parser(my_ads, max_payload, bcast=True)  # broadcasts: datetime and flow control
+flow = fr.Flow(my_ads, rx_buffer_len, max_payload + fr.OVERHEAD)
+credit_wait = 0.5  # max seconds a frame waits for credit. See uart_send()
+stats = fr.Stats()  # link counters of this device
+node_stats = {}     # link counters of the Sensors: {address: {counter name: value}}. See hdl_stats()
+t_push = None   # time.monotonic() of the last datetime push applied
+t_bcast = None  # time.monotonic() of the last datetime broadcast applied
+pend = {}  # nodes that answered PEND: {(address << 8) | sequence number: node}. See hdl_deferred()
+listen_period = 0.25  # seconds between two checks for broadcasts when idle. See listen()
+# Sequence number of the last request sent. It starts at random: a Sensor answers a request
+# with the address and sequence number of one it answered shortly before with that reply (see its replies)
+seq_nr = os.urandom(1)[0]
 last_req_sent = 0
 ACK_rcvd = False
 rtc = None
@@ -68,16 +109,69 @@ display = board.DISPLAY
 t_start = time.monotonic()
 default_dt = time.struct_time((2022,10,10,1,15,1,283,0,-1))
 default_s_dt = "2022-10-10 01:15:00"
-hour_old = 0
-min_old = 0
-tag_le_max = 20  # see tag_adj()
+ERR_UNKNOWN = 0xFFFF  # error bound sent by a Sensor that has no time from NTP
+t_err_ms = None  # error bound of the last datetime received, as reported by the Sensor (ms). None: not reported
+# The time of the built-in RTC came from a Sensor with a known error bound. Not the time of
+# warm_start() (NVM, or an RTC that kept running): it may be stale. See accept_time()
+t_bounded = False
+# Digits shown on the flipclock: (hour tens, hour units, minute tens, minute units)
+# A FlipDigit starts with value 0, so do we. See upd_digits()
+disp_digits = bytearray(4)
+clock_digits = None
 msg_valid=None
+start = True
+t_interval = 60 # in the future set to 600 (10 minutes)
+sub_renew = 300  # seconds between two renewals of a subscription while the pushes arrive (see sub_ttl of the Sensor)
+# Sensor nodes on the bus: one entry per Sensor address and request code. See poll_nodes()
+# 'period': seconds between two polls; 'timeout': seconds to wait for the reply of this node;
+# 'prio': when several nodes are due, the lowest prio is polled first.
+# Nodes with the same prio are polled round-robin: the node that is due the longest goes first.
+# 'payload': optional payload of the request.
+# 'retries': optional max nr of retransmissions of a request (default: max_retries). See ck_uart()
+# A 'date_time' node is not polled while datetime broadcasts or pushes arrive,
+# a 'subscribe' node not while the pushes arrive, except every sub_renew seconds.
+nodes = [
+    # Subscribe once to a datetime push at each minute boundary (cadence 0)
+    {'ads': 0x25, 'req': 103, 'payload': bytes((100, 0, 0)), 'period': t_interval, 'timeout': 2.0, 'prio': 0},
+    # {'ads': 0x25, 'req': 100, 'period': t_interval, 'timeout': 2.0, 'prio': 0},  # or poll for the datetime
+    # {'ads': 0x26, 'req': 102, 'period': 600, 'timeout': 5.0, 'prio': 1},  # weather from a second Sensor
+    # {'ads': 0x25, 'req': 104, 'period': 600, 'timeout': 2.0, 'prio': 2},  # link counters of the Sensor
+]
+for nd in nodes:
+    nd['due'] = 0.0      # time.monotonic() at which the node is polled next
+    nd['fails'] = 0      # nr of polls of this node in a row without a valid reply
+    nd['pend_end'] = 0.0  # a deferred reply is expected until this time.monotonic(), 0.0: none
+    nd['t_req'] = 0.0     # time.monotonic() of the last request sent to the node
+if use_time_bcast is None:
+    use_time_bcast = not any(nd['req'] == 103 for nd in nodes)  # the pushes keep the time: do not apply both
+# Retransmissions. The timeout of a request follows the round-trip time of its node (see sercom_frame.Rtt)
+max_retries = 3      # retransmissions of a request without ACK or reply
+rto_min = 0.3        # seconds, min retransmission timeout. Lower values retransmit too early under loss (see Host/bench_noise.py)
+retry_ratio = 0.5    # each new request adds this to the retry budget
+retry_cap = 5.0      # max retry budget: at most this many retransmissions in a burst
+retry_tokens = retry_cap
+poll_backoff = 1.0   # seconds to the next poll of a node after a failed poll, doubled each failure
+poll_tmr = None
+# Timers. Each timer is a list: [deadline, period, callback]. See add_timer()
+timers = []
+refresh_tmr = None
+# Last known time in NVM. See sercom_nvm
+nvm_ofs = 0         # offset of the ring of records in microcontroller.nvm
+nvm_slots = 16      # nr of records in the ring
+nvm_period = 3600   # min seconds between two writes: each write wears the flash of the NVM
+t_nvm = None        # time.monotonic() of the last write. See save_time()
+
+trace_size = 1024  # size of the trace buffer
+trace_path = 'trace_main.bin'  # if the CIRCUITPY drive is read-only the trace goes to the REPL
+log_ring_len = 0  # nr of log lines kept in RAM. See sercom_log.dump(). 0: RAM is tight on the Titano
+log.set_level(log.DEBUG if my_debug else log.INFO)
+log.set_ring(log_ring_len)
 
 uart = UART(board.SDA, board.SCL, baudrate=4800, timeout=0, receiver_buffer_size=rx_buffer_len)
 
 def setup():
     global rtc
-    TAG=tag_adj("setup(): ")
+    TAG="setup(): "
 
     if not uart:
         so = 'UART'
@@ -85,141 +179,282 @@ def setup():
     if not rtc:
         so = 'RTC'
     if not uart or not rtc:
-        print(TAG+f"failed to create an instance of the {so} object")
+        log.error(TAG, "failed to create an instance of the {} object", so)
     try:
         from secrets import secrets
     except ImportError:
-        print("WiFi secrets are kept in secrets.py, please add them there!")
+        log.error(TAG, "WiFi secrets are kept in secrets.py, please add them there!")
         raise
+    if use_trace:
+        trc.start(trace_size, trace_path, my_ads)
+    if use_flow:
+        send_credit()  # tell the Sensors the size of our receive buffer
 
     make_clock()
+    if use_nvm:
+        warm_start()
+
+"""
+    Function next_frame()
+
+    :param  None
+    :return bool, True if a frame addressed to this device is in parser.frame
+
+    This function parses the bytes received (see sercom_frame) until it has
+    a complete frame. Frames addressed to other devices on the bus are skipped
+    by the parser. Broadcast and pushed frames are handled here (see hdl_push()),
+    so are the CREDIT frames (see sercom_frame.Flow) and the deferred replies (see hdl_deferred()).
+    It returns False when there are no more bytes received now.
+    A part of a frame is dropped after frame_gap seconds without bytes.
+"""
+def next_frame():
+    global rx_i, rx_n, t_rx
+    while True:
+        if rx_i >= rx_n:
+            #-----------------------------------------------------
+            rx_n = uart.readinto(rx_buffer)  # Reception here
+            #-----------------------------------------------------
+            rx_i = 0
+            if not rx_n:
+                rx_n = 0
+                if parser.busy and time.monotonic() - t_rx > frame_gap:
+                    parser.drop()  # the rest of the frame got lost
+                return False
+            t_rx = time.monotonic()
+            stats.add(fr.ST_RX_BYTES, rx_n)
+            if rx_n >= rx_buffer_len:
+                stats.add(fr.ST_RX_FULL)
+            if use_trace:
+                trc.rx(rx_buffer, rx_n)
+            if use_flow:
+                rx_flow(rx_n)
+            if log.enabled(log.DEBUG):  # rx_buffer[:rx_n] is a copy
+                log.debug("ck_uart(): ", "rcvd data= {}", rx_buffer[:rx_n])
+        i = parser.feed(rx_buffer, rx_i, rx_n)
+        if i == -1:
+            rx_i = rx_n
+            continue
+        rx_i = i
+        stats.add(fr.ST_RX_FRAMES)
+        if parser.frame[fr.CODE] == fr.CREDIT:
+            flow.granted(parser.frame[fr.SRC], parser.payload())
+            continue
+        if parser.frame[fr.DST] == fr.BCAST or parser.frame[fr.CODE] in push_dict:
+            hdl_push()
+            continue
+        if pend and hdl_deferred():
+            continue
+        return True
+
+"""
+    Function ck_uart()
 
-def ck_uart():
-    global rx_buffer, rx_buffer_s, my_debug, last_req_sent, my_ads, default_s_dt, unix_dt, ACK_rcvd, msg_valid
-    TAG = tag_adj('ck_uart():  ')
-    nr_bytes = 0
-    delay_ms = 0.2
-    u_start = time.monotonic()
-    msg = ''
-    s_req = ''
-    le_msg = 0
-    u_end = u_start + 20
-    f_dict = None
+    :param  dict node, int seq
+    :return int, 1 if a reply was received, 0 on timeout or NAK, or -1
+
+    This function waits for the ACK and the reply of the node to the request
+    with sequence number seq. If the reply does not arrive within the retransmission
+    timeout of the node (node['rtt'], see sercom_frame.Rtt), the request is sent again
+    with the same sequence number (so a late reply still counts), with exponential backoff,
+    at most node['retries'] times and while the retry budget lasts (see retry_ok()).
+    Then it waits at most node['timeout'] seconds after the last request sent.
+    The payload of the reply is handed to the handler of the request code (see rx_handlers).
+    Bytes received after the reply stay in rx_buffer for the next call.
+    In case of a KeyboardInterrupt during the execution of this function, this function
+    will return a value of -1, herewith 'signalling' the called function
+    that a KeyboardInterrupt has occurred.
+"""
+def ck_uart(node, seq):
+    global ACK_rcvd
+    TAG = "ck_uart(): "
+    delay_ms = 0.02
+    rtt = node.get('rtt', None)
+    if rtt is None:
+        rtt = node['rtt'] = fr.Rtt(rto_min=rto_min, rto_max=node['timeout'])
+    retries = node.get('retries', max_retries)
+    tries = 0
+    last = False  # no retransmissions left: wait until the timeout of the node
+    t_sent = time.monotonic()
+    u_end = t_sent + rtt.rto  # no ACK by then: send again
     ACK_rcvd = False
-    STX_rcvd = False
-    STX_idx = -1
-    t_buf = None
-    cln = ''
-    b_start = b_end = 0
-    b1 = False
-    msg_valid = False
     try:
-        empty_buffer()  # clear the rx_buffer
         while True:
-            u_now = time.monotonic()
-            if u_now > u_end:
-                print(TAG+"timed-out")
-                nr_bytes = 0
-                break
-            #-----------------------------------------------------
-            rx_buffer = uart.read(rx_buffer_len)  # Reception here
-            #-----------------------------------------------------
-            if rx_buffer is None:
+            if not next_frame():
+                now = time.monotonic()
+                if now > u_end:
+                    if not last and tries < retries and retry_ok():
+                        tries += 1
+                        log.info(TAG, "no {} from node 0x{:x}. Retry {}", 'reply' if ACK_rcvd else 'ACK', node['ads'], tries)
+                        if send_req(node['ads'], node['req'], node.get('payload', None), seq) == -1:
+                            return -1
+                        ACK_rcvd = False
+                        t_sent = time.monotonic()
+                        u_end = t_sent + rtt.backoff(tries)
+                        continue
+                    if not last:
+                        last = True
+                        if t_sent + node['timeout'] > u_end:
+                            u_end = t_sent + node['timeout']
+                            continue
+                    log.warning(TAG, "timed-out waiting for node 0x{:x}", node['ads'])
+                    stats.add(fr.ST_TIMEOUTS)
+                    return 0
                 time.sleep(delay_ms)
                 continue  # Go around
-            nr_bytes = len(rx_buffer)
-            if nr_bytes is None:
-                time.sleep(delay_ms)
-                continue
-            if not nr_bytes:
-                time.sleep(delay_ms)
-                continue
-            if my_debug:
-                print(TAG+f"nr of bytes received= {nr_bytes}")
-                print(TAG+f"rcvd data= {rx_buffer}" ,end="\n")
-            if nr_bytes >0:
-                rx_buffer_s = rx_buffer.decode() # convert to a buffer of strings
-                rx_buffer = None # Cleanup
-                #-------------------------------------------------------
-                uart.reset_input_buffer()  # Clear the uart buffer
-                #-------------------------------------------------------
-                if nr_bytes == 2 and not ACK_rcvd:
-                    ACK_rcvd = True if nr_bytes ==2 and (rx_buffer_s.find(chr(_ACK)) == 1) else False
-                    time.sleep(delay_ms)
-                    continue  # loop to receive the message
-                if nr_bytes > 2:
-                    if not STX_rcvd:
-                        STX_rcvd = True if rx_buffer_s.find(chr(_STX)) == 2 else False
-                        if STX_rcvd:
-                            STX_idx = 2
-                    # Check the STX flag again. Could be changed in last lines above
-                    if STX_rcvd:
-                        le_msg = ord(rx_buffer_s[STX_idx -1])
-                        b_start = STX_idx + 1
-                        b_end = b_start + le_msg
-                        msg = rx_buffer_s[b_start : b_end]
-                        ads = ord(rx_buffer_s[0])
-                        if ads == my_ads:
-                            if last_req_sent == req_rev_dict['date_time']:
-                                if len(rx_buffer_s) >= le_msg:
-                                    msg_valid = rx_buffer_s[-3] == ':' and rx_buffer_s[-6] == ':' and rx_buffer_s[-12] == '-' and rx_buffer_s[-15] == '-'
-                                    s = "message is{} valid".format('' if msg_valid else ' not')
-                                    print(TAG+s)
-                                    if msg_valid:
-                                        #-------------------------------------------------
-                                        default_s_dt = msg    # Global datetime var set
-                                        #-------------------------------------------------
-                                        break  # Done!
-                                    else:
-                                        nr_bytes = 0
-                                        break
-                                else:
-                                    time.sleep(delay_ms)
-                                    continue
-                            if last_req_sent == req_rev_dict['unix_time']:
-                                msg_valid = True
-                                unix_dt = int(float(msg))
-                                break  # Done!
-            empty_buffer()
-            nr_bytes = 0
-            msg = ''
-            ACK_rcvd = False
-            STX_rcvd = False
-            STX_idx = 0
-            time.sleep(delay_ms)
+            f = parser.frame
+            if f[fr.SRC] != node['ads'] or f[fr.SEQ] != seq:
+                log.debug(TAG, "frame from 0x{:x} seq {} ignored", f[fr.SRC], f[fr.SEQ])
+                continue  # a late reply to an earlier request
+            code = f[fr.CODE]
+            if code == fr.ACK:
+                ACK_rcvd = True
+                continue  # loop to receive the message
+            if code == fr.NAK:
+                log.warning(TAG, "node 0x{:x} does not serve request {}", node['ads'], node['req'])
+                stats.add(fr.ST_NAK)
+                return 0
+            if code == fr.PEND:
+                # The reply follows later. next_frame() hands it to hdl_deferred()
+                if not tries:
+                    rtt.sample(time.monotonic() - t_sent)
+                pl = parser.payload()
+                pend[(node['ads'] << 8) | seq] = node
+                node['pend_end'] = time.monotonic() + (pl[0] if len(pl) else 0) + node['timeout']
+                log.info(TAG, "node 0x{:x} sends the {} later", node['ads'], req_dict.get(node['req'], ''))
+                return 1
+            if code == node['req']:
+                if not tries:
+                    rtt.sample(time.monotonic() - t_sent)  # only a request sent once is measured
+                if not ACK_rcvd:
+                    stats.add(fr.ST_NAK)  # the ACK got lost
+                hdl = rx_handlers.get(code, None)
+                if hdl is None:
+                    log.info(TAG, "{} received: {}", req_dict.get(code, code), bytes(parser.payload()))
+                else:
+                    hdl(parser.payload())
+                return 1  # Done!
     except KeyboardInterrupt:
-        nr_bytes = -1
-    return nr_bytes
+        return -1
+
+"""
+    Function send_req()
 
-def send_req(c):
-    global last_req_sent
-    TAG = tag_adj("send_req(): ")
+    :param  int ads, address of the Sensor node; int c, request code; bytes payload;
+            int seq, sequence number of the request to send again, or None for a new request
+    :return int, number of characters sent, or -1
+"""
+def send_req(ads, c, payload=None, seq=None):
+    global last_req_sent, seq_nr, retry_tokens
+    TAG = "send_req(): "
     n = 0
     try:
         if isinstance(c, int):
             if c not in req_dict.keys():
                 return n  # Exit. Cannot send non existing request code.
-            b = bytearray(2)
-            b[0] = target_ads  # Address of 'destination'
-            b[1] = c # request code
-            n = uart.write(b)
+            blk = frame_pool.get()
+            if blk < 0:
+                log.error(TAG, "frame pool exhausted ({}x). Request {} not sent", frame_pool.n_exhausted, c)
+                return n
+            if seq is None:
+                seq_nr = (seq_nr + 1) & 0xFF
+                seq = seq_nr
+                retry_tokens = min(retry_cap, retry_tokens + retry_ratio)
+            try:
+                le = fr.encode(frame_pool.buf(blk), ads, my_ads, c, seq, payload)
+                n = uart_send(blk, le)
+            finally:
+                frame_pool.put(blk)
             if n is None:
-                print(TAG+f"failed to send request: {c}")
+                log.error(TAG, "failed to send request: {}", c)
             elif n > 0:
                 last_req_sent = c  # remember last request code sent
-                s = TAG+"request for \'{}\' sent".format(req_dict[c])
-                print(s)  # Always inform user with send result
+                log.info(TAG, "request for \'{}\' sent to 0x{:x}", req_dict[c], ads)  # Always inform user with send result
     except KeyboardInterrupt:
         n = -1
     return n
 
-def empty_buffer():
-    global rx_buffer, rx_buffer_len
-    rx_buffer = bytearray(rx_buffer_len * b'\x00')
+"""
+    Function retry_ok()
+
+    :param  None
+    :return bool, True if a retransmission may be sent
+
+    The retry budget: each new request adds retry_ratio, each retransmission takes 1,
+    at most retry_cap. When the link is down the retransmissions stop after the budget is spent,
+    instead of multiplying the traffic.
+"""
+def retry_ok():
+    global retry_tokens
+    if retry_tokens >= 1:
+        retry_tokens -= 1
+        return True
+    log.warning("ck_uart(): ", "retry budget spent")
+    return False
+
+"""
+    Function uart_send()
+
+    :param  int blk, block of the pool with the frame; int n, length of the frame
+    :return int, nr of bytes sent, or None
+
+    All frames except CREDIT frames are sent by this function.
+    If the Sensors have not enough room in their receive buffer (see sercom_frame.Flow)
+    it waits for their CREDIT frames, at most credit_wait seconds.
+"""
+def uart_send(blk, n):
+    if use_flow and not flow.can_send(n):
+        flow.n_stalls += 1
+        t_end = time.monotonic() + credit_wait
+        while not flow.can_send(n):
+            if time.monotonic() > t_end:
+                flow.expire(n)
+                log.warning("uart_send(): ", "no credit received. Sending anyway")
+                break
+            if not next_frame():
+                time.sleep(0.005)
+    #-----------------------------------------------------
+    res = uart.write(frame_pool.view(blk, n))
+    #-----------------------------------------------------
+    stats.add(fr.ST_TX_FRAMES)
+    stats.add(fr.ST_TX_BYTES, n)
+    if use_flow:
+        flow.sent(n)
+    if use_trace:
+        trc.tx(frame_pool.buf(blk), n)
+    return res
+
+"""
+    Function send_credit()
+
+    :param  None
+    :return None
+
+    This function sends a CREDIT frame with the free space of our receive buffer.
+"""
+def send_credit():
+    mv = flow.advert()
+    uart.write(mv)
+    stats.add(fr.ST_TX_FRAMES)
+    stats.add(fr.ST_TX_BYTES, len(mv))
+    flow.sent(len(mv))
+    if use_trace:
+        trc.tx(mv, len(mv))
+
+"""
+    Function rx_flow()
+
+    :param  int n, nr of bytes read
+    :return None
+"""
+def rx_flow(n):
+    if flow.received(n):
+        log.warning("ck_uart(): ", "receive buffer full, bytes may be lost ({}x). Increase \'sercom_rxbuf\'", flow.n_rx_full)
+    if flow.need_adv():
+        send_credit()
 
 def make_clock():
-    global clock
-    TAG=tag_adj("make_clock(): ")
+    global clock, clock_digits
+    TAG="make_clock(): "
 
     if use_flipclock:
         TRANSPARENT_INDEXES = range(11)
@@ -238,8 +473,8 @@ def make_clock():
             top_anim_palette.make_transparent(_)
             btm_anim_palette.make_transparent(_)
         gc.collect()
-        if my_debug:
-            print(TAG+f"mem_free= {gc.mem_free()}")
+        if log.enabled(log.DEBUG):
+            log.debug(TAG, "mem_free= {}", gc.mem_free())
         try:
             clock = FlipClock(
                     static_ss,
@@ -259,6 +494,7 @@ def make_clock():
                     medium_level=0.9,
                     h_pos=48,
                     v_pos=54)
+            clock_digits = (clock.digit_0, clock.digit_1, clock.digit_2, clock.digit_3)
             main_group = Group()
             main_group.append(clock)
             # don't go higher than 2.
@@ -266,7 +502,7 @@ def make_clock():
             main_group.scale = 2
             board.DISPLAY.show(main_group)
         except MemoryError as e:
-            print(TAG+f"Error: {e}")
+            log.error(TAG, "Error: {}", e)
 
 def dt_adjust():
     global default_dt, default_s_dt, unix_dt
@@ -278,13 +514,34 @@ def dt_adjust():
         default_s_dt = "{:d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(dt[0],
             dt[1], dt[2], dt[3], dt[4], dt[5])
 
+"""
+    Function upd_digits()
+
+    :param  int hh, int mm
+    :return int, number of digits flipped
+
+    This function compares each of the four digits to show with the digits
+    shown on the flipclock (global disp_digits). Only a digit that changed
+    is set, so only that digit runs its flip animation.
+    At most minute rollovers only the minute units digit changes.
+"""
+def upd_digits(hh, mm):
+    global disp_digits
+    n = 0
+    new_digits = (hh // 10, hh % 10, mm // 10, mm % 10)
+    for i in range(4):
+        if disp_digits[i] != new_digits[i]:
+            clock_digits[i].value = new_digits[i]  # this flips (animates) the digit
+            disp_digits[i] = new_digits[i]
+            n += 1
+    return n
+
 def upd_tm(show_t: bool = False):
-    global clock, default_s_dt, hour_old, min_old
-    TAG=tag_adj("upd_tm(): ")
-    wait = 1
+    global clock, default_s_dt
+    TAG="upd_tm(): "
     ret = 1
     if show_t and not rtc_is_set:
-        print(TAG+"built-in RTC is not set (yet)")
+        log.info(TAG, "built-in RTC is not set (yet)")
         return 0
     if default_s_dt is None:
         return -1
@@ -292,41 +549,26 @@ def upd_tm(show_t: bool = False):
         return -1
     try:
         dt_adjust()
-        p_time = False
         le = len(default_s_dt)
         if le < 16:
-            print(TAG+f"datetime {default_s_dt} invalid.")
+            log.warning(TAG, "datetime {} invalid.", default_s_dt)
             return 0
         hh = int(float(default_s_dt[11:13]))
         mm = int(float(default_s_dt[14:16]))
-        if hh != hour_old:
-           hour_old = hh
-           p_time = True
-        if mm != min_old:
-            min_old = mm
-            p_time = True
-        if p_time:
-            if use_flipclock:
-                try:
-                    fp = "{:02d}".format(hh)
-                    clock.first_pair = fp
-                    fp2 = clock.first_pair
-                    time.sleep(wait)
-                    sp = "{:02d}".format(mm)
-                    clock.second_pair = sp
-                    sp2  = clock.second_pair
-                    time.sleep(wait)
-                    # print(TAG+"time = {}:{}".format(fp2, sp2))
-                except ValueError as e:
-                    print(TAG)
-                    raise
+        if use_flipclock:
+            try:
+                n = upd_digits(hh, mm)
+                log.debug(TAG, "nr of digits flipped: {}", n)
+            except ValueError as e:
+                log.error(TAG, "Error: {}", e)
+                raise
     except KeyboardInterrupt:
         ret = -1
     return ret
 
 def dtstr_to_stru():
     global default_s_dt
-    TAG=tag_adj("dtstr_to_stru(): ")
+    TAG="dtstr_to_stru(): "
     ret = ()
     if isinstance(default_s_dt, str):
         s = default_s_dt
@@ -337,31 +579,404 @@ def dtstr_to_stru():
                 #ret= (yy,         mo,          dd,           hh,            mi,            ss,         wd, yd, isdst)
                 ret = (int(s[:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:]), 0, 0, -1 )
             except ValueError as e:
-                print(TAG+f"Error = {e}")
+                log.error(TAG, "Error = {}", e)
                 raise
     return ret
 
-def tag_adj(t):
-    global tag_le_max
-    le = 0
-    spc = 0
-    ret = t
-    if isinstance(t, str):
-        le = len(t)
-    if le >0:
-        spc = tag_le_max - le
-        ret = ""+t+"{0:>{1:d}s}".format("",spc)
-    return ret
+"""
+    Function add_timer()
+
+    :param  float delay, float period, function cb
+    :return list, the timer
+
+    This function adds a timer that calls cb() when time.monotonic()
+    reaches the deadline: now + delay. If period > 0 the timer is periodic
+    and its next deadline is period seconds after the previous deadline.
+    If period is 0 the timer is a one-shot and is removed after it fired.
+"""
+def add_timer(delay, period, cb):
+    tmr = [time.monotonic() + delay, period, cb]
+    timers.append(tmr)
+    return tmr
+
+def cancel_timer(tmr):
+    if tmr in timers:
+        timers.remove(tmr)
+
+"""
+    Function run_timers()
+
+    :param  None
+    :return float, seconds until the next deadline, or
+                   -1 if a callback returned -1 (stop)
+
+    This function calls the callback of each timer whose deadline has passed.
+    A periodic timer that fell behind (e.g. by a blocking ck_uart())
+    fires once and is re-armed on its next deadline in the future,
+    so an event is never skipped and never fires twice.
+"""
+def run_timers():
+    ret = 0
+    now = time.monotonic()
+    i = len(timers) - 1
+    while i >= 0:
+        if i < len(timers):  # a callback can cancel timers
+            tmr = timers[i]
+            if tmr[0] <= now:
+                if tmr[1] > 0:
+                    while tmr[0] <= now:
+                        tmr[0] += tmr[1]
+                else:
+                    timers.pop(i)
+                if tmr[2]() == -1:
+                    ret = -1
+                now = time.monotonic()
+        i -= 1
+    if ret == -1:
+        return ret
+    if not timers:
+        return t_interval
+    nxt = min(tmr[0] for tmr in timers) - now
+    return nxt if nxt > 0 else 0
+
+def pr_elapsed():
+    log.info("main(): ", "time elapsed: {}", int(time.monotonic() - t_start))
+
+"""
+    Function refresh_tm()
+
+    :param  None
+    :return int, result of upd_tm()
+
+    Timer callback. It updates the flipclock and re-arms itself
+    as a one-shot timer on the next minute boundary of the built-in RTC.
+"""
+def refresh_tm():
+    global refresh_tmr
+    res = upd_tm(False)
+    if rtc_is_set:
+        refresh_tmr = add_timer(60 - time.localtime()[5], 0, refresh_tm)
+    return res
+
+"""
+    Function warm_start()
+
+    :param  None
+    :return None
+
+    Called at boot, right after the flipclock is made. If the built-in RTC kept
+    running (soft reset) it shows that time. Otherwise it sets the RTC to the last
+    known time from the NVM (see sercom_nvm). That time is behind by the time the
+    device was off: the first sync from a Sensor corrects it, also one with an unknown
+    error bound (t_bounded stays False, see accept_time()).
+"""
+def warm_start():
+    global rtc_is_set, refresh_tmr
+    TAG = "warm_start(): "
+    rec = nvs.start(microcontroller.nvm, nvm_ofs, nvm_slots)
+    if time.localtime()[0] >= default_dt[0]:
+        log.info(TAG, "built-in RTC kept running")
+    elif rec is not None:
+        rtc.datetime = time.localtime(rec[0])
+        log.info(TAG, "built-in RTC set to the last known time from NVM. It may be behind")
+    else:
+        log.info(TAG, "no time in NVM")
+        return
+    rtc_is_set = True
+    upd_tm(False)
+    refresh_tmr = add_timer(60 - time.localtime()[5], 0, refresh_tm)
+
+"""
+    Function save_time()
+
+    :param  None
+    :return None
+
+    Called after a sync from a Sensor. It writes the time of the built-in RTC to the NVM,
+    at most once every nvm_period seconds. A time before default_dt (e.g. the year 2000
+    of a Sensor that has no time yet) or with an unknown error bound (t_err_ms) is not
+    saved: warm_start() would restore it.
+"""
+def save_time():
+    global t_nvm
+    now = time.monotonic()
+    if not use_nvm or (t_nvm is not None and now - t_nvm < nvm_period):
+        return
+    if time.localtime()[0] < default_dt[0] or t_err_ms == ERR_UNKNOWN:
+        return
+    if nvs.save(time.time(), nvs.SYNCED):
+        t_nvm = now
+        log.debug("save_time(): ", "time saved in NVM ({} writes)", nvs.n_writes)
+
+"""
+    Function accept_time()
+
+    :param  int err, error bound of a time received (ms, ERR_UNKNOWN: unknown), None: not reported
+    :return bool, True if the time is to be set in the built-in RTC
+
+    A time with an unknown error bound (the Sensor has no time from NTP) is refused
+    only while the time of the built-in RTC came with a known bound (t_bounded).
+    Until then, e.g. after warm_start(), it is accepted. It keeps t_err_ms.
+"""
+def accept_time(err):
+    global t_err_ms, t_bounded
+    t_err_ms = err
+    if err == ERR_UNKNOWN:
+        if t_bounded:
+            log.info("accept_time(): ", "error bound of the time received is unknown. Built-in RTC not changed")
+            return False
+    elif err is not None:
+        log.info("accept_time(): ", "error bound of the time received: {} ms", err)
+    t_bounded = err is not None and err != ERR_UNKNOWN
+    return True
+
+"""
+    Function hdl_date_time()
+
+    :param  memoryview msg, payload of the reply
+    :return None
+
+    Handler of the reply to a 'date_time' request.
+    If the datetime string is valid it sets the built-in RTC,
+    the flipclock and re-aligns the refresh of the flipclock.
+    The string (19 characters) may be followed by the error bound of the time
+    of the Sensor in ms (2 bytes, big-endian, ERR_UNKNOWN: unknown). It is kept in t_err_ms.
+    A time with an unknown error bound (the Sensor has no time from NTP) does not replace
+    a time with a known bound (see accept_time()), and is not saved in the NVM (see save_time()).
+"""
+def hdl_date_time(msg):
+    global default_s_dt, msg_valid, rtc_is_set, refresh_tmr
+    TAG = "main(): "
+    le = len(msg)
+    msg_valid = (le == 19 or le == 21) and msg[4] == 45 and msg[7] == 45 and msg[13] == 58 and msg[16] == 58  # '-' and ':'
+    log.info(TAG, "message is{} valid", '' if msg_valid else ' not')
+    if not msg_valid:
+        stats.add(fr.ST_INVALID)
+        return
+    #-------------------------------------------------
+    default_s_dt = str(bytes(msg[:19]), 'utf-8')    # Global datetime var set
+    #-------------------------------------------------
+    if not accept_time((msg[19] << 8) | msg[20] if le == 21 else None):
+        return
+    dt = dtstr_to_stru()
+    if isinstance(dt, tuple):
+        le = len(dt)
+        if le == 9:
+            dts = time.struct_time(dt)
+            rtc.datetime = dts
+            rtc_is_set = True
+            t_check = time.localtime(time.time())
+            if t_err_ms == ERR_UNKNOWN:
+                log.info(TAG, "built-in RTC is set from the Sensor, which is not sync\'d from NTP")
+            else:
+                log.info(TAG, "built-in RTC is sync\'d from NTP")
+            log.info(TAG, "new time from RTC: {:02d}:{:02d}", t_check[3], t_check[4])
+        else:
+            log.warning(TAG, "result dt {} is invalid. len(dt)= {}. Skipping", dt, le)
+    upd_tm(start)
+    if rtc_is_set:
+        # Re-align the flipclock refresh on the minute boundary of the (new) RTC time
+        cancel_timer(refresh_tmr)
+        refresh_tmr = add_timer(60 - time.localtime()[5], 0, refresh_tm)
+        save_time()
+
+"""
+    Function hdl_push()
+
+    :param  None
+    :return None
+
+    Handler of a frame (in parser.frame) a Sensor sent without being asked.
+    A datetime broadcast is applied to the built-in RTC like the reply to
+    a 'date_time' request, if use_time_bcast. A compact datetime push (9 bytes: year (2 bytes),
+    month, day, hour, minute, second, error bound in ms (2 bytes)) is sent at the minute boundary,
+    so the flipclock flips on the minute. Its error bound is checked like the one of a
+    'date_time' reply (see accept_time()).
+"""
+def hdl_push():
+    global t_push, t_bcast, msg_valid, rtc_is_set, refresh_tmr
+    TAG = "hdl_push(): "
+    f = parser.frame
+    code = f[fr.CODE]
+    if code == 110 and use_time_bcast:  # time_bcast
+        log.info(TAG, "datetime broadcast received from 0x{:x}", f[fr.SRC])
+        hdl_date_time(parser.payload())
+    elif code == 111 and f[fr.LEN] == 9:  # time_push
+        msg = parser.payload()
+        if not accept_time((msg[7] << 8) | msg[8]):
+            return
+        rtc.datetime = time.struct_time(((msg[0] << 8) | msg[1], msg[2], msg[3], msg[4], msg[5], msg[6], 0, -1, -1))
+        rtc_is_set = True
+        msg_valid = True
+        upd_tm(False)
+        cancel_timer(refresh_tmr)
+        refresh_tmr = add_timer(60 - msg[6], 0, refresh_tm)
+        save_time()
+        log.debug(TAG, "datetime push received from 0x{:x}", f[fr.SRC])
+    else:
+        return
+    if not msg_valid:
+        return
+    if code == 111:
+        t_push = time.monotonic()
+    else:
+        t_bcast = time.monotonic()
+
+"""
+    Function listen()
+
+    :param  None
+    :return None
+
+    Timer callback. Between the polls of the nodes it handles the broadcast
+    and pushed frames and the deferred replies received. Other frames (e.g. late replies)
+    are dropped. A node whose deferred reply did not arrive in time is polled again.
+"""
+def listen():
+    global poll_tmr
+    while next_frame():
+        f = parser.frame
+        log.debug("listen(): ", "frame from 0x{:x} code {} dropped", f[fr.SRC], f[fr.CODE])
+    if pend:
+        now = time.monotonic()
+        for key in [k for k, nd in pend.items() if now > nd['pend_end']]:
+            nd = pend.pop(key)
+            nd['pend_end'] = 0.0
+            nd['fails'] += 1
+            nd['due'] = now
+            stats.add(fr.ST_TIMEOUTS)
+            log.warning("listen(): ", "no deferred reply from node 0x{:x}", nd['ads'])
+            cancel_timer(poll_tmr)
+            poll_tmr = add_timer(0, 0, poll_nodes)
+
+"""
+    Function hdl_deferred()
+
+    :param  None
+    :return bool, True if the frame in parser.frame was a deferred reply
+
+    A node that answered a request with PEND (see ck_uart()) sends the reply later,
+    with the code and the sequence number of the request. This function hands it
+    to the handler of the request code (see rx_handlers).
+"""
+def hdl_deferred():
+    f = parser.frame
+    key = (f[fr.SRC] << 8) | f[fr.SEQ]
+    nd = pend.get(key, None)
+    if nd is None or f[fr.CODE] != nd['req']:
+        return False
+    del pend[key]
+    nd['pend_end'] = 0.0
+    log.info("hdl_deferred(): ", "deferred {} received from 0x{:x}", req_dict.get(nd['req'], ''), nd['ads'])
+    hdl = rx_handlers.get(nd['req'], None)
+    if hdl is not None:
+        hdl(parser.payload())
+    return True
+
+def hdl_subscribe(msg):
+    log.info("main(): ", "subscription {}", "accepted" if len(msg) and msg[0] else "refused")
+
+"""
+    Function hdl_stats()
+
+    :param  msg, payload of the reply to a 'stats' request
+    :return None
+
+    Handler of the reply to a 'stats' request: the link counters of the Sensor
+    (see sercom_frame.Stats). They are kept in node_stats.
+"""
+def hdl_stats(msg):
+    ads = parser.frame[fr.SRC]
+    st = fr.unpack_stats(msg)
+    node_stats[ads] = st
+    log.info("main(): ", "link stats of 0x{:x}: {}", ads, st)
+
+def hdl_unix_time(msg):
+    global unix_dt, msg_valid
+    msg_valid = True
+    unix_dt = int(float(str(bytes(msg), 'utf-8')))
+
+# Handlers of the replies. Key: request code
+rx_handlers = {
+    100: hdl_date_time,
+    101: hdl_unix_time,
+    103: hdl_subscribe,
+    104: hdl_stats,
+}
+
+"""
+    Function poll_nodes()
+
+    :param  None
+    :return int, -1 if a KeyboardInterrupt occurred
+
+    Timer callback. It polls each node that is due, lowest prio first and,
+    within the same prio, the node that is due the longest first (round-robin).
+    Each poll is one request, sent again if needed (see ck_uart()). After a failed
+    poll the node is polled again after poll_backoff seconds, doubled each failure.
+    A node is not polled while its deferred reply is on its way (see hdl_deferred()).
+    A 'date_time' node is not polled while datetime broadcasts or pushes arrive,
+    a 'subscribe' node not while the pushes arrive: a subscription is renewed
+    every sub_renew seconds, or as soon as the pushes stop, e.g. after a reset of the Sensor.
+    Then it re-arms itself on the deadline of the node that is due next.
+"""
+def poll_nodes():
+    global start, poll_tmr
+    TAG="main(): "
+    res = 0
+    now = time.monotonic()
+    due = [nd for nd in nodes if nd['due'] <= now]
+    due.sort(key=lambda nd: (nd['prio'], nd['due']))
+    for nd in due:
+        pend_end = nd.get('pend_end', 0.0)
+        if pend_end:
+            nd['due'] = pend_end + listen_period  # its deferred reply is on its way. See listen()
+            continue
+        t = None
+        if nd['req'] == 103:
+            t = t_push  # only the pushes show that the subscription is alive
+            if now - nd.get('t_req', 0.0) >= sub_renew:
+                t = None  # renew it before the Sensor drops it
+        elif nd['req'] == 100:
+            t = t_bcast if t_push is None or (t_bcast is not None and t_bcast > t_push) else t_push
+        if t is not None and now - t < nd['period']:
+            # The datetime broadcasts or pushes keep the RTC in sync. No need to ask for it
+            while nd['due'] <= now:
+                nd['due'] += nd['period']
+            continue
+        res = send_req(nd['ads'], nd['req'], nd.get('payload', None))
+        if res == -1:
+            return res
+        nd['t_req'] = now
+        gc.collect()
+        # Check and handle incoming replies
+        nr_bytes = ck_uart(nd, seq_nr)
+        if nr_bytes == -1:
+            return nr_bytes
+        nd['fails'] = 0 if nr_bytes > 0 else nd['fails'] + 1
+        now = time.monotonic()
+        if nd['fails']:
+            # Poll again soon, with exponential backoff, not a whole period later
+            nd['due'] = now + min(nd['period'], poll_backoff * (1 << min(nd['fails'] - 1, 10)))
+        else:
+            while nd['due'] <= now:
+                nd['due'] += nd['period']
+    gc.collect()
+    if log.enabled(log.INFO):
+        log.info(TAG, "mem_free= {}", gc.mem_free())
+    start = False
+    poll_tmr = add_timer(min(nd['due'] for nd in nodes) - time.monotonic(), 0, poll_nodes)
+    return res
 
 def main():
-    global t_start, rtc, rtc_is_set
-    TAG=tag_adj("main(): ")
-    dt = None
+    global t_start, poll_tmr
+    TAG="main(): "
     gc.collect()
     if id.find('pros3') >= 0:
             role = roles_dict[1]
     elif id.find('titano') >= 0:
         role = roles_dict[0]
+    setup()  # shows the last known time at once. See warm_start()
     # Give user time to set up a terminal window or so
     time.sleep(5)
     print()
@@ -372,80 +987,32 @@ def main():
     print(f"Running on an {id.upper()}")
     print(f"in the role of {role}")
     print('=' * 36)
-    setup()
-    res = 0
-    start = True
-    t_shown = False
-    t_elap_old = 0
     stop = False
-    t_elapsed = 0
-    t_curr = time.monotonic()
-    t_interval = 60 # in the future set to 600 (10 minutes)
+    t_start = time.monotonic()
+    add_timer(10, 10, pr_elapsed)
+    now = time.monotonic()
+    for nd in nodes:
+        nd['due'] = now
+    poll_tmr = add_timer(0, 0, poll_nodes)
+    add_timer(listen_period, listen_period, listen)
     try:
         while True:
-            t_curr = time.monotonic()
-            t_elapsed = int(float(t_curr - t_start))
-            if t_elapsed > 0 and t_elapsed % 10 == 0:
-                if t_elap_old != t_elapsed:
-                    t_elap_old = t_elapsed
-                    print(TAG+f"time elapsed: {t_elapsed}")
-            if rtc_is_set and (start or (t_elapsed > 0 and t_elapsed % 60 == 0)):
-                # At minute interval update the flipclock display
-                res = upd_tm(False)
-                if res == -1:
-                    stop = True
-                    break
-            if start or (t_elapsed > 0 and t_elapsed % t_interval == 0):
-                t_start = t_curr
-                t_shown = False
-                rtc_is_set = False  # sync buitl-in RTC from NTC)
-                req = req_rev_dict['date_time']
-                res = send_req(req)
-                if res == -1:
-                    stop = True
-                    break
-                gc.collect()
-                # Check and handle incoming requests and control codes
-                nr_bytes = ck_uart()
-                if nr_bytes == -1:
-                    stop = True
-                    break
-                gc.collect()
-                print(TAG+f"mem_free= {gc.mem_free()}")
-                if isinstance(default_s_dt, str):
-                    if len(default_s_dt) > 0:
-                        if not rtc_is_set and msg_valid:
-                            dt = dtstr_to_stru()
-                            if isinstance(dt, tuple):
-                                le = len(dt)
-                                if le == 9:
-                                    dts = time.struct_time(dt)
-                                    rtc.datetime = dts
-                                    rtc_is_set = True
-                                    t_check = time.localtime(time.time())
-                                    print(TAG+f"built-in RTC is sync\'d from NTP")
-                                    print(TAG+"new time from RTC: {:02d}:{:02d}".format(t_check[3], t_check[4]))
-                                else:
-                                    print(TAG+f"result dt {dt} is invalid. len(dt)= {le}. Skipping")
-                        if start:
-                            res = upd_tm(True)
-                        else:
-                            res = upd_tm(False)
-                        if res == -1:
-                            stop = True
-                            break
-
-                start=False
-                gc.collect()
-            time.sleep(0.75)
+            dly = run_timers()
+            if dly == -1:
+                stop = True
+                break
+            # Sleep exactly until the next deadline
+            time.sleep(dly)
         if stop:
-            print(TAG+"we're going to stop...")
+            log.info(TAG, "we're going to stop...")
             raise KeyboardInterrupt
     except KeyboardInterrupt:
-        print("keyboard interrupt. Exiting...")
+        log.info(TAG, "keyboard interrupt. Exiting...")
+        if use_trace:
+            trc.flush()
         sys.exit()
     except ValueError as e:
-        print("ValueError", e)
+        log.error(TAG, "ValueError {}", e)
         raise
 
 if __name__ == '__main__':
@@ -19,6 +19,10 @@
     The reason for 'moving' certain tasks to another MCU is to prevent memory memory errors.
     The bitmapped spritesheets used in this script consume a large part of the memory available
     in the PyPortal Titano.
+
+    OBSOLETE: this script sends the requests of the earlier version of sercom_I2C.
+    The 'Sensor' script of Version_02 only answers the frames of lib/sercom_frame.py.
+    Use code.py.
 """
 
 import time
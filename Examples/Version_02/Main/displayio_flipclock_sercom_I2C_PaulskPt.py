@@ -11,6 +11,10 @@
     Advanced example that shows how you can use the
     FlipClock displayio object along with the adafruit_ntp library
     to show and update the current time with a FlipClock on a display.
+
+    OBSOLETE: this script sends the requests of the earlier version of sercom_I2C.
+    The 'Sensor' script of Version_02 only answers the frames of lib/sercom_frame.py.
+    Use code.py.
 """
 
 import time
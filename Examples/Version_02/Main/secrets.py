@@ -8,6 +8,7 @@ secrets = {
     'LOCAL_TIME_FLAG' : "1",
     'timezone' : 'Europe/Lisbon', # http://worldtimeapi.org/timezones
     'tz_offset' : '1',
+    # 'sercom_rxbuf' : '128',  # size of the UART receive buffer (bytes, at least 2 frames)
     # 'timezone' : 'America/New_York',
     # 'tz_offset' : '-4',
     # 'timezone' : 'America/Kentucky/Louisville',
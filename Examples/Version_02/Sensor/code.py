@@ -13,18 +13,15 @@ import time, gc, os
 import sys
 from busio import UART
 from micropython import const
-import pros3
 from rtc import RTC
-from digitalio import DigitalInOut
-import ipaddress
-import ssl
-from adafruit_ntp import NTP_TO_UNIX_EPOCH, NTP
-import socketpool
-import time
-import wifi
-from collections import OrderedDict
+import struct
+from array import array
+import sercom_log as log
+import sercom_frame as fr
+import sercom_trace as trc
 
-sercom_I2C_version = 2.0
+sercom_I2C_version = 2.1
+t_boot = time.monotonic()  # start of this script. See ck_uart(): time to the first response
 
 try:
     from secrets import secrets
@@ -32,8 +29,7 @@ except ImportError:
     print("WiFi secrets are kept in secrets.py, please add them there!")
     raise
 
-_STX = const(0x02)  # Start-of-text ASCII code
-_ACK = const(0x06)  # Acknowledge ASCII code
+_NTP_TO_UNIX_EPOCH = const(2208988800)  # seconds from 1900-01-01 to 1970-01-01
 
 roles_dict = {
     0: 'Main',
@@ -43,18 +39,48 @@ roles_dict = {
 req_dict = {
    100: 'date_time',  # 100 dec = 64 hex
    101: 'unix_time',
-   102: 'weather'
+   102: 'weather',
+   103: 'subscribe',  # payload: request code to push, cadence in seconds (2 bytes). Cadence 0: each minute
+   104: 'stats'       # reply: the link counters of this device. See send_stats()
+   }
+
+# Codes of frames this device sends without being asked
+push_dict = {
+   110: 'time_bcast',  # datetime broadcast to all devices
+   111: 'time_push',   # compact datetime pushed to a subscriber. See send_pushes()
    }
 
 # Buffers
-rx_buffer_len = 2
-rx_buffer = bytearray(rx_buffer_len * b'\x00')
+max_payload = 32  # max length of the payload of a frame. See sercom_frame
+# Size of the receive buffer of the UART. It can be set in secrets.py, e.g.: 'sercom_rxbuf' : '256'
+rx_buffer_len = int(secrets.get("sercom_rxbuf", "128"))
+rx_buffer = bytearray(rx_buffer_len)
+rx_i = 0  # index of the first byte in rx_buffer not parsed yet. See ck_uart()
+rx_n = 0  # nr of bytes in rx_buffer
+t_rx = 0.0  # time.monotonic() of the last bytes received
+frame_gap = 0.1  # seconds without bytes after which a part of a frame is dropped. See next_frame()
+# The frames to send are built in the blocks of a pool, allocated once. See send_to()
+pool_blocks = 4
+frame_pool = fr.Pool(pool_blocks, max_payload + fr.OVERHEAD)
+push_pl = bytearray(9)  # payload of the datetime pushes. See send_pushes()
 
 """ Global flags """
 # Global debug flag. Set it to true to receive more information to the REPL
-my_debug = False
+my_debug = False  # Set to True for log level DEBUG. See sercom_log
 use_ntp = True
 use_local_time = None
+# Broadcast the datetime to all devices every bcast_interval seconds. See send_bcast()
+use_time_bcast = True
+# Keep broadcasting while devices subscribed to the pushes (see subscribe()), for the devices
+# that only listen to the broadcasts. False: the pushes replace the broadcasts
+bcast_with_subs = False
+use_ping = False  # Set to True to ping ping_host after (re)connecting WiFi. See do_connect()
+use_trace = False  # Record the bytes on the UART. See sercom_trace
+use_flow = True  # Credit-based flow control. See sercom_frame.Flow
+# Serve the UART at once, from the built-in RTC, and bring up WiFi and NTP when idle. See net_start()
+use_fast_start = True
+# Answer a request that needs the network with PEND at once and send the reply when it is ready. See send_dt_ntp()
+use_deferred = True
 
 """ Pre-definitions of functions """
 def dtstr_to_tpl():
@@ -73,26 +99,125 @@ uart = UART(board.SDA, board.SCL, baudrate=4800, timeout=0, receiver_buffer_size
 """ Other global variables """
 id = board.board_id
 main_ads = 0x20
-sensor_ads = 0x25
-pool = None
+# The address of this device on the bus. Give each Sensor its own address in secrets.py ('sercom_ads')
+sensor_ads = int(secrets.get("sercom_ads", "0x25"), 16)
+# The request codes this device serves. To offload different tasks to different Sensors
+# set the codes per device in secrets.py, e.g.: 'sercom_reqs' : '100,101'
+# The 'weather' request (102) is not implemented: it gets a NAK
+served_reqs = tuple(int(c) for c in secrets.get("sercom_reqs", "100,101,103,104").split(','))
+parser = fr.Parser(sensor_ads, max_payload, bcast=True)  # broadcasts: flow control
+frame_pending = False  # a request is waiting in parser.frame. See uart_send()
+flow = fr.Flow(sensor_ads, rx_buffer_len, max_payload + fr.OVERHEAD)
+credit_wait = 0.5  # max seconds a frame waits for credit. See uart_send()
+stats = fr.Stats()  # link counters. See send_stats()
+req_src = main_ads  # address of the device that sent the request being handled
+req_seq = 0         # sequence number of the request being handled
+# The requests received wait in a queue until loop() serves them, by priority. See sercom_frame.Queue
+req_q = fr.Queue(8, max_payload)
+req_slot = -1  # slot in req_q of the request being handled
+# Background work is queued too, with a code that is not a request code
+JOB_NTP = 200  # NTP sync queued by send_dt_ntp(), send_bcast() and ck_uart(), one server per job. See ntp_job()
+JOB_DT = 201   # deferred reply to a 'date_time' request. See send_dt_late()
+# Priority per request code, 0 is served first. Codes not listed: prio_default
+req_prio = {100: 0, 101: 0, 103: 1, 104: 1, 102: 3, JOB_DT: 5, JOB_NTP: 9}
+prio_default = 2
+# Seconds a request may wait in the queue, per request code. After that it is dropped:
+# the Main stopped waiting for it. Codes not listed wait until they are served
+req_ttl = {102: 10.0, 104: 5.0}
+pend_pl = bytes((10,))  # payload of a PEND frame: the seconds a deferred reply may take
+# The last reply sent to each device. A retransmitted request gets it again. See send_to() and ck_uart()
+replies = fr.Replies(4, max_payload + fr.OVERHEAD)
+# Request codes of which the reply does not depend on the device that asks. Identical requests
+# that wait in the queue get the reply of the first one, the handler runs once. See coalesce()
+req_coalesce = (100, 101, JOB_DT)
+job_req = {JOB_DT: 100}  # the request code a queued job sends the reply of
+n_coalesced = 0  # requests answered with the reply to an identical request
+bcast_interval = 60  # seconds between two datetime broadcasts
+bcast_next = 0.0     # time.monotonic() of the next datetime broadcast
+bcast_seq = 0
+# NTP syncs. After ntp_interval seconds a sync is due when the error bound of the built-in RTC
+# (see rtc_err_ms()) exceeds ntp_max_err_ms, or after ntp_interval_max seconds. See ntp_due()
+ntp_interval = 600   # seconds between two NTP syncs, at least
+ntp_interval_max = 86400
+ntp_max_err_ms = 250
+ntp_retry = 60       # seconds between two sync attempts while NTP does not answer
+ntp_tried = None     # time.monotonic() of the last sync attempt
+# Subscribers to pushed datetime frames:
+# {address: [cadence (s), time.monotonic() of the next push, time.monotonic() of the last subscribe]}
+subs = {}
+max_subs = 8
+sub_ttl = 900  # seconds: a subscription that is not renewed within this time is dropped. See expire_subs()
+rtc_mono = None  # time.monotonic() at a second boundary of the built-in RTC. See get_NTP()
+pool = None  # one socketpool, created once. See get_pool()
 ip = None
+last_ap = None  # (bssid, channel) of the last access point we connected to
+dns_dict = {}   # cache of resolved host names: {host: (address, expiry time)}
+dns_ttl = 300   # seconds a resolved host name stays in dns_dict
+ping_host = 'google.com'
 s_ip = '0.0.0.0'
+# Table of scanned WiFi access points. Entry i of each column belongs to AP nr i. See do_scan()
 ap_cnt = 0   # count of WiFi access points
-ap_dict = {} # dictionary of WiFi access points
+ap_ssid = []         # SSIDs (str)
+ap_bssid = []        # BSSIDs (bytes)
+ap_rssi = array('b') # RSSI in dBm
+ap_chan = array('B') # channel
+ap_rssi_idx = bytearray()  # AP nrs sorted on RSSI, strongest first
+ap_chan_idx = bytearray()  # AP nrs sorted on channel
 req_rcvd = 0
 msg_nr = 0
 rtc = None
 rtc_is_set = False
 default_tpl_dt = (2022,10,10,1,15,1,283,0,-1)  # type tuple
+rtc_year_min = default_tpl_dt[0]  # an RTC before this year has no time (default_tpl_dt follows the RTC)
 default_dt = time.struct_time((default_tpl_dt)) # type time.struct_time
 default_s_dt = "2022-10-10 01:15:00"  # type str
 epoch = None
 clock = None
-ntp = None
+# NTP. See get_NTP(). The list of servers can be set in secrets.py ('ntp_servers')
+ntp_servers = ['pool.ntp.org', 'time.google.com', 'time.cloudflare.com']
+ntp_port = 123
+ntp_timeout = 1.0  # seconds to wait for the reply of one server
+ntp_sock = None    # one UDP socket, created once. See ntp_query()
+ntp_srv_i = 0      # index in ntp_servers of the next server to query. See ntp_step()
+ntp_best = None    # the best reply of the servers queried so far
+ntp_buf = bytearray(48)
+# Result of the last sync: server used, offset of the RTC and round-trip delay (ms)
+ntp_stats = {'server': None, 'offset_ms': 0.0, 'delay_ms': 0.0, 'queries': 0, 'fails': 0, 'syncs': 0, 't_sync': None, 'holds': 0}
+# Drift of the built-in RTC, learned from the offsets of successive NTP syncs. See drift_sample()
+# While NTP does not answer (holdover) the RTC is corrected for it. See rtc_hold()
+use_drift = True
+rtc_ppm_max = 50.0  # frequency error of the RTC crystal, before it is measured (ppm)
+drift_wander = 1.0  # ppm the frequency may change between two syncs (temperature)
+drift_min_s = 300   # seconds between two syncs needed for a drift sample
+drift_ppm = 0.0     # estimated frequency error of the RTC (ppm, +: the RTC runs fast)
+drift_dev = rtc_ppm_max  # uncertainty of drift_ppm (ppm)
+drift_n = 0         # drift samples
+rtc_set_mono = None # time.monotonic() when NTP set the RTC, None: never
+rtc_set_s = 0       # the RTC seconds set then
+rtc_set_ofs = 0.0   # true time - RTC then (s): the RTC is not set exactly on the second boundary
+rtc_err0_ms = 0.0   # error of the RTC when it was set: half the NTP round-trip delay, the tick and rtc_set_ofs
+rtc_adj = 0.0       # seconds the RTC was stepped by rtc_hold() since it was set
+rtc_step_min = 0.05 # seconds: a smaller correction waits for the next rtc_hold()
+rtc_hold_mono = 0.0 # time.monotonic() of the last step (or of the set)
+ERR_UNKNOWN = 0xFFFF  # error bound in the datetime payload: the RTC was not set by NTP. See dt_payload()
+dt_pl = bytearray(21)
 start = True
 t_start = time.monotonic()
+t_first = None   # seconds from the start of this script to the first ACK sent
+# The modules wifi, socketpool and ipaddress are imported at their first use. See radio()
+wifi = None
+net_ready = False  # WiFi and NTP may be used. With use_fast_start: after net_start()
+net_delay = 5.0    # seconds without requests after setup() before net_start()
+net_due = 0.0      # time.monotonic() of net_start()
+diag_delay = 30.0  # seconds after net_start() before the network diagnostics. See net_diag()
+diag_due = None    # time.monotonic() of net_diag(), None: not planned
 tz_offset = 0
-tag_le_max = 25  # see tag_adj()
+trace_size = 2048  # size of the trace buffer
+trace_path = 'trace_sensor.bin'  # if the CIRCUITPY drive is read-only the trace goes to the REPL
+log_ring_len = 64  # nr of log lines kept in RAM. See sercom_log.dump()
+log.tag_le_max = 25
+log.set_level(log.DEBUG if my_debug else log.INFO)
+log.set_ring(log_ring_len)
 
 if not use_ntp:
     default_dt = time.struct_time((2022, 9, 17, 12, 0, 0, 5, 261, -1))
@@ -102,21 +227,72 @@ if not use_ntp:
 
 print()
 my_WiFi_SSID = os.getenv("CIRCUITPY_WIFI_SSID")
-if my_debug:
-    print("my_env=", my_WiFi_SSID)
+log.debug("code.py: ", "my_env= {}", my_WiFi_SSID)
+
+"""
+    Function radio()
+
+    :param  None
+    :return wifi.radio
+
+    This function imports the wifi module at the first call.
+"""
+def radio():
+    global wifi
+    if wifi is None:
+        import wifi as w
+        wifi = w
+    return wifi.radio
+
+"""
+    Function do_scan()
 
+    :param  None
+    :return None
+
+    This function scans the WiFi access points. It fills the table of
+    access points (ap_ssid, ap_bssid, ap_rssi, ap_chan) and builds the
+    indexes on RSSI (ap_rssi_idx) and on channel (ap_chan_idx).
+"""
 def do_scan():
-    global ap_cnt, ap_dict
-    TAG = tag_adj("do_scan(): ")
-    for network in wifi.radio.start_scanning_networks():
-        ap_dict[ap_cnt] = {"ap_nr": ap_cnt, "ssid": str(network.ssid, "utf-8"), "rssi": network.rssi, "channel": network.channel}
+    global ap_cnt, ap_ssid, ap_bssid, ap_rssi, ap_chan, ap_rssi_idx, ap_chan_idx
+    TAG = "do_scan(): "
+    ap_cnt = 0
+    ap_ssid = []
+    ap_bssid = []
+    ap_rssi = array('b')
+    ap_chan = array('B')
+    for network in radio().start_scanning_networks():
+        if ap_cnt > 255:
+            break  # the indexes are bytearrays
+        ap_ssid.append(network.ssid)
+        ap_bssid.append(bytes(network.bssid))
+        ap_rssi.append(network.rssi)
+        ap_chan.append(network.channel)
         ap_cnt += 1
-    wifi.radio.stop_scanning_networks()
-    if my_debug:
-        print("ap_dict=", ap_dict)
+    radio().stop_scanning_networks()
+    ap_rssi_idx = bytearray(sorted(range(ap_cnt), key=lambda i: -ap_rssi[i]))
+    ap_chan_idx = bytearray(sorted(range(ap_cnt), key=lambda i: ap_chan[i]))
+    log.debug(TAG, "nr of access points found= {}", ap_cnt)
+
+"""
+    Function best_ap()
+
+    :param  str ssid
+    :return tuple (bssid, channel) or None
+
+    This function returns the BSSID and channel of the access point
+    with the strongest signal that broadcasts ssid.
+    If ssid is not in the table of scanned access points it returns None.
+"""
+def best_ap(ssid):
+    for i in ap_rssi_idx:
+        if ap_ssid[i] == ssid:
+            return (ap_bssid[i], ap_chan[i])
+    return None
 
 def pr_scanned_ap(sort_order: int=0):
-    TAG = tag_adj("pr_scanned_ap(): ")
+    TAG = "pr_scanned_ap(): "
     sort_dict = {0: 'ap_nr', 1: 'rssi', 2: 'channel'}
     le = len(sort_dict)
     n_max = le-1
@@ -125,50 +301,90 @@ def pr_scanned_ap(sort_order: int=0):
     else:
         s = "Value sort_order must be between 0 and {}".format(n_max)
         raise ValueError(s)
-    print("\n"+TAG+"\nAvailable WiFi networks (sorted on: \'{}\')".format(sort_on))
-    if len(ap_dict) > 0:
+    log.info(TAG, "Available WiFi networks (sorted on: \'{}\')", sort_on)
+    if ap_cnt > 0:
         if sort_on == 'ap_nr':
-            od = OrderedDict(sorted(ap_dict.items(), key= lambda x: x[1]['ap_nr'], reverse=False))
-            for k, v in od.items():
-                s = "\tAP nr {:2d}\tSSID: {:30s}\tRSSI: {:d}\tChannel: {:2d}".format(v["ap_nr"], v["ssid"], v["rssi"], v["channel"])
-                print(s)
-        elif sort_on == 'rssi' or sort_on == 'channel':
-            od = OrderedDict(sorted(ap_dict.items(), key= lambda x: x[1]['ap_nr'], reverse=False))  # results in TypeError: 'int' object is not iterable
-            t_dict ={}
-            for i in od.items():
-                # print("od.item[i]=", i)
-                if sort_on == 'rssi':
-                    t_dict[i[0]] = str(i[1]['rssi'])
-                elif sort_on == 'channel':
-                    t_dict[i[0]] = "{:02d}".format(i[1]['channel'])
-            if len(t_dict) > 0:
-                # print("t_dict =", t_dict)
-                od2 = OrderedDict(sorted(t_dict.items(), key= lambda x: x[1], reverse=False))
-                for k, v in od2.items():
-                    if sort_on == 'rssi':
-                        s = "\tAP nr {:2d}\tSSID: {:30s}\tRSSI: {:s}\tChannel: {:2d}".format(k, ap_dict[k]["ssid"], v, ap_dict[k]["channel"])
-                    elif sort_on == 'channel':
-                        s = "\tAP nr {:2d}\tSSID: {:30s}\tRSSI: {:d}\tChannel: {:s}".format(k, ap_dict[k]["ssid"], ap_dict[k]["rssi"], v)
-                    print(s)
+            idx = range(ap_cnt)
+        elif sort_on == 'rssi':
+            idx = ap_rssi_idx
         else:
-            print("Sorting selection \'{}\' unknown".format(sort_on))
+            idx = ap_chan_idx
+        for i in idx:
+            s = "\tAP nr {:2d}\tSSID: {:30s}\tRSSI: {:d}\tChannel: {:2d}".format(i, ap_ssid[i], ap_rssi[i], ap_chan[i])
+            log.info(TAG, s)
     else:
-        print("Dictionary of scanned access points (ap_dict) is empty")
+        log.info(TAG, "Table of scanned access points is empty")
+
+"""
+    Function get_pool()
+
+    :param  None
+    :return socketpool.SocketPool
+
+    This function returns the one socketpool of this script.
+    It creates it at the first call.
+"""
+def get_pool():
+    global pool
+    if pool is None:
+        import socketpool
+        pool = socketpool.SocketPool(radio())
+    return pool
+
+"""
+    Function resolve()
 
+    :param  str host, int port
+    :return str, the address of host
+
+    This function resolves host via DNS. The result is kept in dns_dict
+    for dns_ttl seconds so that a reconnect does not need a new lookup.
+"""
+def resolve(host, port: int=80):
+    now = time.monotonic()
+    d = dns_dict.get(host, None)
+    if d is not None and d[1] > now:
+        return d[0]
+    info = get_pool().getaddrinfo(host, port)
+    addr = info[0][4][0]
+    dns_dict[host] = (addr, now + dns_ttl)
+    return addr
+
+"""
+    Function do_connect()
+
+    :param  bool retry, False: one attempt, without the scan and the reset (see ntp_job())
+    :return None
+
+    This function connects to the WiFi access point set in secrets.py.
+    If we have been connected before, it connects directly to the BSSID and
+    channel of that access point (global last_ap), which skips the scan of
+    all channels. If that fails the cached access point is dropped and the
+    next try is a normal connect. Only if that fails too, the access points are
+    scanned and the strongest access point of our ssid is tried (see do_scan()):
+    a scan of all channels takes seconds. With log level DEBUG the first call
+    scans and prints the access points. Only if use_ping is True the connection
+    is checked by a ping to ping_host.
+    If it does not connect, the device is reset, unless the built-in RTC was synced from NTP before.
+"""
 # Note: wifi.radio.hostname results in: 'UMPros3'
-def do_connect():
-    global ip, s_ip, start, pool
-    TAG = tag_adj("do_connect(): ")
-    print(TAG+"wifi.radio.enabled=", wifi.radio.enabled)
+def do_connect(retry=True):
+    global ip, s_ip, start, last_ap
+    TAG = "do_connect(): "
+    log.info(TAG, "wifi.radio.enabled= {}", radio().enabled)
     cnt = 0
     timeout_cnt = 5
     dc_ip = None
+    scanned = False
     #s_ip = None
 
     if start:
         start = False
-        if my_debug:
+        if log.enabled(log.DEBUG):
             do_scan()
+            scanned = True
+            if last_ap is None:
+                last_ap = best_ap(secrets["ssid"])  # connect to the strongest access point of our ssid
             sort_order = 1  # <<<===  Choose here how you want to sort the received list of Available WiFi networks (range: 0 - 2)
             pr_scanned_ap(sort_order)
             gc.collect()
@@ -177,51 +393,125 @@ def do_connect():
     while dc_ip is None or dc_ip == '0.0.0.0':
         # print(TAG+f"cnt= {cnt}")
         try:
-            wifi.radio.connect(secrets["ssid"], secrets["password"])
+            if last_ap is not None:
+                radio().connect(secrets["ssid"], secrets["password"], channel=last_ap[1], bssid=last_ap[0])
+            else:
+                radio().connect(secrets["ssid"], secrets["password"])
         except ConnectionError as e:
+            if last_ap is not None:
+                last_ap = None  # the cached access point failed. Retry at once with a normal connect
+                continue
+            if retry and not scanned:
+                scanned = True
+                do_scan()  # the normal connect failed. Retry at once with the strongest access point of our ssid
+                last_ap = best_ap(secrets["ssid"])
+                if last_ap is not None:
+                    continue
             if cnt == 0:
-                print(TAG+"WiFi connection try: {:2d}. Error: \'{}\'\n\tTrying max {} times.".format(cnt+1, e, timeout_cnt))
-        dc_ip = wifi.radio.ipv4_address
-        pool = socketpool.SocketPool(wifi.radio)
+                log.error(TAG, "WiFi connection try: {:2d}. Error: \'{}\'\n\tTrying max {} times.", cnt+1, e, timeout_cnt)
+        dc_ip = radio().ipv4_address
+        if dc_ip is not None or not retry:
+            break
         cnt += 1
         if cnt > timeout_cnt:
-            print(TAG+"WiFi connection timed-out")
+            log.warning(TAG, "WiFi connection timed-out")
             break
         time.sleep(1)
 
     if dc_ip:
         ip = dc_ip
         s_ip = str(ip)
+        ap = radio().ap_info
+        if ap is not None:
+            last_ap = (ap.bssid, ap.channel)
+    else:
+        ip = None  # the address of an earlier connection is gone
+        s_ip = '0.0.0.0'
 
     if s_ip is not None and s_ip != '0.0.0.0':
-        print(TAG+"s_ip= \'{}\'".format(s_ip))
-        print(TAG+"connected to %s!"%secrets["ssid"])
-        print(TAG+"IP address is", ip)
-
-        addr_idx = 0
-        addr_dict = {0:'LAN gateway', 1:'google.com'}
-
-        info = pool.getaddrinfo(addr_dict[1], 80)
-        addr = info[0][4][0]
-        print(TAG+f"resolved {addr_dict[1][:-4]} as {addr}")
-        ipv4 = ipaddress.ip_address(addr)
-
-        for _ in range(10):
-            result = wifi.radio.ping(ipv4)
-            if result:
-                print(TAG+f"Ping {addr}: {result*1000} ms")
-                break
-            else:
-                print(TAG+"no response")
-            time.sleep(0.5)
+        log.info(TAG, "s_ip= \'{}\'", s_ip)
+        log.info(TAG, "connected to {}!", secrets["ssid"])
+        log.info(TAG, "IP address is {}", ip)
+
+        if use_ping and not use_fast_start:
+            net_diag()
+    elif rtc_set_mono is not None or not retry:
+        # The built-in RTC was synced from NTP: it keeps the time (holdover, see rtc_hold()).
+        # A reset would lose the drift learned (drift_ppm). Retried by get_NTP() or ntp_job()
+        log.warning(TAG, "s_ip= {}. The built-in RTC continues without NTP", s_ip)
     elif s_ip == '0.0.0.0':
-        print(TAG+f"s_ip= {s_ip}. Resetting this \'{wifi.radio.hostname}\' device...")
+        log.info(TAG, "s_ip= {}. Resetting this \'{}\' device...", s_ip, radio().hostname)
         time.sleep(2)  # wait a bit to show the user the message
         import microcontroller
         microcontroller.reset()
 
+"""
+    Function net_diag()
+
+    :param  None
+    :return None
+
+    Network diagnostics: it resolves ping_host and pings it, at most 10 times.
+    With use_fast_start it runs once, diag_delay seconds after net_start(), when no request is waiting.
+"""
+def net_diag():
+    global diag_due
+    TAG = "net_diag(): "
+    diag_due = None
+    if not use_ping or not wifi_is_connected():
+        return
+    import ipaddress
+    try:
+        addr = resolve(ping_host)
+    except OSError as e:
+        log.warning(TAG, "cannot resolve {}: {}", ping_host, e)
+        return
+    log.info(TAG, "resolved {} as {}", ping_host[:-4], addr)
+    ipv4 = ipaddress.ip_address(addr)
+
+    for _ in range(10):
+        result = radio().ping(ipv4)
+        if result:
+            log.info(TAG, "Ping {}: {} ms", addr, result*1000)
+            break
+        else:
+            log.warning(TAG, "no response")
+        time.sleep(0.5)
+
+"""
+    Function net_start()
+
+    :param  None
+    :return None
+
+    With use_fast_start: called by ck_uart() when no request is waiting, net_delay seconds after setup().
+    It connects WiFi and queues the sync of the built-in RTC from NTP (JOB_NTP). Until then
+    get_NTP() uses the built-in RTC, or if it has no time yet, syncs it at once.
+"""
+def net_start():
+    global net_ready, diag_due
+    TAG = "net_start(): "
+    net_ready = True
+    t0 = time.monotonic()
+    if use_ntp:
+        if not wifi_is_connected():
+            do_connect()
+        req_q.put(JOB_NTP, sensor_ads, 0, req_prio[JOB_NTP], time.monotonic())
+    log.info(TAG, "network up in {:.1f} s", time.monotonic() - t0)
+    if use_ping:
+        diag_due = time.monotonic() + diag_delay
+
+"""
+    Function rtc_valid()
+
+    :param  None
+    :return bool, True if the built-in RTC has a time: it is set, or it kept running over a reset
+"""
+def rtc_valid():
+    return rtc_is_set or time.localtime()[0] >= rtc_year_min
+
 def wifi_is_connected():
-    return True if s_ip is not None and s_ip != '0.0.0.0' else False
+    return radio().ipv4_address is not None
 
 def get_epoch():
     return time.time()
@@ -237,13 +527,13 @@ def get_epoch():
 """
 def dtstru_to_str():
     global default_dt
-    TAG=tag_adj("dtstru_to_str(): ")
+    TAG = "dtstru_to_str(): "
     ret = ""
     if isinstance(default_dt, time.struct_time):
         t = default_dt
         ret = "{}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(t[0], t[1], t[2], t[3], t[4], t[5])
     else:
-        print(TAG+f"default_dt needs to be type time.struct_time. It is of type: {type(default_dt)}")
+        log.error(TAG, "default_dt needs to be type time.struct_time. It is of type: {}", type(default_dt))
         raise TypeError
     return ret
 
@@ -259,7 +549,7 @@ def dtstru_to_str():
 """
 def dtstr_to_tpl():
     global default_s_dt
-    TAG=tag_adj("dtstr_to_tpl(): ")
+    TAG = "dtstr_to_tpl(): "
     ret = ()
     if isinstance(default_s_dt, str):
         s = default_s_dt
@@ -270,10 +560,10 @@ def dtstr_to_tpl():
                 #ret= (yy,         mo,          dd,           hh,            mi,            ss,         wd, yd, isdst)
                 ret = (int(s[:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:]), 0, 0, -1 )
             except ValueError as e:
-                print(TAG+f"Error = {e}")
+                log.error(TAG, "Error = {}", e)
                 raise
     else:
-        print(TAG+f"default_s_dt needs to be type str. It is of type: {type(default_s_dt)}")
+        log.error(TAG, "default_s_dt needs to be type str. It is of type: {}", type(default_s_dt))
         raise TypeError
     return ret  # tuple
 
@@ -294,19 +584,17 @@ def dtstr_to_tpl():
 """
 def set_dt_globls(dt):
     global default_dt, default_s_dt, default_tpl_dt
-    TAG=tag_adj("set_dt_globls(): ")
-    if my_debug:
-        print(TAG+f"param dt, type(dt)= {type(dt)}")
+    TAG = "set_dt_globls(): "
+    log.debug(TAG, "param dt, type(dt)= {}", type(dt))
     if isinstance(dt, time.struct_time):
         default_dt = dt
         default_s_dt = dtstru_to_str() # convert to type str
         default_tpl_dt = dtstr_to_tpl()  # convert to type tuple
-        if my_debug:
-            print(TAG+f"default_dt    ={default_dt}, type(default_dt)= {type(default_dt)}")
-            print(TAG+f"default_s_dt  = \'{default_s_dt}\',type(default_s_dt)= {type(default_s_dt)}")
-            print(TAG+f"default_tpl_dt= \'{default_tpl_dt}\',type(default_tpl_dt)= {type(default_tpl_dt)}")
+        log.debug(TAG, "default_dt    ={}, type(default_dt)= {}", default_dt, type(default_dt))
+        log.debug(TAG, "default_s_dt  = \'{}\',type(default_s_dt)= {}", default_s_dt, type(default_s_dt))
+        log.debug(TAG, "default_tpl_dt= \'{}\',type(default_tpl_dt)= {}", default_tpl_dt, type(default_tpl_dt))
     else:
-        print(TAG+f"parameter dt needs to be type time.struct_time. It is of type: {type(dt)}")
+        log.error(TAG, "parameter dt needs to be type time.struct_time. It is of type: {}", type(dt))
         raise TypeError
 
 """
@@ -321,277 +609,907 @@ def set_dt_globls(dt):
     and returns the seconds value.
 """
 def ck_secs(dts):
-    TAG=tag_adj("ck_secs(): ")
+    TAG = "ck_secs(): "
     if dts is None:
         dts2 = default_s_dt
     else:
-        print(TAG+f"param value= {dts}")
+        log.info(TAG, "param value= {}", dts)
         dts2 = dts  # we use the parameter
 
     secs = int(dts2[-2:])   # ord(dts2[-2])
-    #print(TAG+f"secs = \'{secs}\'")
     return secs
 
 """
-    Function get_NTP()
+    Function ntp_ns()
+
+    :param  int ofs, index of a 64-bit NTP timestamp in ntp_buf
+    :return int, the timestamp in nanoseconds since 1970-01-01
+"""
+def ntp_ns(ofs):
+    secs, frac = struct.unpack_from("!II", ntp_buf, ofs)
+    return (secs - _NTP_TO_UNIX_EPOCH) * 1_000_000_000 + ((frac * 1_000_000_000) >> 32)
+
+"""
+    Function ntp_query()
+
+    :param  str host, int port
+    :return tuple (server time in ns at t_rcvd, round-trip delay in ns, t_rcvd), or None
+
+    This function sends one (S)NTP request to host and waits at most ntp_timeout
+    seconds for the reply. It re-uses the one UDP socket ntp_sock.
+    The transmit timestamp we send is a nonce. A reply is only accepted if the
+    server echoes it (originate timestamp), so a late reply of another server
+    is discarded. t_rcvd is the time.monotonic_ns() at reception.
+"""
+def ntp_query(host, port: int=ntp_port):
+    global ntp_sock
+    TAG = "ntp_query(): "
+    if ntp_sock is None:
+        p = get_pool()
+        ntp_sock = p.socket(p.AF_INET, p.SOCK_DGRAM)
+        ntp_sock.settimeout(ntp_timeout)
+    ntp_stats['queries'] += 1
+    try:
+        addr = resolve(host, port)
+        t_send = time.monotonic_ns()
+        ntp_buf[0] = 0x23  # LI: 0, version: 4, mode: 3 (client)
+        struct.pack_into("!Q", ntp_buf, 40, t_send)  # nonce
+        ntp_sock.sendto(ntp_buf, (addr, port))
+        t_end = t_send + int(ntp_timeout * 1_000_000_000)
+        while True:
+            n = ntp_sock.recv_into(ntp_buf)
+            t_rcvd = time.monotonic_ns()
+            if n >= 48 and struct.unpack_from("!Q", ntp_buf, 24)[0] == t_send:
+                break
+            if t_rcvd > t_end:
+                raise OSError("no valid reply")
+    except OSError as e:
+        ntp_stats['fails'] += 1
+        log.debug(TAG, "{}: {}", host, e)
+        return None
+    t2 = ntp_ns(32)  # server receive time
+    t3 = ntp_ns(40)  # server transmit time
+    delay = (t_rcvd - t_send) - (t3 - t2)
+    return (t3 + delay // 2, delay, t_rcvd)
+
+"""
+    Function rtc_tick()
 
     :param  None
+    :return tuple (int seconds of the built-in RTC at its next second boundary,
+            int time.monotonic_ns() of that boundary), or None
+
+    The RTC counts whole seconds. This function waits, at most 1.1 s, for the next
+    second boundary. It is taken halfway between the last two readings of the RTC,
+    within about 0.5 ms.
+"""
+def rtc_tick():
+    s = time.time()
+    t_ns = time.monotonic_ns()
+    t_end = t_ns + 1_100_000_000
+    while t_ns < t_end:
+        time.sleep(0.001)
+        t_prev = t_ns
+        t_ns = time.monotonic_ns()
+        t = time.time()
+        if t != s:
+            return t, (t_prev + t_ns) // 2
+    return None
+
+"""
+    Function drift_sample()
+
+    :param  float ofs_ms, offset of the RTC measured by NTP (ms); float elapsed, seconds since
+            NTP set the RTC; float delay_ms, round-trip delay of the NTP reply
+    :return None
+
+    The offset, without the steps of rtc_hold(), gathered since the RTC was set gives
+    a sample of its frequency error. The samples are averaged by their uncertainty
+    (a Kalman filter): drift_ppm, and its uncertainty drift_dev. The frequency may
+    wander drift_wander ppm between two samples.
+"""
+def drift_sample(ofs_ms, elapsed, delay_ms):
+    global drift_ppm, drift_dev, drift_n
+    if elapsed < drift_min_s:
+        return
+    smp = -(ofs_ms + (rtc_adj - rtc_set_ofs) * 1000) / elapsed * 1000
+    unc = (rtc_err0_ms + delay_ms / 2 + 1) / elapsed * 1000
+    v = drift_dev * drift_dev + drift_wander * drift_wander
+    w = v / (v + unc * unc)
+    drift_ppm += w * (smp - drift_ppm)
+    drift_dev = (v * (1 - w)) ** 0.5
+    drift_n += 1
+    log.info("drift_sample(): ", "RTC drift {:+.2f} ppm (sample {:+.2f} ppm), uncertainty {:.2f} ppm", drift_ppm, smp, drift_dev)
+
+"""
+    Function rtc_err_ms()
+
+    :param  float now, time.monotonic()
+    :return float, bound of the error of the built-in RTC (ms), or None if NTP did not set it
+
+    The error when NTP set the RTC, plus the uncertainty of the drift since then,
+    plus the drift not corrected yet: since the last step of rtc_hold().
+"""
+def rtc_err_ms(now):
+    if rtc_set_mono is None:
+        return None
+    return rtc_err0_ms + (drift_dev * (now - rtc_set_mono) + abs(drift_ppm) * (now - rtc_hold_mono)) / 1000
+
+"""
+    Function ntp_due()
+
+    :param  float now, time.monotonic()
+    :return bool, True if get_NTP() should sync the built-in RTC
+
+    Not within ntp_retry seconds of the last attempt, also when it never synced:
+    while NTP does not answer, a broadcast or a request does not wait for a round
+    of all the servers each time. Never synced: otherwise always. Else not within
+    ntp_interval seconds of the last sync, then when the error bound of the RTC
+    exceeds ntp_max_err_ms, or after ntp_interval_max seconds. The better the drift
+    is known, the longer the RTC runs without NTP.
+"""
+def ntp_due(now):
+    if ntp_tried is not None and now - ntp_tried < ntp_retry:
+        return False
+    t = ntp_stats['t_sync']
+    if t is None:
+        return True
+    if now - t < ntp_interval:
+        return False
+    return now - t > ntp_interval_max or rtc_err_ms(now) > ntp_max_err_ms
+
+"""
+    Function rtc_hold()
+
+    :param  None
+    :return None
+
+    Holdover: NTP does not answer. This function steps the built-in RTC by the drift
+    (drift_ppm) it gathered since NTP set it, on a second boundary of the corrected time.
+    A correction below rtc_step_min waits for the next call. Without a drift sample it does nothing.
+"""
+def rtc_hold():
+    global rtc_mono, rtc_adj, rtc_hold_mono, rtc_err0_ms
+    TAG = "rtc_hold(): "
+    if not use_drift or rtc_set_mono is None or not drift_n:
+        return
+    tick = rtc_tick()
+    if tick is None:
+        return
+    t, t_ns = tick
+    raw = t - rtc_set_s - rtc_adj  # seconds the RTC counted since it was set, without the steps
+    c = rtc_set_s + rtc_set_ofs + raw * (1 - drift_ppm / 1_000_000) - t  # the correction: corrected time - RTC
+    if abs(c) < rtc_step_min:
+        return
+    b = int(t + c) + 1  # next second boundary of the corrected time
+    dly = b - (t + c) - (time.monotonic_ns() - t_ns) / 1_000_000_000
+    if dly < 0:
+        b += 1
+        dly += 1
+    time.sleep(dly)
+    #----------------------------------------
+    rtc.datetime = time.localtime(b)
+    #----------------------------------------
+    m_ns = time.monotonic_ns()
+    rtc_mono = m_ns / 1_000_000_000
+    rtc_hold_mono = rtc_mono
+    rtc_adj += b - t - (m_ns - t_ns) / 1_000_000_000  # the step, as it was done: the sleep may overshoot
+    rtc_err0_ms += 1  # the tick is known within 0.5 ms, and so is the step
+    ntp_stats['holds'] += 1
+    log.info(TAG, "built-in RTC stepped {:+.0f} ms (drift {:+.2f} ppm). Error bound {:.0f} ms", c * 1000, drift_ppm, rtc_err_ms(rtc_mono))
+
+"""
+    Function ntp_apply()
+
+    :param  tuple best, the reply of ntp_query() to use
     :return None
 
-    This function fetches ntp.datetime.
-    If not set yet, this function will set the built-in RTC
+    This function sets the built-in RTC from the NTP reply best.
+    The offset of the RTC before the sync and the delay are kept in ntp_stats.
+    The offset is measured on a second boundary of the RTC (see rtc_tick()) and gives
+    a sample of the drift of the RTC (see drift_sample()).
+"""
+def ntp_apply(best):
+    global rtc_mono, rtc_is_set, rtc_set_mono, rtc_set_s, rtc_set_ofs, rtc_err0_ms, rtc_adj, rtc_hold_mono
+    TAG = "ntp_apply(): "
+    tick = rtc_tick() if rtc_set_mono is not None else None
+    if tick is None:
+        tick = (time.time(), time.monotonic_ns())
+    # UTC in ns, at the tick
+    utc_ns = best[0] + tick[1] - best[2]
+    ntp_stats['offset_ms'] = (utc_ns - tick[0] * 1_000_000_000 + tz_offset * 3600_000_000_000) / 1_000_000
+    ntp_stats['delay_ms'] = best[1] / 1_000_000
+    if rtc_set_mono is not None:
+        drift_sample(ntp_stats['offset_ms'], time.monotonic() - rtc_set_mono, ntp_stats['delay_ms'])
+    ntp_stats['syncs'] += 1
+    ntp_stats['t_sync'] = time.monotonic()
+    # The RTC counts whole seconds: wait for the next second boundary to set it
+    utc_ns = best[0] + time.monotonic_ns() - best[2]
+    frac = utc_ns % 1_000_000_000
+    time.sleep((1_000_000_000 - frac) / 1_000_000_000)
+    # NOTE: tz_offset, integer, number of hours offset: 1, 2, 3, -5 etc.
+    dt = time.localtime(utc_ns // 1_000_000_000 + 1 + tz_offset * 3600)
+    set_dt_globls(dt) # set the global default_dt, default_s_dt and default_tpl_dt
+    #----------------------------------------
+    rtc.datetime = dt # set the built-in RTC
+    #----------------------------------------
+    m_ns = time.monotonic_ns()
+    rtc_mono = m_ns / 1_000_000_000
+    rtc_is_set = True
+    rtc_set_mono = rtc_hold_mono = rtc_mono
+    rtc_set_s = utc_ns // 1_000_000_000 + 1 + tz_offset * 3600
+    rtc_set_ofs = (best[0] + m_ns - best[2]) / 1_000_000_000 + tz_offset * 3600 - rtc_set_s
+    rtc_err0_ms = ntp_stats['delay_ms'] / 2 + 1 + abs(rtc_set_ofs) * 1000
+    rtc_adj = 0.0
+    log.info(TAG, "time from NTP= \'{}\'", default_s_dt)
+    log.info(TAG, "timezone= \'{}\'. Offset from UTC= {} Hr(s)", location, tz_offset)
+    log.info(TAG, "built-in RTC is synchronized from NTP server {}", ntp_stats['server'])
+    log.info(TAG, "offset= {:.1f} ms, delay= {:.1f} ms", ntp_stats['offset_ms'], ntp_stats['delay_ms'])
+
+"""
+    Function ntp_step()
+
+    :param  None
+    :return bool, True if the round of the servers is complete
+
+    This function queries one server of ntp_servers, the next of the round (ntp_srv_i),
+    and keeps the reply with the lowest round-trip delay (ntp_best). After the last
+    server it sets the built-in RTC from that reply (see ntp_apply()). Without a reply
+    the RTC is corrected for its drift (holdover, see rtc_hold()).
     The result is put in the global variable default_dt
 """
+def ntp_step():
+    global ntp_srv_i, ntp_best
+    TAG = "ntp_step(): "
+    host, _, port = ntp_servers[ntp_srv_i].partition(':')
+    res = ntp_query(host, int(port) if port else ntp_port)
+    if res is not None and (ntp_best is None or res[1] < ntp_best[1]):
+        ntp_best = res
+        ntp_stats['server'] = host
+    ntp_srv_i += 1
+    if ntp_srv_i < len(ntp_servers):
+        return False
+    best = ntp_best
+    ntp_srv_i = 0
+    ntp_best = None
+    if best is not None:
+        ntp_apply(best)
+    else:
+        log.warning(TAG, "no reply from the NTP servers. Using the built-in RTC")
+        rtc_hold()
+    # Get the current time in seconds since Jan 1, 1970 and correct it for local timezone
+    # Note: the if global flag 'use_local_time' is False then we use UTC time. Then the tz_offset will be 0.
+    # (defined in secrets.h)
+    # Convert the current time in seconds since Jan 1, 1970 to a struct_time
+    dt = time.localtime(time.time())  # default_dt type = time.struct_time
+    set_dt_globls(dt) # update global default_dt, default_s_dt and default_tpl_dt from the built-in RTC
+    log.debug(TAG, "datetime is updated from NTP")
+    return True
+
+"""
+    Function get_NTP()
+
+    :param  None
+    :return None
+
+    This function syncs the built-in RTC from NTP: it queries all servers of
+    ntp_servers in one go (see ntp_step()). It blocks for up to ntp_timeout seconds
+    per server: the listener uses ntp_job() instead, except for a reply that waits for the time.
+"""
 def get_NTP():
-    global pool, ntp, rtc_is_set, default_dt, default_s_dt, default_tpl_dt
-    TAG=tag_adj("get_NTP(): ")
-    dt = None
+    global rtc_is_set, ntp_tried, ntp_srv_i, ntp_best
+    TAG = "get_NTP(): "
     #default_dt = time.struct_time((2022, 9, 17, 12, 0, 0, 5, 261, -1))
 
-    if use_ntp:
-        if wifi_is_connected:
-            try:
-                if not ntp:
-                    pool = socketpool.SocketPool(wifi.radio)
-                    # NOTE: tz_offset, integer, number of hours offset: 1, 2, 3, -5 etc.
-                    ntp = NTP(pool, tz_offset=tz_offset)
-                    if ntp and my_debug:
-                        print(TAG+"ntp object created")
-                # print(TAG+f"type(ntp)= {ntp}")
-                if ntp:
-                    if my_debug:
-                        # Note ntp._tz_offset returns the offset from UTC in seconds
-                        print(TAG+f"ntp._tz_offset= {ntp._tz_offset}")
-                    dt = ntp.datetime  # type(dt) = time.struct_time
-                    set_dt_globls(dt) # set the global default_dt, default_s_dt and default_tpl_dt
-                    print(TAG+f"time from NTP= \'{default_s_dt}\'")
-                    print(TAG+f"timezone= \'{location}\'. Offset from UTC= {tz_offset} Hr(s)")
-                    if my_debug:
-                        print(TAG+f"ntp.datetime()={dt}, type(ntp.datetime())={type(dt)}")
-                    rtc_is_set = False
-                    if not rtc_is_set:
-                        if isinstance(default_tpl_dt, tuple):
-                            #----------------------------------------
-                            rtc.datetime = default_tpl_dt # set the built-in RTC from a datetime tuple
-                            #----------------------------------------
-                            rtc_is_set = True
-                            print(TAG+f"built-in RTC is synchronized from NTP")
-                            if my_debug:
-                                print(TAG+f"\n\t{dt}")
-                        else:
-                            print(TAG+f"expected type tuple. received type {type(dt)}")
-                            raise TypeError
-            except OSError:
+    if use_ntp and not net_ready and rtc_valid():
+        # Fast start: the built-in RTC kept running over the reset. Serve it until net_start()
+        rtc_is_set = True
+        set_dt_globls(time.localtime(time.time()))
+    elif use_ntp:
+        if not net_ready:
+            net_start()  # power-up: the built-in RTC has no time yet. The network is needed now
+        ntp_tried = time.monotonic()
+        if not wifi_is_connected():
+            do_connect()  # WiFi dropped. Reconnect to the cached access point
+        if wifi_is_connected():
+            ntp_srv_i = 0
+            ntp_best = None
+            while not ntp_step():
                 pass
-            # Get the current time in seconds since Jan 1, 1970 and correct it for local timezone
-            # Note: the if global flag 'use_local_time' is False then we use UTC time. Then the tz_offset will be 0.
-            # (defined in secrets.h)
-            # Convert the current time in seconds since Jan 1, 1970 to a struct_time
-            dt = time.localtime(time.time())  # default_dt type = time.struct_time
-            set_dt_globls(dt) # update global default_dt, default_s_dt and default_tpl_dt from the built-in RTC
-            if my_debug:
-                print(TAG+f"datetime is updated from NTP")
         else:
-            print("No internet. Setting default time")
+            log.warning(TAG, "No internet. Setting default time")
+            rtc_hold()
     else:
         if not rtc_is_set:
             rtc.datetime = default_tpl_dt # Set the built-in rtc to a fixed fictive datetime
-            print("built-in RTC set with default time")
+            log.info(TAG, "built-in RTC set with default time")
             rtc_is_set = True
 
+"""
+    Function ntp_job()
+
+    :param  None
+    :return None
+
+    Handler of JOB_NTP: the sync of the built-in RTC from NTP, as background work.
+    A job queries one server (see ntp_step()) and queues the next one, with the index
+    of that server as its sequence number: the requests received meanwhile are served
+    in between. A job with sequence number 0 starts a new round, if a sync is still
+    due (see ntp_due()). When WiFi dropped
+    the first job tries to reconnect once: the next round tries again.
+"""
+def ntp_job():
+    global ntp_tried, ntp_srv_i, ntp_best
+    TAG = "ntp_job(): "
+    if not use_ntp or not net_ready:
+        get_NTP()
+        return
+    if req_seq == 0:
+        if not ntp_due(time.monotonic()):
+            return  # synced meanwhile, e.g. for a deferred reply
+        ntp_tried = time.monotonic()
+        ntp_srv_i = 0
+        ntp_best = None
+        if not wifi_is_connected():
+            do_connect(False)  # WiFi dropped. One attempt with the cached access point
+        if not wifi_is_connected():
+            log.warning(TAG, "No internet. Using the built-in RTC")
+            rtc_hold()
+            set_dt_globls(time.localtime(time.time()))
+            return
+    elif req_seq != ntp_srv_i:
+        return  # a step of a round that was restarted
+    if not ntp_step():
+        req_q.put(JOB_NTP, sensor_ads, ntp_srv_i, req_prio[JOB_NTP], time.monotonic())
+
+"""
+    Function send_frame()
+
+    :param  int code, bytes or str payload
+    :return int, nr of bytes sent, or None
+
+    This function sends a frame to the device that sent the request being handled
+    (global req_src), with the sequence number of that request (global req_seq).
+    See sercom_frame. Except for an ACK or NAK the frame is kept in replies.
+"""
+def send_frame(code, payload=None):
+    return send_to(req_src, code, req_seq, payload, 0 if code == fr.ACK or code == fr.NAK else req_rcvd)
+
+"""
+    Function send_to()
+
+    :param  int dst, int code, int seq, bytes or str payload,
+            int req, code of the request answered: keep the frame in replies (0: do not keep)
+    :return int, nr of bytes sent, or None
+
+    This function builds the frame in a block borrowed from the pool and sends it.
+    If all blocks are lent the frame is not sent.
+"""
+def send_to(dst, code, seq, payload=None, req=0):
+    blk = frame_pool.get()
+    if blk < 0:
+        log.error("send_to(): ", "frame pool exhausted ({}x). Frame {} to 0x{:x} not sent", frame_pool.n_exhausted, code, dst)
+        return None
+    try:
+        n = fr.encode(frame_pool.buf(blk), dst, sensor_ads, code, seq, payload)
+        res = uart_send(frame_pool.view(blk, n))
+        if req and res:
+            replies.put(dst, req, seq, frame_pool.buf(blk), n, time.monotonic())
+        return res
+    finally:
+        frame_pool.put(blk)
+
+"""
+    Function uart_send()
+
+    :param  memoryview mv, the frame
+    :return int, nr of bytes sent, or None
+
+    All frames except CREDIT frames are sent by this function.
+    If the other devices have not enough room in their receive buffer (see sercom_frame.Flow)
+    it waits for their CREDIT frames, at most credit_wait seconds. A request
+    received meanwhile stays in parser.frame (frame_pending) for ck_uart().
+"""
+def uart_send(mv):
+    global frame_pending
+    n = len(mv)
+    if use_flow and not flow.can_send(n):
+        flow.n_stalls += 1
+        t_end = time.monotonic() + credit_wait
+        while not flow.can_send(n):
+            if time.monotonic() > t_end:
+                flow.expire(n)
+                log.warning("uart_send(): ", "no credit received. Sending anyway")
+                break
+            if frame_pending:
+                time.sleep(0.005)  # parser.frame is taken. Only the free space in the UART buffer remains
+            elif next_frame():
+                frame_pending = True
+            else:
+                time.sleep(0.005)
+    #--------------------------------------------------
+    res = uart.write(mv)
+    #--------------------------------------------------
+    stats.add(fr.ST_TX_FRAMES)
+    stats.add(fr.ST_TX_BYTES, n)
+    if use_flow:
+        flow.sent(n)
+    if use_trace:
+        trc.tx(mv, n)
+    return res
+
+"""
+    Function send_credit()
+
+    :param  None
+    :return None
+
+    This function sends a CREDIT frame with the free space of our receive buffer.
+"""
+def send_credit():
+    mv = flow.advert()
+    uart.write(mv)
+    stats.add(fr.ST_TX_FRAMES)
+    stats.add(fr.ST_TX_BYTES, len(mv))
+    flow.sent(len(mv))
+    if use_trace:
+        trc.tx(mv, len(mv))
+
+"""
+    Function rx_flow()
+
+    :param  int n, nr of bytes read
+    :return None
+"""
+def rx_flow(n):
+    if flow.received(n):
+        log.warning("ck_uart(): ", "receive buffer full, bytes may be lost ({}x). Increase \'sercom_rxbuf\'", flow.n_rx_full)
+    if flow.need_adv():
+        send_credit()
+
+"""
+    Function err_bound()
+
+    :param  None
+    :return int, error bound of the built-in RTC in ms for a datetime payload (see rtc_err_ms()),
+            ERR_UNKNOWN if NTP did not set the RTC
+"""
+def err_bound():
+    e = rtc_err_ms(time.monotonic())
+    return ERR_UNKNOWN if e is None else min(int(e + 0.5), ERR_UNKNOWN - 1)
+
+"""
+    Function dt_payload()
+
+    :param  str s_dt, datetime string
+    :return bytearray dt_pl, or s_dt if it is not 19 characters long
+
+    The payload of a datetime reply or broadcast: the datetime string (19 characters)
+    followed by the error bound of the built-in RTC in ms (2 bytes, big-endian,
+    see err_bound()). ERR_UNKNOWN if NTP did not set the RTC.
+"""
+def dt_payload(s_dt):
+    if len(s_dt) != 19:
+        return s_dt
+    for i in range(19):
+        dt_pl[i] = ord(s_dt[i])
+    e = err_bound()
+    dt_pl[19] = e >> 8
+    dt_pl[20] = e & 0xFF
+    return dt_pl
+
+"""
+    Function send_bcast()
+
+    :param  None
+    :return int, nr of bytes sent, or None
+
+    This function broadcasts the datetime of the built-in RTC to all devices
+    on the bus in one frame, with its error bound (see dt_payload()).
+    The devices do not acknowledge it. If a sync is due (see ntp_due()) it is queued
+    (JOB_NTP): the broadcast does not wait for NTP.
+"""
+def send_bcast():
+    global bcast_seq
+    TAG = "send_bcast(): "
+    now = time.monotonic()
+    if ntp_due(now):
+        req_q.put(JOB_NTP, sensor_ads, 0, req_prio[JOB_NTP], now)
+    set_dt_globls(time.localtime(time.time()))
+    bcast_seq = (bcast_seq + 1) & 0xFF
+    n = send_to(fr.BCAST, 110, bcast_seq, dt_payload(default_s_dt))
+    if n:
+        log.info(TAG, "datetime \'{}\' broadcast", default_s_dt)
+    else:
+        log.error(TAG, "failed to broadcast datetime")
+    return n
+
+"""
+    Function secs_to_minute()
+
+    :param  None
+    :return float, seconds from now to the next minute boundary of the built-in RTC
+"""
+def secs_to_minute():
+    frac = 0.0
+    if rtc_mono is not None:
+        frac = (time.monotonic() - rtc_mono) % 1.0  # part of the RTC second already passed
+    return 60 - time.localtime()[5] - frac
+
+"""
+    Function subscribe()
+
+    :param  None
+    :return None
+
+    Handler of a 'subscribe' request (in slot req_slot of req_q). The payload holds the
+    request code to push (only 'date_time' yet) and the cadence in seconds
+    (2 bytes, big-endian). Cadence 0 means: at each minute boundary.
+    The reply (code 'subscribe') has payload 1 if accepted, 0 if not.
+    A subscriber renews its subscription by subscribing again, within sub_ttl seconds.
+"""
+def subscribe():
+    TAG = "subscribe(): "
+    msg = req_q.payload(req_slot)
+    ok = len(msg) == 3 and msg[0] == 100 and (req_src in subs or len(subs) < max_subs)
+    if ok:
+        cadence = (msg[1] << 8) | msg[2]
+        dly = cadence if cadence else secs_to_minute()
+        now = time.monotonic()
+        subs[req_src] = [cadence, now + dly, now]
+        log.info(TAG, "0x{:x} subscribed to {} every {} s", req_src, req_dict[100], cadence if cadence else 60)
+    else:
+        log.warning(TAG, "subscription of 0x{:x} refused", req_src)
+    send_frame(103, b'\x01' if ok else b'\x00')
+
+"""
+    Function expire_subs()
+
+    :param  float now, time.monotonic()
+    :return None
+
+    This function drops the subscriptions that were not renewed within sub_ttl seconds:
+    the subscriber is gone, or lost the pushes and subscribes again.
+"""
+def expire_subs(now):
+    for ads in [a for a, sub in subs.items() if now - sub[2] > sub_ttl]:
+        del subs[ads]
+        log.info("expire_subs(): ", "subscription of 0x{:x} not renewed. Dropped", ads)
+
+"""
+    Function send_pushes()
+
+    :param  float now, time.monotonic()
+    :return float, seconds until the next push is due
+
+    This function sends a compact datetime frame (code 'time_push') to each
+    subscriber whose push is due. The payload is 9 bytes:
+    year (2 bytes, big-endian), month, day, hour, minute, second and the error bound
+    of the built-in RTC in ms (2 bytes, big-endian, see err_bound()).
+    The subscriber does not acknowledge it.
+"""
+def send_pushes(now):
+    nxt = 60.0
+    pld = None
+    for ads, sub in subs.items():
+        if sub[1] <= now:
+            if pld is None:
+                t = time.localtime(time.time())
+                struct.pack_into(">HBBBBBH", push_pl, 0, t[0], t[1], t[2], t[3], t[4], t[5], err_bound())
+                pld = push_pl
+            send_to(ads, 111, 0, pld)
+            log.debug("send_pushes(): ", "datetime pushed to 0x{:x}", ads)
+            # the write took time: the next minute boundary is counted from the time now
+            sub[1] = now + sub[0] if sub[0] else time.monotonic() + secs_to_minute()
+        if sub[1] - now < nxt:
+            nxt = sub[1] - now
+    return nxt
+
+"""
+    Function next_frame()
+
+    :param  None
+    :return bool, True if a frame addressed to this device is in parser.frame
+
+    This function parses the bytes received (see sercom_frame) until it has
+    a complete frame addressed to this device. CREDIT frames are handled here
+    (see sercom_frame.Flow). Other broadcast frames are skipped: they are not answered.
+    It returns False when there are no more bytes received now.
+    A part of a frame is dropped after frame_gap seconds without bytes, so a bad
+    length byte does not swallow the retransmission of the request.
+"""
+def next_frame():
+    global rx_i, rx_n, t_rx
+    TAG = "ck_uart(): "
+    while True:
+        if rx_i >= rx_n:
+            #--------------------------------------------------------------
+            rx_n = uart.readinto(rx_buffer)
+            #--------------------------------------------------------------
+            rx_i = 0
+            if not rx_n:
+                rx_n = 0
+                if parser.busy and time.monotonic() - t_rx > frame_gap:
+                    parser.drop()  # the rest of the frame got lost
+                return False
+            t_rx = time.monotonic()
+            stats.add(fr.ST_RX_BYTES, rx_n)
+            if rx_n >= rx_buffer_len:
+                stats.add(fr.ST_RX_FULL)
+            if use_trace:
+                trc.rx(rx_buffer, rx_n)
+            if use_flow:
+                rx_flow(rx_n)
+            if log.enabled(log.DEBUG):  # rx_buffer[:rx_n] is a copy
+                log.debug(TAG, "nr of bytes= {}", rx_n)
+                log.debug(TAG, "rcvd data: {}", rx_buffer[:rx_n])
+        i = parser.feed(rx_buffer, rx_i, rx_n)
+        if i == -1:
+            rx_i = rx_n  # all bytes parsed
+            continue
+        rx_i = i
+        stats.add(fr.ST_RX_FRAMES)
+        f = parser.frame
+        if f[fr.CODE] == fr.CREDIT:
+            flow.granted(f[fr.SRC], parser.payload())
+            continue
+        if f[fr.DST] == fr.BCAST:
+            continue
+        return True
+
+"""
+    Function take_req()
+
+    :param  None
+    :return None
+
+    Takes the request in parser.frame: answers a retransmission from replies,
+    or puts the request in the request queue (req_q) and sends the ACK.
+    A request that is not served, or that finds the queue full, gets a NAK.
+"""
+def take_req():
+    global loop_time, req_src, req_seq, t_first
+    TAG = "take_req(): "
+    loop_time = time.monotonic()
+    f = parser.frame
+    req = f[fr.CODE]
+    req_src = f[fr.SRC]
+    req_seq = f[fr.SEQ]
+    log.info(TAG, "received request: {} = {} from: 0x{:x}", req, req_dict.get(req, ''), req_src)
+    if req in served_reqs:
+        mv = replies.get(req_src, req, req_seq, loop_time)
+        if mv is not None:
+            # A retransmission of a request answered before: send that reply again, do not redo the work
+            send_frame(fr.ACK)
+            uart_send(mv)
+            log.info(TAG, "reply to request {} seq {} sent again", req, req_seq)
+            return
+        ttl = req_ttl.get(req, 0)
+        if req_q.put(req, req_src, req_seq, req_prio.get(req, prio_default), loop_time,
+                     loop_time + ttl if ttl else 0.0, parser.payload()) < 0:
+            send_frame(fr.NAK)
+            stats.add(fr.ST_NAK)
+            log.warning(TAG, "request queue full. NAK sent")
+            return
+        n = send_frame(fr.ACK)  # send acknowledgement
+        if n:
+            log.debug(TAG, "acknowledge on request sent")
+            if t_first is None:
+                t_first = loop_time - t_boot
+                log.info(TAG, "first request served {:.2f} s after start", t_first)
+        else:
+            log.error(TAG, "sending an acknowledge failed")
+    else:
+        send_frame(fr.NAK)
+        stats.add(fr.ST_NAK)
+        log.warning(TAG, "request {} not served by this device. NAK sent", req)
+
+"""
+    Function drain()
+
+    :param  None
+    :return None
+
+    Takes the requests received while a request was handled, without waiting.
+"""
+def drain():
+    global frame_pending
+    while True:
+        if frame_pending:
+            frame_pending = False
+        elif not next_frame():
+            return
+        take_req()
+
 """
     Function ck_uart()
 
     :param  None
-    :return int    nr_bytes received
+    :return int    nr of requests in the queue (req_q)
 
-    This function checks for incoming characters. If received incoming characters,
-    the funtions first checks for reception of a transmission of 2 bytes,
-    containing:
-    a) the address of the Sensor device that the originator (device with Main role)
-    wants to address this request;
-    b) one byte containing a request code.
+    This function checks for incoming frames (see sercom_frame).
+    The parser (global parser) drops frames addressed to other devices
+    on the bus without decoding them.
 
-    REQUEST (2-byte transmission) received?                           (FLOWCHART)
+    REQUEST frame received?                                           (FLOWCHART)
     > Yes
-        > Addressed to me?
+        > Addressed to me? (checked by the parser)
             > Yes
-                > request code is valid? (exsists?)
+                > request code served by this device? (served_reqs)
                     Yes >
-                        > copy request code to global var req_rcvd;
-                        > send acknowledge to originator (device with Main role)
+                        > answered before (same source address and sequence number, see replies)?
+                          send the ACK and that reply again;
+                        > else put the request code, source address and sequence number
+                          in the request queue (req_q). Queue full? send a NAK frame;
+                        > send acknowledge (ACK frame) to the originator
                     > No
-                        > Do nothing
+                        > send a NAK frame to the originator
             > No
-                > Do nothing
+                > Skip the frame
     > No
         > Do nothing
 
-    In words:
-    When this function receives a request, the following steps are executed:
-    1) determine if the request is addressed to this device (with Sensor role);
-    2) if so:
-        a) check the validity of the request code;
-        b) if the request code is valid, copy the received request code into
-        the global variable 'req_rcvd';
-    3) send an an acknowledge code (_ACK) to the device from which the Sensor
-        device received the request. The acknowledge contains the address of
-        the sender device (Main role).add()
-    The calling function (loop()) will 'handle' the received request.
-
-    This function also 'fills' the global rx_buffer with characters received.
+    The calling function (loop()) will 'handle' the queued requests, by priority.
+    This function reads all the frames received before it returns, so a request
+    that arrived behind a slower one can be served first.
+    It waits as long as it takes for a request: there is no deadline.
+    While waiting, this function also sends the datetime broadcasts (see send_bcast())
+    and the datetime pushes to the subscribers (see send_pushes()), and brings up the network.
+    As long as the built-in RTC has no time they are not sent: NTP is retried instead (JOB_NTP).
+    When idle it sleeps up to delay_ms, in steps of delay_poll: the wait ends as soon
+    as bytes arrive, so a request is read within delay_poll.
+    Bytes received after the request stay in rx_buffer for the next call.
     In case of a KeyboardInterrupt during the execution of this function, the function
     will return a value of -1, 'signalling' the calling function (loop())
     that a KeyboardInterrupt has occurred.
 
 """
 def ck_uart():
-    global rx_buffer, msg_nr, loop_time, my_debug, req_rcvd, sensor_ads
-    TAG = tag_adj('ck_uart(): ')
-    nr_bytes = 0
-    delay_ms = 0.2
-    empty_buffer()  # clean the rx_buffer
-    u_start = time.monotonic()
-    u_end = u_start + 60
-    if my_debug:
-        print(TAG+"Entering...")
-        print(TAG+f"u_start= {u_start}")
+    global bcast_next, frame_pending
+    delay_ms = 0.2      # max idle wait: nothing received, nothing queued
+    delay_poll = 0.005  # step of the idle wait: it ends as soon as bytes arrive
     try:
         while True:
-            u_now = time.monotonic()
-            if u_now > u_end:
-                #print(TAG+f"timed-out. u_now= {u_now}, u_end= {u_end}")
-                print(TAG+f"timed-out")
-                return 0  # timeout
-            #--------------------------------------------------------------
-            rx_buffer = uart.read(rx_buffer_len)
-            #--------------------------------------------------------------
-            if rx_buffer is None:
-                time.sleep(0.2)
+            if frame_pending:
+                frame_pending = False  # received while waiting for credit. See uart_send()
+            elif not next_frame():
+                if req_q.count:
+                    return req_q.count  # serve the queue first
+                u_now = time.monotonic()
+                t_ok = rtc_valid()  # no broadcasts or pushes of the power-up time of the RTC
+                if subs:
+                    expire_subs(u_now)
+                if use_time_bcast and (bcast_with_subs or not subs) and u_now >= bcast_next and t_ok:
+                    send_bcast()
+                    while bcast_next <= u_now:
+                        bcast_next += bcast_interval
+                dly = delay_ms
+                if subs and t_ok:
+                    dly = send_pushes(u_now)
+                    if dly > delay_ms:
+                        dly = delay_ms
+                if not net_ready and u_now >= net_due:
+                    net_start()  # fast start: the UART was served first
+                elif diag_due is not None and u_now >= diag_due:
+                    net_diag()
+                elif not t_ok and use_ntp and net_ready and ntp_due(u_now):
+                    req_q.put(JOB_NTP, sensor_ads, 0, req_prio[JOB_NTP], u_now)
+                if dly > 0 and not frame_pending:
+                    # wake up in time for the next push, or as soon as bytes arrive
+                    t_end = time.monotonic() + dly
+                    while True:
+                        time.sleep(delay_poll if dly > delay_poll else dly)
+                        dly = t_end - time.monotonic()
+                        if dly <= 0 or uart.in_waiting:
+                            break
                 continue
-            nr_bytes = len(rx_buffer)
-            if my_debug:
-                print(TAG+"nr of bytes= ", nr_bytes)
-                print(TAG+"type(rx_buffer)=", type(rx_buffer))
-                print(TAG+"rcvd data: {}".format(rx_buffer),end="\n")
-            loop_time = time.monotonic()
-            if nr_bytes is None:
-                if my_debug:
-                    print(TAG+"nr_bytes received is None")
-                time.sleep(delay_ms)
-                continue
-            if not nr_bytes:
-                if my_debug:
-                    print(TAG+f"nr_bytes received={nr_bytes}")
-                time.sleep(delay_ms)
-                continue
-            elif nr_bytes == 2:
-                b = rx_buffer[:2]
-                ads = b[0]  # Address of the 'destination' device
-                req = b[1]  # Code representing the request type
-                if req in req_dict.keys():
-                    req_txt = req_dict[req]
-                else:
-                    req_txt = ''
-                s_ads = "0x{:x}".format(ads)
-                print(TAG+f"received address: {s_ads}")
-                print(TAG+f"received request: {req} = {req_txt}")
-                if ads == sensor_ads:  # is this device addressed ?
-                    if req in req_dict.keys():
-                        tx_failed = None
-                        if my_debug:
-                            print(TAG+f"request {req} found in list of request keys: {req_dict.keys()}")
-                        req_rcvd = req
-                        b = bytearray(2)
-                        b[0] = main_ads  # add the address of 'destination'
-                        b[1] = _ACK      # add the ACK ASCII value
-                        n = uart.write(b)  # send acknowledgement
-                        if n is not None:
-                            if n > 0:
-                                if my_debug:
-                                    print(TAG+f"acknowledge on request sent: {b}. Number of characters sent: {n}")
-                                else:
-                                    print(TAG+"acknowledge on request sent")
-                                time.sleep(1)  # Create a time space between sending ACK and next sending datetime\
-                            else:
-                                tx_failed = True
-                        else:
-                            tx_failed = True
-                        if tx_failed:
-                            print(TAG+"sending an acknowledge failed")
-                        break  # leave loop
-            else:
-                empty_buffer()  # create a new instance of the rx_buffer (bytearrray)
-                time.sleep(delay_ms)
-                continue  # go around
+            take_req()
     except KeyboardInterrupt:
-        nr_bytes = -1
-    if my_debug:
-        print(TAG+"Exiting...")
-    return  nr_bytes
+        pass
+    return -1
 
-loop_nr = 1
+"""
+    Function coalesce()
+
+    :param  int code, queue code of the request just handled; int src, int seq of that request
+    :return int, nr of requests answered
+
+    Single flight: the requests for the same reply (req_rcvd, or a job of job_req for it)
+    that wait in the queue, from any device, get a copy of the reply just sent to src,
+    with their own destination and sequence number.
+    The handler is not run again. Requests received while the handler ran are taken
+    first (drain()). A PEND frame is not copied: the waiting requests get their own PEND.
+"""
+def coalesce(code, src, seq):
+    global n_coalesced
+    TAG = "coalesce(): "
+    drain()
+    mv = replies.last(src, seq)
+    if mv is None or mv[fr.CODE] != req_rcvd:
+        return 0
+    blk = frame_pool.get()
+    if blk < 0:
+        return 0  # the handler runs for the waiting requests
+    now = time.monotonic()
+    n = len(mv)
+    res = 0
+    try:
+        buf = frame_pool.buf(blk)
+        buf[:n] = mv
+        for j in range(req_q.n):
+            c = req_q.code[j]
+            if c != req_rcvd and job_req.get(c, 0) != req_rcvd:
+                continue
+            if req_q.dl[j] and now > req_q.dl[j]:
+                continue  # dropped by req_q.get()
+            buf[fr.DST] = req_q.src[j]
+            buf[fr.SEQ] = req_q.seq[j]
+            buf[n - 1] = fr.chksum(buf, n - 1)
+            if uart_send(frame_pool.view(blk, n)):
+                replies.put(req_q.src[j], req_rcvd, req_q.seq[j], buf, n, now)
+                res += 1
+            req_q.free(j)
+    finally:
+        frame_pool.put(blk)
+    if res:
+        n_coalesced += res
+        log.info(TAG, "reply to request {} also sent to {} waiting request(s)", req_rcvd, res)
+    return res
+
+loop_nr = 0  # nr of requests served by loop()
 """
     Function loop()
 
     :param  None
-    :return int, characters received, or
-                 in case of a Keyboard Interrupt occurred
-                 inside this function,
-                 the function will return a value of -1
-                 to 'signal' to the calling function (main())
+    :return int, -1 when a Keyboard Interrupt occurred
+                 inside this function, to 'signal' to
+                 the calling function (main())
                  that a Keyboard Interrupt took place.
 
-    This function checks incoming request codes.
-    Only the 'date_time' request is implemented yet.
-    The two other 'unix_datetime' or 'weather'
-    are not implemented.
+    This function is the listener of the UART. It runs until a Keyboard Interrupt:
+    ck_uart() waits for requests and puts them in the request queue (req_q).
+    The request with the highest priority (req_prio) is handled first, by its
+    function in req_handlers. Requests that waited longer than their req_ttl are dropped.
+    The UART is never flushed: the parser (global parser) and the bytes not parsed
+    yet in rx_buffer are kept from one request to the next, so a request that
+    arrived right behind the previous one is served next.
+    Identical requests from several devices are answered with one reply (see coalesce()).
+    Only the 'date_time', 'unix_time', 'subscribe' and 'stats' requests are implemented.
+    The 'weather' request is not implemented.
 """
 def loop():
-    global loop_nr, rx_buffer, req_rcvd
-    TAG = tag_adj("loop(): ")
-    gts = "going to send "
-    while True:
-        try:
-            print("=" * 37)
-            print(TAG+"loop nr: {:3d}".format(loop_nr))
-            print("=" * 37)
-            chrs_rcvd = ck_uart()  # Check and handle incoming requests and control codes
+    global loop_nr, req_rcvd, req_src, req_seq, req_slot
+    TAG = "loop(): "
+    log.info(TAG, "listening for requests")
+    try:
+        while True:
+            chrs_rcvd = ck_uart()  # Wait for requests. Handles control codes and the pushes
             if chrs_rcvd == -1:  # did a Keyboard Interrupt took place?
                 return chrs_rcvd # if so, 'signal' this to the calling function (main())
-            if chrs_rcvd > 0:
-                #-------------------------------------------------------
-                uart.reset_input_buffer()  # Clear the uart buffer
-                #-------------------------------------------------------
-                if req_rcvd is not None:
-                    if req_rcvd in req_dict.keys():
-                        s = req_dict[req_rcvd]
-                        print(TAG+f"the device with role: {roles_dict[0]} requested to send: {s}")
-                        print(TAG+gts+req_dict[req_rcvd])
-                        if req_rcvd == 100:
-                            get_NTP()
-                            send_dt()
-                        elif req_rcvd == 101:
-                            send_ux()
-                        elif req_rcvd == 102:
-                            send_wx()
-                    else:
-                        # req not found
-                        print(TAG+f"Unknown request \'{req_rcvd}\' received")
-            loop_nr += 1
-            if loop_nr > 1000:
-                loop_nr = 1
-        except KeyboardInterrupt:
-            print(TAG+"KeyboardInterrupt. Exiting loop()")
-            lStop = True
-            break
-        except OSError as e:
-            lStop = True
-            raise
-    if lStop:
-        return -1
-    else:
-        return 1
+            n_exp = req_q.n_expired
+            i = req_q.get(time.monotonic())
+            if req_q.n_expired != n_exp:
+                log.warning(TAG, "{} request(s) dropped: waited too long", req_q.n_expired - n_exp)
+            if i < 0:
+                continue
+            code = req_rcvd = req_q.code[i]
+            src = req_src = req_q.src[i]
+            seq = req_seq = req_q.seq[i]
+            req_slot = i
+            hdl = req_handlers.get(req_rcvd, None)
+            if hdl is None:
+                # req not found
+                log.warning(TAG, "Unknown request \'{}\' received", req_rcvd)
+            else:
+                log.debug(TAG, "going to send {}", req_dict.get(req_rcvd, req_rcvd))
+                hdl()
+                loop_nr += 1
+            req_q.free(i)  # after the handler: it may read the payload in the slot
+            if code in req_coalesce:
+                coalesce(code, src, seq)
+    except KeyboardInterrupt:
+        log.info(TAG, "KeyboardInterrupt. Exiting loop()")
+    return -1
 
 """
    Function send_dt()
@@ -611,9 +1529,7 @@ def loop():
 """
 def send_dt(s_epoch: str=''):
     global default_s_dt
-    TAG=tag_adj("send_dt(): ")
-    msg = None
-    le = None
+    TAG = "send_dt(): "
     n = None
     s_dt = ''
     option = 0
@@ -621,61 +1537,44 @@ def send_dt(s_epoch: str=''):
     if option == 0 and isinstance(s_epoch, str):
         le = len(s_epoch)
         if le > 0:
-            msg = bytearray(le+3)
-            msg = bytearray(le+3)
-            msg[0] = main_ads
-            msg[1] = le
-            msg[2] = _STX  # Start of message marker
-            for i in range(le):
-                msg[3+i] = ord(s_epoch[i])
-            le2 = len(msg)
-                #--------------------------------------------------
-            n =uart.write(msg)
-            #--------------------------------------------------
+            n = send_frame(req_rcvd, s_epoch)
+            le2 = le + fr.OVERHEAD
             if n is None:
-                print(TAG+"failed to send unix time")
+                log.error(TAG, "failed to send unix time")
             elif n > 0:
-                print(TAG+f"{req_dict[req_rcvd]} \'{s_epoch}\' sent. Nr of characters: {le2}")
-                print(TAG+f"contents of the msg= {msg}") # bytearray(b' \x..\x......ToDo......')
-                #                                                             /\
-                #
+                log.info(TAG, "{} \'{}\' sent. Nr of characters: {}", req_dict[req_rcvd], s_epoch, le2)
             return
 
     if isinstance(default_s_dt, str):
         option = 1
         s_dt = default_s_dt
-        if my_debug:
-            print(TAG+f"to do: sending default_s_dt= \'{default_s_dt}\'")
+        log.debug(TAG, "to do: sending default_s_dt= \'{}\'", default_s_dt)
 
     le = len(s_dt)
     if le > 0:
-        # b = bytes(default_dt, 'utf-8')
-        msg = bytearray(le+3)
-        msg[0] = main_ads
-        msg[1] = le
-        msg[2] = _STX  # Start of message marker
-        for i in range(le):
-            msg[3+i] = ord(s_dt[i])
-        le2 = len(msg)
-        #--------------------------------------------------
-        n =uart.write(msg)
-        #--------------------------------------------------
+        n = send_frame(req_rcvd, dt_payload(s_dt))
+        le2 = le + fr.OVERHEAD
         if n is None:
-            print(TAG+"failed to send datetime")
+            log.error(TAG, "failed to send datetime")
         elif n > 0:
-            print(TAG+f"datetime message sent. Nr of characters: {le2}")
-            if my_debug:
-                print(TAG+f"contents of the message= {msg}")
+            log.info(TAG, "datetime message sent. Nr of characters: {}", le2)
+            log.debug(TAG, "contents of the message= {}", s_dt)
             """
-             bytearray(b' \x13\x022022-10-06 01:15:00')
+             bytearray(b' %\x13\x02d\x072022-10-06 01:15:00g')
                         /\
-                        byte0 = ' ' = 0x20 = 32 decimal (ascii value for space character)
-                                It is the address of the device with role 'Main',
-                                the device the sent the request for datetime.
+                        byte0 = ' ' = 0x20: address of the device with role 'Main' that sent the request
+                          /\
+                          byte1 = '%' = 0x25: address of this device
                             /\
-                            byte1 = \x13 = length of the datetime string following the STX code
+                            byte2 = \x13 = length of the datetime string
                                 /\
-                                byte2 = \x02 = STX ASCII code (indicates start of datetime)
+                                byte3 = \x02 = STX ASCII code
+                                    /\
+                                    byte4 = 'd' = 100: the request code (date_time)
+                                     /\
+                                     byte5 = sequence number of the request
+                                                                 /\
+                                                                 last byte: checksum ('g' = 0x67)
             """
 
 """
@@ -691,21 +1590,85 @@ def send_ux():
     epoch = get_epoch()
     send_dt(str(epoch))
 
+"""
+    Function send_stats()
+
+    :param  None
+    :return int, nr of bytes sent, or None
+
+    This function sends the link counters of this device (see sercom_frame.Stats):
+    8 counters of 4 bytes, big-endian. The frames dropped by the parser count as invalid.
+"""
+def send_stats():
+    n = send_frame(104, stats.pack(parser))
+    if n:
+        log.info("send_stats(): ", "link stats sent. Nr of characters: {}", n)
+    return n
+
 """ ToDo """
 def send_wx():
     pass
 
 """
-   Function empty_buffer()
+    Function send_dt_ntp()
 
-   :param  None
-   :return None
+    :param  None
+    :return None
 
-   Function creates a new instance of the rx_buffer bytearray
+    This function sends the datetime. Once the built-in RTC was synced from NTP
+    it is sent from the RTC at once (fast path), and when a sync is due (see ntp_due())
+    it is queued as background work (JOB_NTP).
+    Otherwise, if the network is needed (use_deferred), it answers with a PEND frame
+    and queues the reply (JOB_DT), so the Main does not wait on the link meanwhile.
+    Else it syncs the built-in RTC from NTP, if needed, first.
 """
-def empty_buffer():
-    global rx_buffer, rx_buffer_len
-    rx_buffer = bytearray(rx_buffer_len * b'\x00')
+def send_dt_ntp():
+    t = ntp_stats['t_sync']
+    if use_ntp and net_ready and rtc_is_set and t is not None:
+        set_dt_globls(time.localtime(time.time()))
+        send_dt()
+        now = time.monotonic()
+        if ntp_due(now):
+            req_q.put(JOB_NTP, sensor_ads, 0, req_prio[JOB_NTP], now)
+        return
+    if use_deferred and use_ntp and (net_ready or not rtc_valid()):
+        # The network is needed first: the reply follows. See send_dt_late()
+        if send_frame(fr.PEND, pend_pl):
+            req_q.put(JOB_DT, req_src, req_seq, req_prio[JOB_DT], time.monotonic())
+            log.info("send_dt_ntp(): ", "datetime pending")
+            return
+    get_NTP()
+    send_dt()
+
+"""
+    Function send_dt_late()
+
+    :param  None
+    :return None
+
+    Handler of JOB_DT: the deferred reply to a 'date_time' request answered with PEND.
+    It syncs the built-in RTC from NTP, unless an earlier JOB_DT just did, and sends
+    the datetime with the code and the sequence number of the request.
+"""
+def send_dt_late():
+    global req_rcvd
+    req_rcvd = 100
+    if ntp_due(time.monotonic()):
+        get_NTP()
+    else:
+        set_dt_globls(time.localtime(time.time()))
+    send_dt()
+
+# The function that handles a request, by request code. See loop()
+req_handlers = {
+    100: send_dt_ntp,
+    101: send_ux,
+    102: send_wx,
+    103: subscribe,
+    104: send_stats,
+    JOB_NTP: ntp_job,
+    JOB_DT: send_dt_late,
+}
 
 """
     Function setup()
@@ -717,17 +1680,19 @@ def empty_buffer():
     It also sets various global variables which some of them it reads from the file secrets.py
 """
 def setup():
-    global rtc, ntp, default_dt, tz_offset, use_local_time, aio_username, aio_key, location, secs_synced  # , pool
-    TAG=tag_adj("setup(): ")
-
-    wifi.AuthMode.WPA2   # set only once
+    global rtc, ntp_servers, default_dt, tz_offset, use_local_time, aio_username, aio_key, location, secs_synced  # , pool
+    TAG = "setup(): "
 
     if not uart:
-        print(TAG+"failed to create an instance of the UART object")
+        log.error(TAG, "failed to create an instance of the UART object")
 
     rtc = RTC()  # create the built-in rtc object
     if not rtc:
-        print(TAG+"failed to create an instance of the RTC object")
+        log.error(TAG, "failed to create an instance of the RTC object")
+    if use_trace:
+        trc.start(trace_size, trace_path, sensor_ads)
+    if use_flow:
+        send_credit()  # tell the other devices the size of our receive buffer
     secs_synced = False  # see get_NTP()
 
     lt = secrets.get("LOCAL_TIME_FLAG", None)
@@ -735,11 +1700,9 @@ def setup():
         use_local_time = False
     else:
         lt2 = int(lt)
-        if my_debug:
-            print("lt2=", lt2)
+        log.debug(TAG, "lt2= {}", lt2)
         use_local_time = True if lt2 == 1 else False
-        if not my_debug:
-            print(TAG+f"using local time= {use_local_time}")
+        log.info(TAG, "using local time= {}", use_local_time)
 
     if use_local_time:
         location = secrets.get("timezone", None)
@@ -752,33 +1715,14 @@ def setup():
                 tz_offset = 0
             else:
                 tz_offset = int(tz_offset0)
-                if my_debug:
-                    print(TAG+f"tz_offset= {tz_offset}")
+                log.debug(TAG, "tz_offset= {}", tz_offset)
     else:
         location = 'UTC'
         tz_offset = 0
 
-"""
-    Function tag_adj()
-
-    :param  str
-    :return str
-
-    This function fills param t with trailing spaces up to the value of global variable tag_le_max
-"""
-def tag_adj(t):
-    global tag_le_max
-    le = 0
-    spc = 0
-    ret = t
-    if isinstance(t, str):
-        le = len(t)
-    if le >0:
-        spc = tag_le_max - le
-        #print(f"spc= {spc}")
-        ret = ""+t+"{0:>{1:d}s}".format("",spc)
-        #print(f"s=\'{s}\'")
-    return ret
+    srv = secrets.get("ntp_servers", None)  # e.g.: 'pool.ntp.org,time.google.com,192.168.1.1:123'
+    if srv is not None:
+        ntp_servers = srv.split(',')
 
 """
     Function main()
@@ -793,8 +1737,8 @@ def tag_adj(t):
     with a (CTRL+C) Keyboard Interrupt.
 """
 def main():
-    global my_debug, ctrl_c_flag, rtc_is_set, t_start
-    TAG=tag_adj("main(): ")
+    global ctrl_c_flag, rtc_is_set, t_start, net_ready, net_due
+    TAG = "main(): "
     lResult = True
     cnt = 0
     f = ''
@@ -802,7 +1746,8 @@ def main():
         f = roles_dict[1]
     elif id.find('titano') >= 0:
         f = roles_dict[0]
-    time.sleep(5) # Give user time to set up a terminal window or so
+    if not use_fast_start:
+        time.sleep(5) # Give user time to set up a terminal window or so
     print('=' * 36)
     print("SERCOM VIA I2C TEST")
     print(f"Version {sercom_I2C_version}")
@@ -810,6 +1755,10 @@ def main():
     print(f"in the role of {f}")
     print('=' * 36)
     setup()
+    if use_fast_start:
+        net_due = time.monotonic() + net_delay  # first serve the UART. See net_start()
+    else:
+        net_ready = True
     t_elapsed = 0
     t_curr = time.monotonic()
     t_interval = 120  # every 2 minutes. In future increase to 10 minutes (600)
@@ -819,8 +1768,8 @@ def main():
             if t_elapsed > 0 and t_elapsed % t_interval == 0:
                 t_start = t_curr
                 rtc_is_set = False  # sync buitl-in RTC from NTC)
-            if not wifi_is_connected():
-                print("\n"+TAG+"trying to connect WiFi...")
+            if net_ready and not wifi_is_connected():
+                log.info(TAG, "trying to connect WiFi...")
                 do_connect()
             #time.sleep(2)
             if cnt == 0:
@@ -829,7 +1778,9 @@ def main():
                 if lResult == -1: # A Keyboard Interrupt occurred?
                     raise KeyboardInterrupt # Yes, raise it
         except KeyboardInterrupt:
-            print(TAG+"KeyboardInterrupt- Exiting...") # Handle the Keyboard Interrupt
+            log.info(TAG, "KeyboardInterrupt- Exiting...") # Handle the Keyboard Interrupt
+            if use_trace:
+                trc.flush()
             sys.exit()
 
 if __name__ == '__main__':
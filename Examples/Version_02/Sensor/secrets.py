@@ -10,6 +10,10 @@ secrets = {
     'LOCAL_TIME_FLAG' : "1",
     'timezone' : 'Europe/Lisbon', # http://worldtimeapi.org/timezones
     'tz_offset' : '1',
+    # 'ntp_servers' : 'pool.ntp.org,time.google.com,192.168.1.1:123',
+    # 'sercom_ads' : '0x25',  # address of this Sensor on the bus (hex)
+    # 'sercom_reqs' : '100,101,102',  # request codes served by this Sensor
+    # 'sercom_rxbuf' : '128',  # size of the UART receive buffer (bytes, at least 2 frames)
     # 'timezone' : 'America/New_York',
     # 'tz_offset' : '-4',
     # 'timezone' : 'America/Kentucky/Louisville',
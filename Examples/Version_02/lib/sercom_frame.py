@@ -0,0 +1,672 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Framing used by the scripts of both the 'Main' and the 'Sensor' role.
+# Copy this file into the folder 'lib' of both devices.
+# Version 2
+#
+"""
+    Frames on the sercom_I2C line.
+
+    Every transmission, request, ACK, NAK or reply, is one frame:
+
+        byte 0      destination address
+        byte 1      source address
+        byte 2      n, length of the payload
+        byte 3      STX (start-of-text ASCII code)
+        byte 4      code: request code, ACK or NAK
+        byte 5      sequence number of the request (the reply echoes it)
+        byte 6..    payload (n bytes)
+        byte 6+n    checksum: the sum of bytes 0 .. 5+n, modulo 256
+
+    Several devices can share the line. The Parser only keeps the frames
+    addressed to its own address and, if enabled, to the broadcast address
+    BCAST. A broadcast frame is never acknowledged or answered. The payload
+    of a frame for another device is skipped using the length byte, without
+    copying or decoding it.
+    CREDIT frames carry the flow control (see Flow).
+    A device that needs time to produce a result can answer a request with PEND
+    (payload: 1 byte, the seconds it expects to need) and send the reply later,
+    with the code and the sequence number of the request, when the work is done.
+    Stats counts what went over the link; the 'stats' request returns it.
+    The frames to send are built in the blocks of a Pool, allocated once.
+    Rtt estimates the round-trip time of a device and gives the retransmission timeout.
+    Queue keeps the requests received until they are served, by priority.
+    Replies keeps the last reply sent to each device, to answer a retransmitted request again,
+    or to give identical requests from other devices the same reply.
+"""
+import random
+from array import array
+from micropython import const
+
+STX = const(0x02)  # Start-of-text ASCII code
+ACK = const(0x06)  # Acknowledge ASCII code
+NAK = const(0x15)  # Not acknowledged ASCII code
+CREDIT = const(0x11)  # DC1 ASCII code: free space of the receive buffer. See Flow
+PEND = const(0x16)  # SYN ASCII code: the reply follows later (deferred response)
+
+BCAST = const(0xFF)  # destination address of a frame for all devices
+
+HDR_LEN = const(6)   # dst, src, n, STX, code, seq
+OVERHEAD = const(7)  # header + checksum
+
+# Offsets in a frame
+DST = const(0)
+SRC = const(1)
+LEN = const(2)
+CODE = const(4)
+SEQ = const(5)
+
+# Link statistics: indexes in Stats.c, in the order of the payload of the 'stats' reply
+ST_TX_FRAMES = const(0)  # frames sent
+ST_RX_FRAMES = const(1)  # frames received (addressed to us or broadcast)
+ST_TX_BYTES = const(2)   # bytes sent
+ST_RX_BYTES = const(3)   # bytes read from the UART
+ST_TIMEOUTS = const(4)   # waits for a frame that timed out
+ST_INVALID = const(5)    # frames dropped by the parser (bad STX, length or checksum) and invalid messages
+ST_NAK = const(6)        # ACK failures: NAK sent or received, reply without ACK
+ST_RX_FULL = const(7)    # reads that filled the receive buffer: bytes may be lost
+ST_N = const(8)
+ST_NAMES = ('tx_frames', 'rx_frames', 'tx_bytes', 'rx_bytes', 'timeouts', 'invalid', 'nak', 'rx_full')
+
+def chksum(buf, n):
+    c = 0
+    for i in range(n):
+        c += buf[i]
+    return c & 0xFF
+
+"""
+    Function encode()
+
+    :param  bytearray buf, int dst, int src, int code, int seq, bytes or str payload
+    :return int, the length of the frame in buf
+
+    This function writes a frame into buf. buf must be at least
+    len(payload) + OVERHEAD bytes long. A str payload (ASCII) is copied
+    character by character, so it needs no encode() (allocation) first.
+"""
+def encode(buf, dst, src, code, seq, payload=None):
+    n = len(payload) if payload else 0
+    buf[0] = dst
+    buf[1] = src
+    buf[2] = n
+    buf[3] = STX
+    buf[4] = code
+    buf[5] = seq & 0xFF
+    if n:
+        if isinstance(payload, str):
+            for i in range(n):
+                buf[HDR_LEN + i] = ord(payload[i])
+        else:
+            buf[HDR_LEN:HDR_LEN + n] = payload
+    buf[HDR_LEN + n] = chksum(buf, HDR_LEN + n)
+    return n + OVERHEAD
+
+class Parser:
+    """
+        Incremental frame parser.
+
+        Feed it the bytes read from the UART with feed(). It returns as soon as
+        a complete and valid frame addressed to my_ads (or, if bcast is True,
+        a broadcast frame) is in self.frame.
+        The parser keeps its state between calls, so a frame may arrive
+        in several pieces.
+    """
+    def __init__(self, my_ads, max_payload=32, bcast=False):
+        self.my_ads = my_ads
+        self.bcast = bcast  # keep broadcast frames too
+        self.max_payload = max_payload
+        self.frame = bytearray(max_payload + OVERHEAD)
+        self._mv = memoryview(self.frame)
+        self._views = [None] * (max_payload + 1)  # payload views per length. See payload()
+        self.n_bad = 0     # frames dropped: bad STX, length or checksum
+        self.n_other = 0   # frames skipped: addressed to another device
+        self.reset()
+
+    def reset(self):
+        self._idx = 0    # nr of bytes of the current frame in self.frame
+        self._need = 0   # total length of the current frame, 0: not known yet
+        self._skip = 0   # nr of bytes still to skip of a frame for another device
+        self._mine = False
+
+    @property
+    def busy(self):
+        # part of a frame was received
+        return self._idx > 0 or self._skip > 0
+
+    def drop(self):
+        # Drop the part of a frame received, e.g. when its sender went silent.
+        # A bad length byte would otherwise swallow the frames that follow.
+        if self._idx:
+            self.n_bad += 1
+        self.reset()
+
+    def accepts(self, ads):
+        return ads == self.my_ads or (self.bcast and ads == BCAST)
+
+    @property
+    def payload_len(self):
+        return self.frame[LEN]
+
+    def payload(self):
+        # One view per payload length, made at its first use
+        n = self.frame[LEN]
+        v = self._views[n]
+        if v is None:
+            v = self._views[n] = self._mv[HDR_LEN:HDR_LEN + n]
+        return v
+
+    """
+        Function feed()
+
+        :param  buf, int i, int n
+        :return int, the index in buf after a complete frame, or -1
+
+        This function parses buf[i:n]. If a complete valid frame addressed to
+        us was found it returns the index of the first byte after that frame;
+        call feed() again from there for the next frame.
+        If all bytes were consumed without completing a frame it returns -1.
+    """
+    def feed(self, buf, i, n):
+        frame = self.frame
+        while i < n:
+            if self._skip:
+                k = n - i
+                if k > self._skip:
+                    k = self._skip
+                self._skip -= k
+                i += k
+                continue
+            b = buf[i]
+            i += 1
+            idx = self._idx
+            if idx == 0:
+                self._mine = self.accepts(b)
+            elif idx == LEN:
+                if b > self.max_payload:
+                    self.n_bad += 1
+                    self.reset()
+                    continue
+                self._need = b + OVERHEAD
+            elif idx == 3:
+                if b != STX:
+                    self.n_bad += 1
+                    self.reset()
+                    # this byte could be the destination of the next frame
+                    i -= 1
+                    continue
+                if not self._mine:
+                    # Not for us. Skip the rest without decoding it
+                    self.n_other += 1
+                    self._skip = self._need - 4
+                    self._idx = 0
+                    self._need = 0
+                    continue
+            frame[idx] = b
+            idx += 1
+            self._idx = idx
+            if self._need and idx == self._need:
+                self.reset()
+                if chksum(frame, idx - 1) == frame[idx - 1]:
+                    return i
+                self.n_bad += 1
+        return -1
+
+class Flow:
+    """
+        Credit-based flow control.
+
+        A device advertises the free space of its receive buffer in a CREDIT
+        frame to all devices (destination BCAST, payload: 2 bytes, big-endian):
+        at start-up and each time it has read thr bytes since its last
+        advertisement (see need_adv() and advert()).
+        A device sends a frame only if the credit of each device that advertised
+        (the free space it advertised minus the bytes sent since) is at least
+        the length of the frame (see can_send()). Every byte sent counts, as
+        every device on the line receives it. A device that never advertised
+        does not limit us, nor one that let a wait for credit time out (see
+        expire()) until it advertises again. CREDIT frames themselves are always sent.
+        One frame of max_frame bytes of the receive buffer is not advertised:
+        it takes the bytes that were on their way when the advertisement was sent.
+    """
+    def __init__(self, my_ads, rx_size, max_frame):
+        self.my_ads = my_ads
+        self.rx_size = rx_size
+        self.free = rx_size - max_frame if rx_size >= 2 * max_frame else rx_size // 2
+        thr = self.free - max_frame
+        if thr > self.free // 2:
+            thr = self.free // 2
+        self.thr = thr if thr > 0 else 1
+        self.credit = {}  # address of a device: bytes we may still send
+        self.adv = {}     # address of a device: free space it advertised last
+        self.n_stalls = 0    # frames that waited for credit
+        self.n_timeouts = 0  # waits for credit that timed out. See expire()
+        self.n_rx_full = 0   # reads that found the receive buffer full: bytes may be lost
+        self.n_adv = 0       # advertisements sent
+        self._rd = 0         # bytes read since our last advertisement
+        self._pl = bytearray(2)
+        self._buf = bytearray(OVERHEAD + 2)
+        self._mv = memoryview(self._buf)
+
+    """
+        Function received()
+
+        :param  int n, nr of bytes read from the UART
+        :return bool, True if the receive buffer was full
+    """
+    def received(self, n):
+        self._rd += n
+        if n >= self.rx_size:
+            self.n_rx_full += 1
+            return True
+        return False
+
+    def need_adv(self):
+        return self._rd >= self.thr
+
+    """
+        Function advert()
+
+        :param  None
+        :return memoryview, the CREDIT frame to send
+    """
+    def advert(self):
+        self._rd = 0
+        self.n_adv += 1
+        self._pl[0] = self.free >> 8
+        self._pl[1] = self.free & 0xFF
+        encode(self._buf, BCAST, self.my_ads, CREDIT, 0, self._pl)
+        return self._mv
+
+    """
+        Function granted()
+
+        :param  int src, address of the device; payload of its CREDIT frame
+        :return None
+    """
+    def granted(self, src, payload):
+        if len(payload) >= 2:
+            self.adv[src] = self.credit[src] = (payload[0] << 8) | payload[1]
+
+    def can_send(self, n):
+        for c in self.credit.values():
+            if c < n:
+                return False
+        return True
+
+    def sent(self, n):
+        for ads in self.credit:
+            self.credit[ads] -= n
+
+    """
+        Function expire()
+
+        :param  int n, length of the frame that waited
+        :return None
+
+        Called when a wait for credit timed out: a device went offline, an
+        advertisement was lost, or the count of the bytes sent no longer matches
+        what the devices read. A device that still has less than n bytes of
+        credit is forgotten: an offline device would otherwise stall every
+        frame by the wait. It limits us again from its next CREDIT frame.
+        The other devices are assumed to have read everything: their credits
+        are reset to the free space they advertised last.
+    """
+    def expire(self, n):
+        self.n_timeouts += 1
+        for ads in list(self.adv):
+            if self.credit[ads] < n:
+                del self.credit[ads]
+                del self.adv[ads]
+            else:
+                self.credit[ads] = self.adv[ads]
+
+class Stats:
+    """
+        Link statistics: ST_N counters of 32 bits, allocated once.
+
+        The scripts count in their send and receive paths:
+            stats.add(fr.ST_TX_FRAMES)
+            stats.add(fr.ST_TX_BYTES, n)
+        pack() writes the counters in the payload of the 'stats' reply:
+        ST_N x 4 bytes, big-endian, in the order of the ST_ indexes.
+        A counter wraps around at 2**32.
+    """
+    def __init__(self):
+        self.c = array('L', [0] * ST_N)
+        self._pl = bytearray(4 * ST_N)
+
+    def add(self, i, n=1):
+        self.c[i] = (self.c[i] + n) & 0xFFFFFFFF
+
+    def reset(self):
+        for i in range(ST_N):
+            self.c[i] = 0
+
+    """
+        Function pack()
+
+        :param  Parser parser (optional), its dropped frames are added to ST_INVALID
+        :return bytearray, the payload of the 'stats' reply
+    """
+    def pack(self, parser=None):
+        pl = self._pl
+        j = 0
+        for i in range(ST_N):
+            v = self.c[i]
+            if i == ST_INVALID and parser is not None:
+                v = (v + parser.n_bad) & 0xFFFFFFFF
+            pl[j] = v >> 24
+            pl[j + 1] = (v >> 16) & 0xFF
+            pl[j + 2] = (v >> 8) & 0xFF
+            pl[j + 3] = v & 0xFF
+            j += 4
+        return pl
+
+"""
+    Function unpack_stats()
+
+    :param  payload of a 'stats' reply
+    :return dict, {counter name: value} (see ST_NAMES)
+"""
+def unpack_stats(payload):
+    res = {}
+    for i in range(min(len(payload) // 4, ST_N)):
+        j = 4 * i
+        res[ST_NAMES[i]] = (payload[j] << 24) | (payload[j + 1] << 16) | (payload[j + 2] << 8) | payload[j + 3]
+    return res
+
+class Pool:
+    """
+        Fixed-block pool of frame buffers.
+
+        n blocks of size bytes, allocated once, in one bytearray.
+        The transport borrows a block to build a frame in and returns it:
+            blk = pool.get()
+            if blk < 0:
+                ...  # exhausted: all blocks are lent
+            n = fr.encode(pool.buf(blk), dst, src, code, seq, payload)
+            uart.write(pool.view(blk, n))
+            pool.put(blk)
+        view() keeps the memoryview of the first n bytes of each block per length,
+        so after the first frames of each length no memory is allocated.
+    """
+    def __init__(self, n, size):
+        self.n = n
+        self.size = size
+        self._mem = bytearray(n * size)
+        mv = memoryview(self._mem)
+        self._blocks = [mv[i * size:(i + 1) * size] for i in range(n)]
+        self._views = [{} for _ in range(n)]
+        self._free = bytearray(range(n))  # stack of the indexes of the free blocks
+        self.n_free = n
+        self.low = n          # lowest nr of free blocks seen
+        self.n_exhausted = 0  # get() calls that found no free block
+
+    """
+        Function get()
+
+        :param  None
+        :return int, index of a free block, or -1 if all blocks are lent
+    """
+    def get(self):
+        if not self.n_free:
+            self.n_exhausted += 1
+            return -1
+        self.n_free -= 1
+        if self.n_free < self.low:
+            self.low = self.n_free
+        return self._free[self.n_free]
+
+    def put(self, i):
+        self._free[self.n_free] = i
+        self.n_free += 1
+
+    def buf(self, i):
+        return self._blocks[i]
+
+    def view(self, i, n):
+        v = self._views[i].get(n, None)
+        if v is None:
+            v = self._views[i][n] = self._blocks[i][:n]
+        return v
+
+class Rtt:
+    """
+        Round-trip time estimator and retransmission timeout (like RFC 6298).
+
+        sample(r) adds a measured round-trip time r (seconds):
+            first sample:   srtt = r, rttvar = r / 2
+            then:           rttvar = 3/4 rttvar + 1/4 |srtt - r|, srtt = 7/8 srtt + 1/8 r
+            rto = srtt + 4 * rttvar, at least rto_min and at most rto_max
+        Only measure a request that was sent once (Karn): the ACK of a retransmitted
+        request may answer an earlier copy.
+        backoff(k) is the timeout after the k-th retransmission: rto * 2**k, at most
+        rto_max, plus a random part of up to jitter times that, so that devices that
+        lost the same frame do not retry in lockstep.
+    """
+    def __init__(self, rto_init=1.0, rto_min=0.1, rto_max=4.0, jitter=0.25):
+        self.rto_min = rto_min
+        self.rto_max = rto_max
+        self.jitter = jitter
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = rto_init
+        self.n_samples = 0
+
+    def sample(self, r):
+        if self.srtt is None:
+            self.srtt = r
+            self.rttvar = r / 2
+        else:
+            d = self.srtt - r
+            self.rttvar += ((d if d >= 0 else -d) - self.rttvar) / 4
+            self.srtt += (r - self.srtt) / 8
+        rto = self.srtt + 4 * self.rttvar
+        if rto < self.rto_min:
+            rto = self.rto_min
+        elif rto > self.rto_max:
+            rto = self.rto_max
+        self.rto = rto
+        self.n_samples += 1
+
+    def backoff(self, k):
+        t = self.rto * (1 << k)
+        if t > self.rto_max:
+            t = self.rto_max
+        return t + t * self.jitter * random.random()
+
+class Queue:
+    """
+        Fixed-size priority queue of requests, allocated once.
+
+        put() keeps a request: its code, source address, sequence number,
+        priority (0 is served first), time received, deadline (a time.monotonic()
+        value, 0.0: none) and a copy of its payload (at most max_payload bytes).
+        A request with the code, source and sequence number of one in the queue
+        (a retransmission) is not added again.
+        get() returns the slot of the request to serve next: the lowest priority,
+        then the oldest. The caller reads code[i], src[i], seq[i] and payload(i),
+        handles the request, then calls free(i).
+        Requests past their deadline are dropped by get(): nobody waits for them anymore.
+        When the queue is full, a request takes the slot of the queued request
+        with the highest priority, if that is higher than its own.
+    """
+    def __init__(self, n, max_payload=32):
+        self.n = n
+        self.max_payload = max_payload
+        self._pl = bytearray(n * max_payload)
+        self._mv = memoryview(self._pl)
+        self.pl_len = bytearray(n)
+        self.code = bytearray(n)  # request code per slot, 0: free
+        self.src = bytearray(n)
+        self.seq = bytearray(n)
+        self.prio = bytearray(n)
+        self.t = [0.0] * n    # time received
+        self.dl = [0.0] * n   # deadline, 0.0: none
+        self.count = 0        # nr of requests in the queue
+        self.n_full = 0       # requests refused: the queue was full
+        self.n_dropped = 0    # requests that lost their slot to a request with a lower priority
+        self.n_expired = 0    # requests dropped past their deadline
+
+    """
+        Function put()
+
+        :param  int code, int src, int seq, int prio, float t, float dl, payload
+        :return int, the slot of the request, or -1 if the queue is full
+    """
+    def put(self, code, src, seq, prio, t, dl=0.0, payload=None):
+        code_ = self.code
+        free = -1
+        worst = -1
+        for i in range(self.n):
+            c = code_[i]
+            if not c:
+                if free < 0:
+                    free = i
+            elif c == code and self.src[i] == src and self.seq[i] == seq:
+                return i
+            elif worst < 0 or self.prio[i] > self.prio[worst]:
+                worst = i
+        if free < 0:
+            if worst < 0 or self.prio[worst] <= prio:
+                self.n_full += 1
+                return -1
+            self.n_dropped += 1
+            free = worst
+            self.count -= 1
+        code_[free] = code
+        self.src[free] = src
+        self.seq[free] = seq
+        self.prio[free] = prio
+        self.t[free] = t
+        self.dl[free] = dl
+        n = 0
+        if payload is not None:
+            n = len(payload)
+            if n > self.max_payload:
+                n = self.max_payload
+            i = free * self.max_payload
+            self._pl[i:i + n] = payload[:n]
+        self.pl_len[free] = n
+        self.count += 1
+        return free
+
+    """
+        Function get()
+
+        :param  float now
+        :return int, the slot of the request to serve next, or -1 if the queue is empty
+    """
+    def get(self, now):
+        best = -1
+        if not self.count:
+            return best
+        for i in range(self.n):
+            if not self.code[i]:
+                continue
+            if self.dl[i] and now > self.dl[i]:
+                self.n_expired += 1
+                self.free(i)
+                continue
+            if best < 0 or self.prio[i] < self.prio[best] or \
+                    (self.prio[i] == self.prio[best] and self.t[i] < self.t[best]):
+                best = i
+        return best
+
+    def payload(self, i):
+        j = i * self.max_payload
+        return self._mv[j:j + self.pl_len[i]]
+
+    def free(self, i):
+        if self.code[i]:
+            self.code[i] = 0
+            self.count -= 1
+
+class Replies:
+    """
+        Last reply sent to each device, to answer a retransmitted request (idempotency).
+
+        n slots of size bytes, allocated once: one slot per device, the oldest slot
+        is reused for a new device. put() copies the frame sent in answer to request
+        code req with sequence number seq. get() returns that frame, as a memoryview,
+        when the same request (src, req, seq) arrives again less than ttl seconds later,
+        else None. The ttl keeps a request with a sequence number that wrapped around
+        from getting an old reply.
+    """
+    def __init__(self, n, size, ttl=30.0):
+        self.n = n
+        self.size = size
+        self.ttl = ttl
+        self._mem = bytearray(n * size)
+        mv = memoryview(self._mem)
+        self._slots = [mv[i * size:(i + 1) * size] for i in range(n)]
+        self._views = [{} for _ in range(n)]
+        self.dst = bytearray(n)
+        self.req = bytearray(n)   # request code per slot, 0: empty
+        self.seq = bytearray(n)
+        self.length = bytearray(n)
+        self.t = [0.0] * n        # time the reply was sent
+        self.n_hits = 0           # retransmitted requests answered from a slot
+
+    """
+        Function put()
+
+        :param  int dst, int req, int seq, buf with the frame, int n, length of the frame, float t
+        :return None
+    """
+    def put(self, dst, req, seq, buf, n, t):
+        if n > self.size:
+            return
+        k = 0
+        for i in range(self.n):
+            if self.req[i] and self.dst[i] == dst:
+                k = i
+                break
+            if self.t[i] < self.t[k] or (self.req[k] and not self.req[i]):
+                k = i
+        self._slots[k][:n] = buf[:n]
+        self.dst[k] = dst
+        self.req[k] = req
+        self.seq[k] = seq
+        self.length[k] = n
+        self.t[k] = t
+
+    """
+        Function get()
+
+        :param  int src, int req, int seq, float now
+        :return memoryview of the reply sent before, or None
+    """
+    def get(self, src, req, seq, now):
+        for i in range(self.n):
+            if self.req[i] == req and self.dst[i] == src and self.seq[i] == seq:
+                if now - self.t[i] > self.ttl:
+                    return None
+                self.n_hits += 1
+                return self._view(i)
+        return None
+
+    """
+        Function last()
+
+        :param  int dst, int seq
+        :return memoryview of the reply just sent to dst for request seq, or None
+
+        Like get(), without the ttl and not counted as a hit: the caller sends
+        the same reply to other devices. See the Sensor script, coalesce().
+    """
+    def last(self, dst, seq):
+        for i in range(self.n):
+            if self.req[i] and self.dst[i] == dst and self.seq[i] == seq:
+                return self._view(i)
+        return None
+
+    def _view(self, i):
+        n = self.length[i]
+        v = self._views[i].get(n, None)
+        if v is None:
+            v = self._views[i][n] = self._slots[i][:n]
+        return v
@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Logger used by the scripts of both the 'Main' and the 'Sensor' role.
+# Copy this file into the folder 'lib' of both devices.
+# Version 2
+#
+"""
+    Leveled logger with deferred formatting.
+
+    Usage:
+        import sercom_log as log
+        TAG = "ck_uart(): "
+        log.info(TAG, "received request: {} = {}", req, req_txt)
+
+    The message and its arguments are only formatted (msg.format(*args))
+    if the level of the call is enabled. The tag is a constant string;
+    it is padded to tag_le_max only when the line is emitted.
+    Emitted lines are printed to the REPL (if echo is True) and, after
+    set_ring() was called, kept in an in-RAM ring buffer (see dump()).
+"""
+from micropython import const
+
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+OFF = const(50)
+
+level = INFO      # calls below this level are dropped before any formatting
+echo = True       # print emitted lines to the REPL
+tag_le_max = 20   # width of the tag column
+
+_ring = None      # ring buffer of emitted lines. See set_ring()
+_ring_idx = 0
+_ring_cnt = 0
+
+"""
+    Function set_level()
+
+    :param  int lvl, one of DEBUG, INFO, WARNING, ERROR, OFF
+    :return None
+"""
+def set_level(lvl):
+    global level
+    level = lvl
+
+"""
+    Function set_ring()
+
+    :param  int n, number of lines to keep. 0 disables the ring buffer
+    :return None
+
+    The ring buffer is allocated once here. When it is full
+    the oldest line is overwritten.
+"""
+def set_ring(n):
+    global _ring, _ring_idx, _ring_cnt
+    _ring = [None] * n if n > 0 else None
+    _ring_idx = 0
+    _ring_cnt = 0
+
+def enabled(lvl):
+    return lvl >= level
+
+def _emit(tag, msg, args):
+    global _ring_idx, _ring_cnt
+    if args:
+        msg = msg.format(*args)
+    le = len(tag)
+    s = tag + " " * (tag_le_max - le) + msg if le < tag_le_max else tag + msg
+    if echo:
+        print(s)
+    if _ring is not None:
+        _ring[_ring_idx] = s
+        _ring_idx = (_ring_idx + 1) % len(_ring)
+        if _ring_cnt < len(_ring):
+            _ring_cnt += 1
+
+def debug(tag, msg, *args):
+    if level <= DEBUG:
+        _emit(tag, msg, args)
+
+def info(tag, msg, *args):
+    if level <= INFO:
+        _emit(tag, msg, args)
+
+def warning(tag, msg, *args):
+    if level <= WARNING:
+        _emit(tag, msg, args)
+
+def error(tag, msg, *args):
+    if level <= ERROR:
+        _emit(tag, msg, args)
+
+"""
+    Function lines()
+
+    :param  None
+    :return list, the lines in the ring buffer, oldest first
+"""
+def lines():
+    if _ring is None:
+        return []
+    n = len(_ring)
+    start = (_ring_idx - _ring_cnt) % n
+    return [_ring[(start + i) % n] for i in range(_ring_cnt)]
+
+"""
+    Function dump()
+
+    :param  None
+    :return None
+
+    Prints the lines in the ring buffer, oldest first.
+"""
+def dump():
+    for s in lines():
+        print(s)
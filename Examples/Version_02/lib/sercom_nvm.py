@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Last known time kept in the non-volatile memory (microcontroller.nvm), used by the script of the 'Main' role.
+# Copy this file into the folder 'lib' of both devices.
+# Version 2
+#
+"""
+    Time record in NVM.
+
+    Usage:
+        import microcontroller
+        import sercom_nvm as nvs
+        rec = nvs.start(microcontroller.nvm)  # (epoch, flags) of the newest record, or None
+        ...
+        nvs.save(time.time(), nvs.SYNCED)     # after a sync over the link
+
+    The records are kept in a ring of n_slots slots of SLOT_LEN bytes from
+    offset ofs in the NVM. Each save() writes the next slot, in one write:
+        seq     2 bytes, big-endian: sequence number, +1 each save (modulo 2**16)
+        epoch   4 bytes, big-endian: seconds since 1970-01-01 of the built-in RTC
+        flags   1 byte: SYNCED if the time came from a Sensor
+        chk     1 byte: (sum of the 7 bytes above + CHK_SEED) modulo 256
+    The valid slot with the highest sequence number is the newest. A slot that is
+    erased (0xFF) or all zero, or a record cut by a power loss, fails the checksum.
+    So a write can never destroy the previous record, and the writes are spread over
+    the slots. Flash backed NVM erases a whole page per write: the caller limits
+    the number of writes (see nvm_period of the Main script).
+"""
+from micropython import const
+
+SLOT_LEN = const(8)
+CHK_SEED = const(0x5A)
+SYNCED = const(0x01)  # flag: the time was set by a Sensor, not estimated
+
+n_writes = 0  # nr of records written since start()
+
+_nvm = None
+_ofs = 0
+_n_slots = 0
+_slot = -1   # slot of the newest record, -1: none
+_seq = 0
+_rec = bytearray(SLOT_LEN)
+
+def _chk(buf, i):
+    c = CHK_SEED
+    for j in range(i, i + SLOT_LEN - 1):
+        c += buf[j]
+    return c & 0xFF
+
+"""
+    Function start()
+
+    :param  nvm (bytearray-like, e.g. microcontroller.nvm), int ofs, int n_slots
+    :return tuple (int epoch, int flags) of the newest valid record, or None
+"""
+def start(nvm, ofs=0, n_slots=16):
+    global _nvm, _ofs, _n_slots, _slot, _seq
+    _nvm = nvm
+    _ofs = ofs
+    _n_slots = n_slots
+    _slot = -1
+    _seq = 0
+    res = None
+    if nvm is None or len(nvm) < ofs + n_slots * SLOT_LEN:
+        _nvm = None
+        return res
+    buf = nvm[ofs:ofs + n_slots * SLOT_LEN]  # one read
+    for s in range(n_slots):
+        i = s * SLOT_LEN
+        if buf[i + SLOT_LEN - 1] != _chk(buf, i):
+            continue
+        seq = (buf[i] << 8) | buf[i + 1]
+        # serial number arithmetic: seq is newer if it is less than 2**15 ahead
+        if _slot < 0 or 0 < ((seq - _seq) & 0xFFFF) < 0x8000:
+            _slot = s
+            _seq = seq
+            res = ((buf[i + 2] << 24) | (buf[i + 3] << 16) | (buf[i + 4] << 8) | buf[i + 5], buf[i + 6])
+    return res
+
+"""
+    Function save()
+
+    :param  int epoch, int flags
+    :return bool, True if the record was written
+"""
+def save(epoch, flags=0):
+    global _slot, _seq, n_writes
+    if _nvm is None:
+        return False
+    _slot = (_slot + 1) % _n_slots
+    _seq = (_seq + 1) & 0xFFFF
+    r = _rec
+    r[0] = _seq >> 8
+    r[1] = _seq & 0xFF
+    r[2] = (epoch >> 24) & 0xFF
+    r[3] = (epoch >> 16) & 0xFF
+    r[4] = (epoch >> 8) & 0xFF
+    r[5] = epoch & 0xFF
+    r[6] = flags
+    r[7] = _chk(r, 0)
+    i = _ofs + _slot * SLOT_LEN
+    _nvm[i:i + SLOT_LEN] = r
+    n_writes += 1
+    return True
@@ -0,0 +1,132 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Trace of the bytes on the UART, used by the scripts of both the 'Main' and the 'Sensor' role.
+# Copy this file into the folder 'lib' of both devices.
+# Version 2
+#
+"""
+    Link trace.
+
+    Usage:
+        import sercom_trace as trc
+        trc.start(1024, 'trace_main.bin', my_ads)
+        ...
+        n = uart.readinto(rx_buffer)
+        if n:
+            trc.rx(rx_buffer, n)
+        ...
+        trc.flush()  # before exit
+
+    The bytes received (rx()) and sent (tx()) are recorded with a timestamp
+    in a buffer that is allocated once by start(). When the buffer is full,
+    and at flush(), all records are written in one batch: appended to the
+    trace file or, if it cannot be written (the CIRCUITPY drive is read-only
+    for code.py unless remounted in boot.py), printed to the REPL as hex
+    lines starting with 'TRC:'.
+
+    Trace: MAGIC, the address of the device (1 byte), then the records:
+        t       4 bytes, little-endian: microseconds since start() (modulo 2**32)
+        dir     1 byte: RX or TX
+        n       1 byte: nr of bytes
+        data    n bytes
+    Host/replay_trace.py reads the file and the REPL output.
+"""
+import struct
+import time
+from binascii import hexlify
+from micropython import const
+
+RX = const(0)
+TX = const(1)
+MAGIC = b'SCT1'
+HDR_LEN = const(6)   # t, dir, n
+HEX_LINE = const(48)  # bytes per 'TRC:' line
+
+enabled = False
+n_flush = 0   # nr of batches written
+n_lost = 0    # bytes not recorded: start() was not called
+
+_buf = None
+_idx = 0
+_t0 = 0
+_path = None
+
+"""
+    Function start()
+
+    :param  int size, size of the trace buffer; str path, trace file or None (REPL); int ads
+    :return None
+"""
+def start(size=1024, path=None, ads=0):
+    global _buf, _idx, _t0, _path, enabled
+    _buf = bytearray(size)
+    _idx = 0
+    _path = path
+    hdr = MAGIC + bytes((ads,))
+    if _path is not None:
+        try:
+            with open(_path, 'wb') as f:
+                f.write(hdr)
+        except OSError:
+            _path = None
+    if _path is None:
+        print("TRC:" + hexlify(hdr).decode())
+    _t0 = time.monotonic_ns()
+    enabled = True
+
+def _record(d, buf, n):
+    global _idx, n_lost
+    if not enabled:
+        n_lost += n
+        return
+    size = len(_buf)
+    mv = memoryview(buf)
+    i = 0
+    while i < n:
+        k = n - i
+        if k > 255:
+            k = 255
+        if k > size - HDR_LEN:
+            k = size - HDR_LEN
+        if _idx + HDR_LEN + k > size:
+            flush()
+        t = ((time.monotonic_ns() - _t0) // 1000) & 0xFFFFFFFF
+        struct.pack_into("<IBB", _buf, _idx, t, d, k)
+        j = _idx + HDR_LEN
+        _buf[j:j + k] = mv[i:i + k]
+        _idx = j + k
+        i += k
+
+def rx(buf, n):
+    _record(RX, buf, n)
+
+def tx(buf, n):
+    _record(TX, buf, n)
+
+"""
+    Function flush()
+
+    :param  None
+    :return None
+
+    Writes the records in the trace buffer in one batch and empties it.
+"""
+def flush():
+    global _idx, _path, n_flush
+    if not _idx:
+        return
+    data = memoryview(_buf)[:_idx]
+    if _path is not None:
+        try:
+            with open(_path, 'ab') as f:
+                f.write(data)
+        except OSError:
+            _path = None  # From now on the REPL
+    if _path is None:
+        for i in range(0, _idx, HEX_LINE):
+            print("TRC:" + hexlify(data[i:i + HEX_LINE]).decode())
+    _idx = 0
+    n_flush += 1
@@ -0,0 +1,18 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Tests of the modules in lib, run with CPython: python -m pytest
+# Version 2
+#
+import os
+import sys
+import types
+
+# The modules in lib import const from micropython (see Host/sim_board.py)
+if 'micropython' not in sys.modules:
+    sys.modules['micropython'] = types.ModuleType('micropython')
+    sys.modules['micropython'].const = lambda x: x
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
@@ -0,0 +1,311 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Tests of lib/sercom_frame.py.
+# Version 2
+#
+import sercom_frame as fr
+from sercom_frame import Flow, Parser, Pool, Queue, Replies, Rtt, Stats
+
+ME = 0x25
+
+def frame(dst, src, code, seq, payload=None):
+    buf = bytearray(64)
+    n = fr.encode(buf, dst, src, code, seq, payload)
+    return bytes(buf[:n])
+
+def parse(p, data):
+    """The frames parsed from data, as (code, seq, payload)."""
+    res = []
+    i = 0
+    while True:
+        i = p.feed(data, i, len(data))
+        if i < 0:
+            return res
+        f = p.frame
+        res.append((f[fr.CODE], f[fr.SEQ], bytes(p.payload())))
+
+# encode() and Parser
+
+def test_encode():
+    b = frame(0x25, 0x20, 100, 0x1FF, b'ab')
+    assert b[:6] == bytes((0x25, 0x20, 2, fr.STX, 100, 0xFF))
+    assert b[6:8] == b'ab'
+    assert b[8] == sum(b[:8]) & 0xFF
+    assert len(b) == 2 + fr.OVERHEAD
+    assert frame(0x25, 0x20, 100, 1, 'ab') == frame(0x25, 0x20, 100, 1, b'ab')
+    assert frame(0x25, 0x20, fr.ACK, 1) == bytes((0x25, 0x20, 0, fr.STX, fr.ACK, 1, (0x25 + 0x20 + 2 + 6 + 1) & 0xFF))
+
+def test_parser_in_pieces():
+    p = Parser(ME)
+    b = frame(ME, 0x20, 100, 3, b'hello')
+    for k in range(len(b) - 1):
+        assert p.feed(b, k, k + 1) == -1
+        assert p.busy
+    assert p.feed(b, len(b) - 1, len(b)) == len(b)
+    assert not p.busy
+    assert bytes(p.payload()) == b'hello'
+    assert p.payload() is p.payload()  # one view per length
+
+def test_parser_address_filter():
+    p = Parser(ME)
+    data = frame(0x26, 0x20, 100, 1, b'for-another') + frame(fr.BCAST, 0x20, 110, 2, b'all') + \
+        frame(ME, 0x20, 101, 3, b'mine')
+    assert parse(p, data) == [(101, 3, b'mine')]
+    assert p.n_other == 2
+    assert p.n_bad == 0
+    p = Parser(ME, bcast=True)
+    assert parse(p, data) == [(110, 2, b'all'), (101, 3, b'mine')]
+    assert p.n_other == 1
+
+def test_parser_skips_foreign_payload():
+    # the payload of a frame for another device is not decoded: an STX in it does not matter
+    p = Parser(ME)
+    data = frame(0x26, 0x20, 100, 1, bytes((ME, 0x20, 0, fr.STX))) + frame(ME, 0x20, 101, 2)
+    assert parse(p, data) == [(101, 2, b'')]
+    assert p.n_bad == 0
+
+def test_parser_stx_resync():
+    p = Parser(ME)
+    data = b'\x01\x02\x03' + frame(ME, 0x20, 100, 1, b'x')
+    assert parse(p, data) == [(100, 1, b'x')]
+    assert p.n_bad == 1
+
+def test_parser_checksum():
+    p = Parser(ME)
+    bad = bytearray(frame(ME, 0x20, 100, 1, b'abc'))
+    bad[7] ^= 0x04
+    assert parse(p, bytes(bad) + frame(ME, 0x20, 100, 2, b'abc')) == [(100, 2, b'abc')]
+    assert p.n_bad == 1
+
+def test_parser_length():
+    p = Parser(ME, max_payload=4)
+    assert parse(p, frame(ME, 0x20, 100, 1, b'12345') + frame(ME, 0x20, 100, 2, b'1234')) == [(100, 2, b'1234')]
+    assert p.n_bad >= 1
+
+def test_parser_drop():
+    p = Parser(ME)
+    b = frame(ME, 0x20, 100, 1, b'abc')
+    assert p.feed(b, 0, 5) == -1
+    p.drop()  # the sender went silent
+    assert not p.busy
+    assert p.n_bad == 1
+    p.drop()
+    assert p.n_bad == 1
+    assert parse(p, b) == [(100, 1, b'abc')]
+
+# Flow
+
+def test_flow_advert():
+    f = Flow(ME, 256, 39)
+    assert f.free == 256 - 39
+    p = Parser(0x20, bcast=True)
+    assert parse(p, bytes(f.advert())) == [(fr.CREDIT, 0, bytes((0, 256 - 39)))]
+    assert not f.need_adv()
+    f.received(f.thr - 1)
+    assert not f.need_adv()
+    f.received(1)
+    assert f.need_adv()
+    f.advert()
+    assert not f.need_adv()
+    assert f.received(256)
+    assert f.n_rx_full == 1
+
+def test_flow_credit():
+    f = Flow(ME, 256, 39)
+    assert f.can_send(1000)  # no device advertised yet
+    f.granted(0x20, b'\x00\x64')
+    f.granted(0x21, b'\x00\xc8')
+    f.sent(60)
+    assert f.credit == {0x20: 40, 0x21: 140}
+    assert f.can_send(40)
+    assert not f.can_send(41)
+    f.granted(0x20, b'\x00\x64')
+    assert f.can_send(41)
+
+def test_flow_expire():
+    f = Flow(ME, 256, 39)
+    f.granted(0x20, b'\x00\x64')
+    f.granted(0x21, b'\x00\xc8')
+    f.sent(90)
+    assert not f.can_send(20)
+    f.expire(20)  # 0x20 is gone, 0x21 read everything
+    assert f.n_timeouts == 1
+    assert f.credit == {0x21: 200}
+    assert f.can_send(200)
+    f.granted(0x20, b'\x00\x10')  # back
+    assert not f.can_send(17)
+
+# Stats
+
+def test_stats_pack():
+    st = Stats()
+    st.add(fr.ST_TX_FRAMES)
+    st.add(fr.ST_TX_BYTES, 0x12345)
+    st.add(fr.ST_INVALID, 2)
+    res = fr.unpack_stats(st.pack())
+    assert len(st.pack()) == 4 * fr.ST_N
+    assert res == dict(zip(fr.ST_NAMES, (1, 0, 0x12345, 0, 0, 2, 0, 0)))
+    p = Parser(ME)
+    parse(p, b'\x01\x02\x03' + frame(ME, 0x20, 100, 1))
+    assert p.n_bad == 1
+    assert fr.unpack_stats(st.pack(p))['invalid'] == 3  # the frames dropped by the parser count
+    assert st.c[fr.ST_INVALID] == 2
+    st.reset()
+    assert set(fr.unpack_stats(st.pack()).values()) == {0}
+
+def test_stats_wrap():
+    st = Stats()
+    st.add(fr.ST_RX_BYTES, 0xFFFFFFFF)
+    st.add(fr.ST_RX_BYTES, 3)
+    assert st.c[fr.ST_RX_BYTES] == 2
+    assert fr.unpack_stats(b'\x00\x00\x01\x00\x00') == {'tx_frames': 256}  # a short payload
+
+# Pool
+
+def test_pool_get_put():
+    pool = Pool(2, 16)
+    a = pool.get()
+    b = pool.get()
+    assert {a, b} == {0, 1}
+    assert pool.get() == -1  # exhausted
+    assert pool.n_exhausted == 1
+    assert pool.low == 0
+    pool.put(a)
+    assert pool.get() == a
+    pool.put(a)
+    pool.put(b)
+    assert pool.n_free == 2
+    assert pool.low == 0
+
+def test_pool_buf_view():
+    pool = Pool(2, 16)
+    a = pool.get()
+    b = pool.get()
+    n = fr.encode(pool.buf(a), ME, 0x20, 100, 1, b'abc')
+    assert len(pool.buf(a)) == 16
+    assert bytes(pool.view(a, n)) == frame(ME, 0x20, 100, 1, b'abc')
+    assert pool.view(a, n) is pool.view(a, n)  # one view per length
+    pool.buf(b)[:] = b'\xff' * 16
+    assert bytes(pool.view(a, n)) == frame(ME, 0x20, 100, 1, b'abc')  # blocks do not overlap
+
+# Rtt
+
+def test_rtt_sample():
+    r = Rtt(rto_init=1.0, rto_min=0.1, rto_max=4.0)
+    r.sample(0.2)
+    assert r.srtt == 0.2
+    assert abs(r.rttvar - 0.1) < 1e-9
+    assert abs(r.rto - 0.6) < 1e-9
+    r.sample(0.2)
+    assert abs(r.rttvar - 0.075) < 1e-9
+    assert r.n_samples == 2
+
+def test_rtt_clamp():
+    r = Rtt(rto_min=0.1, rto_max=4.0)
+    r.sample(0.001)
+    assert r.rto == 0.1
+    r = Rtt(rto_min=0.1, rto_max=4.0)
+    r.sample(3.0)
+    assert r.rto == 4.0
+
+def test_rtt_backoff():
+    r = Rtt(rto_init=0.5, rto_max=4.0, jitter=0.0)
+    assert [r.backoff(k) for k in range(5)] == [0.5, 1.0, 2.0, 4.0, 4.0]
+    r.jitter = 0.25
+    for k in range(5):
+        t = min(0.5 * (1 << k), 4.0)
+        assert t <= r.backoff(k) <= t * 1.25
+
+# Queue
+
+def test_queue_put_dedup():
+    q = Queue(4)
+    i = q.put(100, 0x20, 7, 1, 1.0, payload=b'ab')
+    assert q.put(100, 0x20, 7, 1, 2.0, payload=b'cd') == i  # retransmission
+    assert q.count == 1
+    assert bytes(q.payload(i)) == b'ab'
+    assert q.put(100, 0x20, 8, 1, 2.0) != i  # next sequence number
+    assert q.put(101, 0x20, 7, 1, 2.0) != i  # other code
+    assert q.put(100, 0x21, 7, 1, 2.0) != i  # other source
+    assert q.count == 4
+
+def test_queue_get_order():
+    q = Queue(4)
+    a = q.put(100, 0x20, 1, 2, 1.0)
+    b = q.put(101, 0x20, 2, 1, 3.0)
+    c = q.put(102, 0x20, 3, 1, 2.0)
+    assert q.get(4.0) == c  # lowest priority, then the oldest
+    q.free(c)
+    assert q.get(4.0) == b
+    q.free(b)
+    assert q.get(4.0) == a
+    q.free(a)
+    assert q.get(4.0) == -1
+    assert q.count == 0
+
+def test_queue_full_evicts_by_prio():
+    q = Queue(2)
+    low = q.put(102, 0x20, 1, 3, 1.0)
+    q.put(100, 0x20, 2, 1, 1.0)
+    assert q.put(101, 0x20, 3, 3, 2.0) == -1  # not more urgent than the worst queued
+    assert q.n_full == 1
+    i = q.put(101, 0x20, 4, 0, 2.0)
+    assert i == low
+    assert q.code[i] == 101
+    assert q.n_dropped == 1
+    assert q.count == 2
+
+def test_queue_deadline():
+    q = Queue(4)
+    i = q.put(100, 0x20, 1, 0, 1.0, dl=5.0)
+    j = q.put(101, 0x20, 2, 1, 1.0)
+    assert q.get(5.0) == i
+    assert q.get(5.5) == j
+    assert q.n_expired == 1
+    assert q.count == 1
+    assert q.code[i] == 0
+
+def test_queue_payload_cut():
+    q = Queue(2, max_payload=4)
+    i = q.put(100, 0x20, 1, 0, 1.0, payload=b'abcdef')
+    assert bytes(q.payload(i)) == b'abcd'
+
+# Replies
+
+def test_replies_get():
+    r = Replies(2, 16, ttl=30.0)
+    r.put(0x20, 100, 5, b'reply-a', 7, 10.0)
+    assert bytes(r.get(0x20, 100, 5, 20.0)) == b'reply-a'
+    assert r.n_hits == 1
+    assert r.get(0x20, 100, 6, 20.0) is None
+    assert r.get(0x21, 100, 5, 20.0) is None
+    assert r.get(0x20, 101, 5, 20.0) is None
+
+def test_replies_ttl():
+    r = Replies(2, 16, ttl=30.0)
+    r.put(0x20, 100, 5, b'reply-a', 7, 10.0)
+    assert r.get(0x20, 100, 5, 40.0) is not None
+    assert r.get(0x20, 100, 5, 40.5) is None  # sequence number may have wrapped around
+    assert r.n_hits == 1
+    assert bytes(r.last(0x20, 5)) == b'reply-a'  # no ttl
+
+def test_replies_slot_reuse():
+    r = Replies(2, 16)
+    r.put(0x20, 100, 1, b'a1', 2, 1.0)
+    r.put(0x21, 100, 1, b'b1', 2, 2.0)
+    r.put(0x20, 101, 2, b'a2!', 3, 3.0)  # same device: its own slot
+    assert r.get(0x20, 100, 1, 3.0) is None
+    assert bytes(r.get(0x20, 101, 2, 3.0)) == b'a2!'
+    assert bytes(r.get(0x21, 100, 1, 3.0)) == b'b1'
+    r.put(0x22, 100, 1, b'c1', 2, 4.0)  # new device: the oldest slot (0x21)
+    assert r.get(0x21, 100, 1, 4.0) is None
+    assert bytes(r.get(0x20, 101, 2, 4.0)) == b'a2!'
+    assert bytes(r.get(0x22, 100, 1, 4.0)) == b'c1'
+
+def test_replies_too_long():
+    r = Replies(1, 4)
+    r.put(0x20, 100, 1, b'abcdef', 6, 1.0)
+    assert r.get(0x20, 100, 1, 1.0) is None
@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Tests of lib/sercom_log.py.
+# Version 2
+#
+import pytest
+
+import sercom_log as log
+
+@pytest.fixture(autouse=True)
+def logger():
+    log.set_level(log.INFO)
+    log.echo = False
+    log.set_ring(4)
+    yield log
+    log.set_level(log.INFO)
+    log.echo = True
+    log.set_ring(0)
+
+class Fmt:
+    """An argument that counts how often it is formatted."""
+    n = 0
+
+    def __format__(self, spec):
+        Fmt.n += 1
+        return 'x'
+
+def test_levels():
+    log.debug("t(): ", "debug")
+    log.info("t(): ", "info")
+    log.warning("t(): ", "warning")
+    log.error("t(): ", "error")
+    assert [s.split()[-1] for s in log.lines()] == ['info', 'warning', 'error']
+    log.set_level(log.OFF)
+    log.error("t(): ", "error")
+    assert len(log.lines()) == 3
+    assert log.enabled(log.OFF)
+    assert not log.enabled(log.ERROR)
+
+def test_lazy_format():
+    Fmt.n = 0
+    log.debug("t(): ", "value {}", Fmt())
+    assert Fmt.n == 0
+    log.info("t(): ", "value {}", Fmt())
+    assert Fmt.n == 1
+    assert log.lines()[-1].endswith("value x")
+
+def test_no_args_no_format():
+    log.info("t(): ", "braces {} kept")
+    assert log.lines()[-1].endswith("braces {} kept")
+
+def test_tag_padding():
+    log.tag_le_max = 8
+    try:
+        log.info("ab(): ", "m")
+        log.info("abcdefgh(): ", "m")
+    finally:
+        log.tag_le_max = 20
+    assert log.lines() == ["ab():   m", "abcdefgh(): m"]
+
+def test_ring_wraps():
+    for k in range(6):
+        log.info("t(): ", "{}", k)
+    assert [s.split()[-1] for s in log.lines()] == ['2', '3', '4', '5']
+
+def test_no_ring(capsys):
+    log.set_ring(0)
+    log.echo = True
+    log.info("t(): ", "shown")
+    assert log.lines() == []
+    assert capsys.readouterr().out.rstrip().endswith("shown")
@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Tests of lib/sercom_nvm.py: the ring of time records.
+# Version 2
+#
+import sercom_nvm as nvs
+
+OFS = 16
+N_SLOTS = 4
+
+def blank():
+    return bytearray(b'\xff' * (OFS + N_SLOTS * nvs.SLOT_LEN + 8))
+
+def test_empty():
+    nvm = blank()
+    assert nvs.start(nvm, OFS, N_SLOTS) is None
+    nvm = bytearray(len(nvm))
+    assert nvs.start(nvm, OFS, N_SLOTS) is None
+
+def test_too_small():
+    assert nvs.start(bytearray(OFS + 8), OFS, N_SLOTS) is None
+    assert not nvs.save(1, nvs.SYNCED)
+
+def test_save_restart():
+    nvm = blank()
+    nvs.start(nvm, OFS, N_SLOTS)
+    assert nvs.save(1_700_000_000, nvs.SYNCED)
+    assert nvs.start(nvm, OFS, N_SLOTS) == (1_700_000_000, nvs.SYNCED)
+    assert nvm[:OFS] == b'\xff' * OFS  # nothing written before ofs
+    assert nvm[OFS + N_SLOTS * nvs.SLOT_LEN:] == b'\xff' * 8
+
+def test_wraparound():
+    nvm = blank()
+    nvs.start(nvm, OFS, N_SLOTS)
+    for k in range(2 * N_SLOTS + 1):
+        nvs.save(1000 + k)
+        assert nvs.start(nvm, OFS, N_SLOTS) == (1000 + k, 0)
+    # the last N_SLOTS records are all kept, one per slot
+    epochs = set()
+    for s in range(N_SLOTS):
+        i = OFS + s * nvs.SLOT_LEN
+        assert nvm[i + nvs.SLOT_LEN - 1] == nvs._chk(nvm, i)
+        epochs.add(int.from_bytes(nvm[i + 2:i + 6], 'big'))
+    assert epochs == set(range(1000 + N_SLOTS + 1, 1000 + 2 * N_SLOTS + 1))
+
+def test_seq_wraparound():
+    nvm = blank()
+    nvs.start(nvm, OFS, N_SLOTS)
+    last = 0x10000
+    for k in range(last + 1):
+        nvs.save(k)
+    # the ring holds the sequence numbers 0xFFFE, 0xFFFF, 0x0000 and 0x0001
+    seqs = {int.from_bytes(nvm[OFS + s * nvs.SLOT_LEN:OFS + s * nvs.SLOT_LEN + 2], 'big') for s in range(N_SLOTS)}
+    assert seqs == {0xFFFE, 0xFFFF, 0x0000, 0x0001}
+    assert nvs.start(nvm, OFS, N_SLOTS) == (last, 0)  # seq 0x0001 is newer than 0xFFFF
+
+def test_torn_slot():
+    nvm = blank()
+    nvs.start(nvm, OFS, N_SLOTS)
+    nvs.save(3000, nvs.SYNCED)
+    nvs.save(3001, nvs.SYNCED)
+    # a power loss while the next record was written: half of it reached the NVM
+    i = OFS + 2 * nvs.SLOT_LEN
+    nvm[i:i + 4] = b'\x00\x03\x00\x00'
+    assert nvs.start(nvm, OFS, N_SLOTS) == (3001, nvs.SYNCED)
+    # the next save() goes to the torn slot and is found again
+    nvs.save(3002)
+    assert nvs.start(nvm, OFS, N_SLOTS) == (3002, 0)
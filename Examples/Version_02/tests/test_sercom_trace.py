@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: Copyright (c) 2022 Paulus Schulinck @PaulskPt
+#
+# SPDX-License-Identifier: MIT
+#
+# Serial communication via I2C (alias: 'Sercom I2C')
+# Tests of lib/sercom_trace.py.
+# Version 2
+#
+import struct
+
+import pytest
+
+import sercom_trace as trc
+
+@pytest.fixture(autouse=True)
+def trace():
+    trc.enabled = False
+    trc.n_lost = 0
+    trc.n_flush = 0
+    yield trc
+    trc.enabled = False
+
+def records(raw):
+    """The address and the records (dir, bytes) of a trace."""
+    assert raw[:4] == trc.MAGIC
+    recs = []
+    t_prev = 0
+    i = 5
+    while i < len(raw):
+        t, d, n = struct.unpack_from("<IBB", raw, i)
+        assert t >= t_prev
+        t_prev = t
+        recs.append((d, raw[i + 6:i + 6 + n]))
+        i += 6 + n
+    assert i == len(raw)
+    return raw[4], recs
+
+def joined(recs, d):
+    return b''.join(b for dd, b in recs if dd == d)
+
+def test_not_started():
+    trc.rx(b'abc', 3)
+    assert trc.n_lost == 3
+
+def test_file(tmp_path):
+    path = tmp_path / 'trace.bin'
+    trc.start(64, str(path), 0x25)
+    big = bytes(range(256)) * 2
+    trc.rx(b'request', 7)
+    trc.tx(big, 300)  # more than the buffer: split over several records and batches
+    trc.rx(b'ab', 1)
+    trc.flush()
+    assert trc.n_flush > 1
+    ads, recs = records(path.read_bytes())
+    assert ads == 0x25
+    assert joined(recs, trc.RX) == b'requesta'
+    assert joined(recs, trc.TX) == big[:300]
+    assert all(len(b) <= 64 - trc.HDR_LEN for _, b in recs)
+
+def test_repl(tmp_path, capsys):
+    trc.start(32, str(tmp_path / 'no_such_folder' / 'trace.bin'), 0x20)
+    trc.tx(b'\x25\x20\x00\x02\x64\x01\x8c', 7)
+    trc.flush()
+    out = capsys.readouterr().out
+    hexs = [s[4:] for s in out.splitlines() if s.startswith('TRC:')]
+    ads, recs = records(bytes.fromhex(''.join(hexs)))
+    assert ads == 0x20
+    assert recs == [(trc.TX, b'\x25\x20\x00\x02\x64\x01\x8c')]
+
+def test_flush_empty(tmp_path):
+    trc.start(32, str(tmp_path / 'trace.bin'))
+    trc.flush()
+    assert trc.n_flush == 0